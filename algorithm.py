@@ -7,14 +7,74 @@ Created on Thu May 31 15:44:57 2018
 
 from individual import Individual
 from level import Level
-from search import WorldGraph, a_star_search
+from search import SearchBudgetExceeded, WorldGraph, a_star_search, reconstruct_path
 from world import World
+from evaluators import LocalEvaluator
+from surrogate import SurrogateScreen
+from diversity import DiversityFilter
+from checkpoint import checkpoint_trajectory, load_checkpoint, restore_random_states, save_checkpoint
+from profiling import GenerationProfiler
+import itertools
+import logging
+import numpy as np
 import operator
-import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# Fitness of a level A* gave up on (see `budgetExceededResult()`).
+BUDGET_EXCEEDED_FITNESS = 0.5
+
+"""
+Fitness of a level: the number of A* steps needed to solve it (0 if A* fails, `BUDGET_EXCEEDED_FITNESS` if A* gives
+up)
+Returns the fitness, the solution path (or None) and search statistics, including the per-cell expansion counts of
+A* (under "heatmap") if `heatmap` is True
+"""
+def levelFitness(level, max_steps=None, heatmap=False):
+    start_time = time.perf_counter()
+    world = World(level)
+    state = world.init_state
+    exit_position, exit_cell = level.get_exit()
+    stats = dict(n_steps=0, n_nodes=0)
+    if heatmap:
+        stats['heatmap'] = np.zeros(level.cells.shape, dtype=np.uint32)
+
+    #Calculate the cost of traversing the level
+    try:
+        came_from, cost_so_far, current, n_steps = a_star_search(
+        graph=WorldGraph(world), start=state,
+            exit_definition=exit_position,
+            extract_definition=world.get_player_position,
+            max_steps=max_steps, heatmap=stats.get('heatmap'))
+    except SearchBudgetExceeded:
+        stats.update(seconds=time.perf_counter() - start_time)
+        return budgetExceededResult(max_steps, stats)
+    except OverflowError:
+        # A* failure.
+        stats.update(seconds=time.perf_counter() - start_time)
+        return 0, None, stats
+
+    # Keep the solution so that it can be shipped along with the level.
+    solution = [world.get_player_position(state) for state in reconstruct_path(came_from, current)]
+    stats.update(n_steps=n_steps, n_nodes=len(came_from), seconds=time.perf_counter() - start_time)
+    return n_steps, solution, stats
+
+"""
+Fitness, solution and search statistics (`stats`) of a level harder than the A* step budget `max_steps` allows (or
+taking too long to evaluate). Without a solution it cannot be delivered, so its fitness ranks it below every solved
+level (which took at least one step), though above invalid ones
+"""
+def budgetExceededResult(max_steps, stats):
+    stats['n_steps'] = max_steps or 0
+    return BUDGET_EXCEEDED_FITNESS, None, stats
 
 class Algorithm:
+
+    # Smallest A* step budget used when adapting to a delivery period.
+    MIN_SEARCH_BUDGET = 1000
       
-    def __init__(self, trajectory, width, height, population_size, generations, chromosome_size, mutation_probability=0.5, tournament_size = 5):
+    def __init__(self, trajectory, width, height, population_size, generations, chromosome_size, mutation_probability=0.5, tournament_size = 5, evaluator = None, steady_state = False, min_population_size = 4, max_population_size = None, screen_fraction = None, guided_mutation = None, dedup_distance = None, rng = None):
         self.population = []
         self.population_size = population_size
         self.generations = generations
@@ -26,7 +86,44 @@ class Algorithm:
         self.level_width = width
         self.level_height = height
         self.best = None
-        self.best_generations = []
+        # Id of the next new individual.
+        self.next_id = 0
+        # Source of all random numbers of the algorithm: a numpy `RandomState` (for reproducible runs), or by default
+        # `numpy.random`.
+        self.rng = np.random if rng is None else rng
+        # Where fitnesses are computed (in this process by default).
+        if evaluator is None:
+            evaluator = LocalEvaluator(self.calculateFitness)
+        # Optional pre-screening: only the most promising fraction of candidates (according to a cheap surrogate) get a
+        # full A* evaluation.
+        if screen_fraction is not None:
+            evaluator = SurrogateScreen(evaluator, keep_fraction=screen_fraction)
+        # Optional diversity control: duplicates are not evaluated again, and clones (within `dedup_distance` cells of
+        # another individual) are penalised.
+        self.diversity = None
+        if dedup_distance is not None:
+            evaluator = self.diversity = DiversityFilter(evaluator, near_distance=dedup_distance)
+        self.evaluator = evaluator
+        # Guided mutation: None (uniform), "heat" (where A* expanded most) or "path" (close to the solution).
+        if guided_mutation not in (None, 'heat', 'path'):
+            raise ValueError(guided_mutation)
+        self.guided_mutation = guided_mutation
+        self.evaluator.set_record_heatmaps(guided_mutation == 'heat')
+        # Steady-state mode: offspring replace the worst individuals as soon as they are evaluated.
+        self.steady_state = steady_state
+        self.generation = 0
+        self.evaluations = 0
+        # Whether the population was restored from a checkpoint (see `resume()`), rather than to be initialized.
+        self.restored = False
+        # Online measurements and adaptation (see `run()`).
+        self.throughput = None
+        self.max_steps = None
+        # Phase timings and rejection counts of the current generation (see `run()`).
+        self.profiler = GenerationProfiler()
+        self.min_population_size = max(min_population_size, tournament_size)
+        if max_population_size is None:
+            max_population_size = 10 * population_size
+        self.max_population_size = max_population_size
           
     """
     Test get population
@@ -40,16 +137,26 @@ class Algorithm:
     """
     def initializePopulation(self):
         for i in range(self.population_size):
-            self.population.append(Individual(i, self.chromosome_size, self.trajectory))
+            self.population.append(self.newIndividual())
         return
+
+    """
+    A new random individual, with a new id
+    """
+    def newIndividual(self):
+        individual = Individual(self.next_id, self.chromosome_size, self.trajectory, rng=self.rng)
+        self.next_id += 1
+        return individual
     
     
     """
-    Evaluate the whole population by the fitness function
+    Evaluate the individuals of the population that are new or changed since their last evaluation (the others keep
+    their fitness)
     """
     def evaluatePopulation(self):
-        for individual in self.population:
-            individual.setFitness(self.calculateFitness(individual))
+        unevaluated = [individual for individual in self.population if not individual.evaluated]
+        self.evaluator.evaluate(unevaluated)
+        self.evaluations += len(unevaluated)
 #            print("fitness is = " + str(individual.getFitness()))
 #            individual.getPhenotype().level.print()
         self.population.sort(key=operator.attrgetter('fitness'), reverse=True)
@@ -58,23 +165,9 @@ class Algorithm:
     Fitness FUNCTION!
     """
     def calculateFitness(self, individual):
-        #print("calculating...")
-        phen = individual.getPhenotype()
-        world = World(phen.level)
-        state = world.init_state
-        exit_position, exit_cell = phen.level.get_exit()
-        
-        #Calculate the cost of traversing the level
-        try:
-            came_from, cost_so_far, current, n_steps = a_star_search(
-            graph=WorldGraph(world), start=state,
-                exit_definition=exit_position,
-                extract_definition=world.get_player_position)
-        except OverflowError:
-            # A* failure.
-            return 0
-
-        return n_steps
+        fitness, individual.solution, individual.stats = levelFitness(individual.getPhenotype().level, self.max_steps,
+                                                                      self.guided_mutation == 'heat')
+        return fitness
         
     """
     Select individuals doing tournament selection and reproduce the parents
@@ -84,18 +177,54 @@ class Algorithm:
         #print("Select from the whole population and create offsprings half the size... Tournament selection")
         
         while(len(offsprings) < self.offspring_size):
-            parents = random.sample(self.population, self.tournament_size)
-            parents.sort(key=operator.attrgetter('fitness'), reverse=True)
-            offsprings.extend(parents[0].crossover(parents[1]))
+            offsprings.extend(self.breed())
             
         return offsprings
+
+    """
+    Tournament selection of two parents, and their crossover
+    """
+    def breed(self):
+        chosen = self.rng.choice(len(self.population), self.tournament_size, replace=False)
+        parents = [self.population[i] for i in chosen]
+        parents.sort(key=operator.attrgetter('fitness'), reverse=True)
+        return parents[0].crossover(parents[1], self.rng, self.profiler.counts)
     
     """
     Mutate all population by mutation probability
     """
     def mutatePopulation(self):
         for individual in self.population:
-            individual.mutateAll(self.mutation_probability)
+            self.mutateIndividual(individual)
+
+    """
+    Mutate one individual, uniformly or guided by its last evaluation
+    """
+    def mutateIndividual(self, individual):
+        weights = self.mutationWeights(individual)
+        if weights is None:
+            individual.mutateAll(self.mutation_probability, self.rng, self.profiler.counts)
+        else:
+            individual.mutateGuided(self.mutation_probability, weights, self.rng, self.profiler.counts)
+
+    """
+    Per-cell mutation weights from the individual's last evaluation (None if unavailable or not guided):
+    the A* expansion counts ("heat", plus one so that any cell may mutate), or the inverse of the distance to the
+    solution path
+    """
+    def mutationWeights(self, individual):
+        if self.guided_mutation == 'heat' and individual.stats and 'heatmap' in individual.stats:
+            weights = individual.stats['heatmap'] + 1.0
+        elif self.guided_mutation == 'path' and individual.solution:
+            xs, ys = np.indices((self.level_width, self.level_height))
+            path = np.array(individual.solution)
+            distances = (np.abs(xs.T[..., None] - path[:, 0]) + np.abs(ys.T[..., None] - path[:, 1])).min(axis=2)
+            weights = 1.0 / (1.0 + distances)
+        else:
+            return None
+        # The border is fixed.
+        weights[0, :] = weights[-1, :] = weights[:, 0] = weights[:, -1] = 0
+        return weights
     
     def replaceIndividuals(self, new_individuals):
         #print("Replace the half of the individuals? ... 50% elitism")
@@ -104,48 +233,295 @@ class Algorithm:
              del new_individuals[len(new_individuals) - 1]
 
         #print(len(new_individuals))
-        self.population[self.offspring_size : len(self.population)] = new_individuals
+        # The offspring replace the worst individuals, keeping the size of the population (which may be odd, see
+        # `resizePopulation()`).
+        self.population[len(self.population) - len(new_individuals) : len(self.population)] = new_individuals
         
     """
-    Print the current best individual
+    Best individuals as (packed genome, fitness, solution, search statistics) tuples, to be sent to another island
     """
-    def printBestIndividual(self):
-        print("BEST INDIVIDUAL IS: " + 
-              str(self.population[0].individualID()) + 
-              " with a fitness of: " + 
-              str(self.population[0].getFitness()))
-        
+    def emigrants(self, count):
+        return [(individual.getGenotype().pack(), individual.getFitness(), individual.solution, individual.stats)
+                for individual in self.population[:count]]
+
+    """
+    Replace the worst individuals by migrants from another island, given as returned by `emigrants()`
+    Migrants that were not searched (e.g. only pre-screened, see `SurrogateScreen`) are evaluated with the next
+    generation, so that an island's best level always comes with its solution
+    """
+    def immigrate(self, migrants):
+        migrants = migrants[:len(self.population)]
+        for i, (packed_genome, fitness, solution, stats) in enumerate(migrants):
+            replaced = self.population[len(self.population) - 1 - i]
+            individual = Individual(replaced.individualID(), self.chromosome_size, self.trajectory, packed_genome)
+            if stats is not None:
+                individual.setFitness(fitness)
+                individual.solution = solution
+                individual.stats = stats
+            self.population[len(self.population) - 1 - i] = individual
+        self.population.sort(key=operator.attrgetter('fitness'), reverse=True)
+
+    """
+    Save the population, trajectory, counters and random states to `path` (see `checkpoint.py`)
+    """
+    def checkpoint(self, path):
+        save_checkpoint(path, self)
+
+    """
+    Restore the state saved by `checkpoint()`, so that `run()` carries on from there instead of starting from a new
+    random population
+    """
+    def resume(self, path):
+        checkpoint = load_checkpoint(path)
+        self.trajectory = checkpoint_trajectory(checkpoint)
+        self.level_width, self.level_height = self.trajectory.level_width, self.trajectory.level_height
+        self.population = []
+        # Individuals of checkpoints saved before evaluation flags were kept are evaluated again.
+        evaluated = checkpoint.get('evaluated', np.zeros(len(checkpoint['ids']), dtype=bool))
+        candidates = checkpoint.get('candidates', np.zeros(len(checkpoint['ids']), dtype=bool))
+        for individual_id, packed_genome, fitness, is_evaluated, is_candidate in zip(
+                checkpoint['ids'], checkpoint['genomes'], checkpoint['fitnesses'], evaluated, candidates):
+            individual = Individual(int(individual_id), self.chromosome_size, self.trajectory, packed_genome.tobytes())
+            individual.setFitness(float(fitness))
+            individual.evaluated = bool(is_evaluated)
+            individual.candidate = bool(is_candidate)
+            self.population.append(individual)
+        self.population.sort(key=operator.attrgetter('fitness'), reverse=True)
+        self.next_id = max(int(individual_id) for individual_id in checkpoint['ids']) + 1
+        generation, evaluations, population_size, max_steps = (int(x) for x in checkpoint['counters'])
+        self.generation = generation
+        self.evaluations = evaluations
+        self.population_size = population_size
+        self.offspring_size = population_size//2
+        self.max_steps = None if max_steps < 0 else max_steps
+        self.evaluator.set_search_budget(self.max_steps)
+        restore_random_states(checkpoint, self.rng)
+        self.restored = True
+
+    """
+    Remember and log (at the INFO level) the current best individual
+    """
+    def logBestIndividual(self):
         self.best = self.population[0]
-        self.best_generations.append(str("BEST INDIVIDUAL IS: " + 
-              str(self.population[0].individualID()) + 
-              " with a fitness of: " + 
-              str(self.population[0].getFitness())))
-#        print(self.population[0].getGenotype().chromosomes)
-        #self.population[0].getPhenotype().level.print()
-        
-    def printBestGenerations(self):
-        print(self.best_generations)
+        logger.info('Generation %d: best individual is %d with a fitness of %s', self.generation,
+                    self.best.individualID(), self.best.getFitness())
+
+    """
+    Grow (with new random individuals) or shrink (dropping the worst individuals) the population
+    New individuals are evaluated before joining the population: right away in generational mode, and asynchronously
+    with the offspring in steady-state mode (see `runSteadyState()`)
+    """
+    def resizePopulation(self, size):
+        size = max(size, 2)
+        new_individuals = [self.newIndividual() for i in range(size - len(self.population))]
+        del self.population[size:]
+        self.population_size = size
+        self.offspring_size = size//2
+        if self.steady_state:
+            for individual in new_individuals:
+                self.evaluator.submit(individual)
+        elif new_individuals:
+            self.evaluator.evaluate(new_individuals)
+            self.evaluations += len(new_individuals)
+            self.population.extend(new_individuals)
+            self.population.sort(key=operator.attrgetter('fitness'), reverse=True)
+
+    """
+    Stop criteria and online adaptation, checked once per generation (right after the best individual was yielded)
+    Returns True if the run should stop
+    """
+    def endGeneration(self):
+        now = time.perf_counter()
+        elapsed = now - self.generation_start_time
+        if elapsed > 0:
+            throughput = (self.evaluations - self.generation_start_evaluations) / elapsed
+            if self.throughput is None:
+                self.throughput = throughput
+            else:
+                self.throughput = 0.5 * self.throughput + 0.5 * throughput
+        self.generation_start_time = now
+        self.generation_start_evaluations = self.evaluations
+
+        if self.best_fitness is None or self.population[0].getFitness() > self.best_fitness:
+            self.best_fitness = self.population[0].getFitness()
+            self.stagnant_generations = 0
+        else:
+            self.stagnant_generations += 1
+
+        if self.stopRequested():
+            return True
+        if self.stagnation_generations is not None and self.stagnant_generations >= self.stagnation_generations:
+            return True
+
+        if self.delivery_period is not None:
+            self.adaptToDeliveryPeriod()
+        return False
+
+    """
+    Whether the run must stop now: its stop event is set, or its time budget is spent
+    """
+    def stopRequested(self):
+        if self.stop_event is not None and self.stop_event.is_set():
+            return True
+        return self.time_budget is not None and time.perf_counter() - self.start_time >= self.time_budget
+
+    """
+    Size the population so that a new best level is delivered every `delivery_period` seconds at the measured
+    throughput, and cap A* so that a single evaluation cannot take more than half of that period
+    """
+    def adaptToDeliveryPeriod(self):
+        if self.throughput:
+            evaluations = self.throughput * self.delivery_period
+            # A generation evaluates the whole population, or only the offspring in steady-state mode.
+            size = int(2 * evaluations if self.steady_state else evaluations)
+            size = min(max(size, self.min_population_size), self.max_population_size)
+            if size != self.population_size:
+                self.resizePopulation(size)
+        seconds = sum(individual.stats['seconds'] for individual in self.population if individual.stats)
+        steps = sum(individual.stats['n_steps'] for individual in self.population if individual.stats)
+        if seconds > 0 and steps > 0:
+            self.max_steps = max(int(steps / seconds * self.delivery_period / 2), self.MIN_SEARCH_BUDGET)
+            self.evaluator.set_search_budget(self.max_steps)
 
     """
     Runs the algorithm one generation at a time.
+
+    time_budget: stop after this many seconds (checked once per generation, and while waiting for evaluations in
+        steady-state mode)
+    delivery_period: target number of seconds between two generations (i.e. two delivered levels); the population
+        size and the A* step budget are adapted online to the measured throughput to match it
+    stagnation_generations: stop when the best fitness did not improve for this many generations
+    checkpoint_path: if not None, save a checkpoint there every `checkpoint_period` generations (see `resume()`)
+    metrics_sink: callable receiving the record of each generation (phase timings, evaluation and rejection counts,
+        memory, see `profiling.py`), or a list of them
+    profile_generation: if not None, profile the phases of this generation with cProfile, saving the profile to
+        `profile_path`
+    stop_event: if not None, stop as soon as this event (e.g. a `multiprocessing.Event`) is set; like the time budget,
+        it is also checked while waiting for evaluations in steady-state mode
     """
-    def run(self):
-        self.initializePopulation()
-        print("dsdsds")
-        for i in range(self.generations):
-            self.evaluatePopulation()
+    def run(self, time_budget=None, delivery_period=None, stagnation_generations=None, checkpoint_path=None,
+            checkpoint_period=10, metrics_sink=None, profile_generation=None, profile_path=None, stop_event=None):
+        if metrics_sink is None:
+            metrics_sink = []
+        elif callable(metrics_sink):
+            metrics_sink = [metrics_sink]
+        self.profiler = GenerationProfiler(metrics_sink, profile_generation, profile_path)
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_period = checkpoint_period
+        self.time_budget = time_budget
+        self.stop_event = stop_event
+        self.delivery_period = delivery_period
+        self.stagnation_generations = stagnation_generations
+        self.start_time = self.generation_start_time = time.perf_counter()
+        self.generation_start_evaluations = self.evaluations
+        self.best_fitness = None
+        self.stagnant_generations = 0
+        if self.steady_state:
+            return self.runSteadyState()
+        return self.runGenerational()
+
+    def generationRange(self):
+        if self.generations is None:
+            return itertools.count(self.generation)
+        return range(self.generation, self.generations)
+
+    """
+    Count one more generation, and save a checkpoint if one is due
+    """
+    def nextGeneration(self):
+        self.generation += 1
+        if self.checkpoint_path is not None and self.generation % self.checkpoint_period == 0:
+            self.checkpoint(self.checkpoint_path)
+
+    def runGenerational(self):
+        if not self.restored:
+            self.initializePopulation()
+        profiler = self.profiler
+        for i in self.generationRange():
+            profiler.start_generation(self.generation, self.evaluations)
+            with profiler.phase('evaluate'):
+                self.evaluatePopulation()
             # TODO Check if the returned individual needs to be (deep-)copied to ensure operations below keep it intact.
-            yield self.population[0].getPhenotype().level, self.population[0].fitness
-            self.printBestIndividual()
-            offsprings = self.selectIndividuals()
-            self.replaceIndividuals(offsprings)
-            self.mutatePopulation()
+            yield self.population[0].getPhenotype().level, self.population[0].fitness, self.population[0].solution
+            self.logBestIndividual()
+            if self.endGeneration():
+                profiler.end_generation(self)
+                return
+            with profiler.phase('select'):
+                offsprings = self.selectIndividuals()
+            with profiler.phase('replace'):
+                self.replaceIndividuals(offsprings)
+            with profiler.phase('mutate'):
+                self.mutatePopulation()
+            profiler.end_generation(self)
+            self.nextGeneration()
+
+        profiler.start_generation(self.generation, self.evaluations)
+        with profiler.phase('evaluate'):
+            self.evaluatePopulation()
+        yield self.population[0].getPhenotype().level, self.population[0].fitness, self.population[0].solution
+        profiler.end_generation(self)
+
+    """
+    Steady-state variant: offspring are bred and mutated (elites are left alone), evaluated asynchronously, and each one
+    replaces the worst individual as soon as its result arrives, if it is at least as fit (or joins the population if
+    it is smaller than `population_size`, after it grew, see `resizePopulation()`). Enough offspring are kept
+    in flight to keep every evaluation worker busy. A "generation" is `offspring_size` evaluations, after which the
+    best individual is yielded, for the same total number of evaluations as the generational mode.
+    """
+    def runSteadyState(self):
+        profiler = self.profiler
+        if not self.restored:
+            # A restored population was evaluated already.
+            self.initializePopulation()
+            profiler.start_generation(self.generation, self.evaluations)
+            with profiler.phase('evaluate'):
+                self.evaluatePopulation()
+            yield self.population[0].getPhenotype().level, self.population[0].fitness, self.population[0].solution
+            if self.endGeneration():
+                profiler.end_generation(self)
+                return
 
-        self.evaluatePopulation()
-        yield self.population[0].getPhenotype().level, self.population[0].fitness
+        for i in self.generationRange():
+            if profiler.start_time is None:
+                # The first generation also includes the evaluation of the initial population.
+                profiler.start_generation(self.generation, self.evaluations)
+            evaluated = 0
+            while evaluated < self.offspring_size:
+                while self.evaluator.pending() < 2 * self.evaluator.capacity():
+                    with profiler.phase('select'):
+                        offsprings = self.breed()
+                    for offspring in offsprings:
+                        with profiler.phase('mutate'):
+                            self.mutateIndividual(offspring)
+                        with profiler.phase('evaluate'):
+                            self.evaluator.submit(offspring)
+                with profiler.phase('evaluate'):
+                    completed = self.evaluator.completed(timeout=1)
+                with profiler.phase('replace'):
+                    for offspring in completed:
+                        evaluated += 1
+                        self.evaluations += 1
+                        if len(self.population) < self.population_size:
+                            self.population.append(offspring)
+                        elif offspring.getFitness() >= self.population[-1].getFitness():
+                            self.population[-1] = offspring
+                        else:
+                            continue
+                        self.population.sort(key=operator.attrgetter('fitness'), reverse=True)
+                if self.stopRequested():
+                    # Do not wait for the rest of the generation (e.g. when evaluations are slow or stalled).
+                    profiler.end_generation(self)
+                    return
+            yield self.population[0].getPhenotype().level, self.population[0].fitness, self.population[0].solution
+            self.logBestIndividual()
+            profiler.end_generation(self)
+            if self.endGeneration():
+                return
+            self.nextGeneration()
 
 #trajectory = RandomWalkTrajectory(40, 30)
 #evolutionaryAlgorithm = Algorithm(trajectory, width=40, height=30, population_size=10, generations=10, chromosome_size=100)
 #evolutionaryAlgorithm.run()
-#evolutionaryAlgorithm.printBestIndividual()
+#evolutionaryAlgorithm.logBestIndividual()
 
@@ -0,0 +1,248 @@
+"""
+Micro-benchmarks of the world and search hot paths.
+
+Each benchmark runs on a fixed-seed corpus of levels (see `CASES`), so that timings can be compared across changes:
+
+    python benchmark.py                          # all benchmarks on all levels
+    python benchmark.py a_star_search --cases large --json baseline.json
+
+For each benchmark and level, the best of `--repeat` runs is reported in operations per second (plus A* expansions
+per second for `a_star_search`), along with the peak memory allocated during one run (measured separately with
+`tracemalloc`, which slows code down).
+"""
+
+import argparse
+import collections
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from genotype import Genotype
+from level import CellType, Level
+from search import WorldGraph, a_star_search, reconstruct_path
+from trajectory import RandomWalkTrajectory
+from world import Action, World
+
+
+# A benchmark level: its size, the density passed to `Level.generate_valid()`, then the fraction of the remaining
+# free cells (off the trajectory) turned into blocks, and then into items.
+LevelCase = collections.namedtuple('LevelCase', ['width', 'height', 'density', 'blocks', 'items'])
+
+CASES = collections.OrderedDict([
+    ('easy', LevelCase(30, 20, 0.1, 0.0, 0.0)),
+    ('corridors', LevelCase(30, 20, 0.9, 0.9, 0.0)),
+    ('items', LevelCase(30, 20, 0.6, 0.0, 0.1)),
+    ('large', LevelCase(80, 60, 0.5, 0.5, 0.0)),
+])
+
+SEED = 2018
+
+# Maximum number of states used by the `perform` and `neighbors` benchmarks.
+N_STATES = 1000
+
+
+def make_level(case, seed=SEED):
+    """
+    Build the benchmark level described by `case` (a `LevelCase`), always the same for a given seed.
+
+    :return: A tuple `(level, trajectory)`, where `trajectory` is a valid way out of the level.
+    """
+    py_rng = random.Random(seed)
+    rng = np.random.RandomState(seed)
+    trajectory = RandomWalkTrajectory(case.width, case.height, rng=py_rng)
+    level = Level(case.width, case.height)
+    level.generate_valid(trajectory, case.density, rng=rng)
+
+    # Cells off the trajectory may take any type without making it invalid.
+    free = level.cells == CellType.EMPTY
+    free[0, :] = free[-1, :] = free[:, 0] = free[:, -1] = False
+    for x, y in trajectory.get_traversed_cells():
+        free[y, x] = False
+    free = np.flatnonzero(free)
+    rng.shuffle(free)
+    n_blocks = int(case.blocks * len(free))
+    n_items = int(case.items * len(free))
+    level.cells.flat[free[:n_blocks]] = CellType.BLOCK
+    level.cells.flat[free[n_blocks:n_blocks + n_items]] = rng.choice([CellType.WINE, CellType.CHEESE], size=n_items)
+    return level, trajectory
+
+
+def _search(world, max_steps=None):
+    return a_star_search(graph=WorldGraph(world), start=world.init_state,
+                         exit_definition=world.level.get_exit()[0],
+                         extract_definition=world.get_player_position, max_steps=max_steps)
+
+
+def _sample_states(world):
+    # States reached by A* (the most common inputs of `perform` and `neighbors`), in a fixed order.
+    came_from, cost_so_far, current, n_steps = _search(world)
+    states = list(came_from)
+    return states[:N_STATES] + reconstruct_path(came_from, current)
+
+
+# Each benchmark is built from a level and its trajectory, and returns a function running it once, which returns
+# `(number of operations, number of A* expansions or None)`.
+
+def bench_world_init(level, trajectory):
+    def run():
+        World(level)
+        return 1, None
+    return run
+
+
+def bench_world_perform(level, trajectory):
+    world = World(level)
+    states = _sample_states(world)
+    actions = list(Action)
+
+    def run():
+        perform = world.perform
+        for state in states:
+            for action in actions:
+                perform(state, action)
+        return len(states) * len(actions), None
+    return run
+
+
+def bench_validate_trajectory(level, trajectory):
+    world = World(level)
+
+    def run():
+        assert world.validate_trajectory(trajectory)
+        return 1, None
+    return run
+
+
+def bench_neighbors(level, trajectory):
+    graph = WorldGraph(World(level))
+    states = _sample_states(graph.world)
+
+    def run():
+        for state in states:
+            graph.neighbors(state)
+        return len(states), None
+    return run
+
+
+def bench_a_star_search(level, trajectory):
+    world = World(level)
+
+    def run():
+        came_from, cost_so_far, current, n_steps = _search(world)
+        return 1, n_steps
+    return run
+
+
+def bench_get_phenotype(level, trajectory):
+    genotype = Genotype()
+    genotype.fromChromosomes(level.cells.flatten(), trajectory)
+
+    def run():
+        genotype.getPhenotype()
+        return 1, None
+    return run
+
+
+BENCHMARKS = collections.OrderedDict([
+    ('world_init', bench_world_init),
+    ('world_perform', bench_world_perform),
+    ('validate_trajectory', bench_validate_trajectory),
+    ('neighbors', bench_neighbors),
+    ('a_star_search', bench_a_star_search),
+    ('get_phenotype', bench_get_phenotype),
+])
+
+
+def measure(run, min_time=0.2, repeat=3):
+    """
+    Time `run` (as returned by a benchmark).
+
+    Each of the `repeat` runs calls `run` until `min_time` seconds have passed, and the fastest one is kept.
+
+    :return: A dict with the number of operations and A* expansions per second, and the peak memory (in bytes)
+        allocated by one call.
+    """
+    best = None
+    for i in range(repeat):
+        n_calls = n_ops = n_expansions = 0
+        start_time = time.perf_counter()
+        while True:
+            ops, expansions = run()
+            n_calls += 1
+            n_ops += ops
+            n_expansions += expansions or 0
+            elapsed = time.perf_counter() - start_time
+            if elapsed >= min_time:
+                break
+        if best is None or n_ops / elapsed > best[0] / best[2]:
+            best = n_ops, n_expansions, elapsed, n_calls
+
+    tracemalloc.start()
+    try:
+        run()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    n_ops, n_expansions, elapsed, n_calls = best
+    return dict(ops_per_second=n_ops / elapsed,
+                expansions_per_second=n_expansions / elapsed if n_expansions else None,
+                expansions=n_expansions // n_calls if n_expansions else None,
+                peak_memory=peak)
+
+
+def run_benchmarks(names=None, cases=None, seed=SEED, min_time=0.2, repeat=3, verbose=True):
+    """
+    Run the benchmarks `names` (by default, all of them) on the levels `cases` (by default, all of them).
+
+    :return: A dict mapping `'<benchmark>/<case>'` to the results of `measure()`.
+    """
+    names = list(BENCHMARKS) if names is None else names
+    cases = list(CASES) if cases is None else cases
+    results = collections.OrderedDict()
+    for case_name in cases:
+        level, trajectory = make_level(CASES[case_name], seed)
+        if verbose:
+            print(f'{case_name}: {level.width}x{level.height} level {level.content_hash()}')
+        for name in names:
+            result = measure(BENCHMARKS[name](level, trajectory), min_time=min_time, repeat=repeat)
+            results[f'{name}/{case_name}'] = result
+            if verbose:
+                expansions = ''
+                if result['expansions'] is not None:
+                    expansions = (f', {result["expansions_per_second"]:,.0f} expansions/s '
+                                  f'({result["expansions"]} per search)')
+                print(f'  {name:<20} {result["ops_per_second"]:>14,.1f} ops/s{expansions}, '
+                      f'peak memory {result["peak_memory"] / 1024:,.1f} KiB')
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the world and search hot paths on fixed levels.')
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help=f'benchmarks to run (default: all of {", ".join(BENCHMARKS)})')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=None,
+                        help=f'levels to run them on (default: all of {", ".join(CASES)})')
+    parser.add_argument('--seed', type=int, default=SEED, help='seed of the benchmark levels')
+    parser.add_argument('--min-time', type=float, default=0.2, help='minimum duration of a run, in seconds')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs (the fastest one is reported)')
+    parser.add_argument('--json', default=None, help='also write the results to this JSON file')
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error(f'unknown benchmark {name!r} (choose from {", ".join(BENCHMARKS)})')
+
+    results = run_benchmarks(args.benchmarks or None, args.cases, seed=args.seed, min_time=args.min_time,
+                             repeat=args.repeat)
+    if args.json is not None:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(dict(seed=args.seed, results=results), f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
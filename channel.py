@@ -0,0 +1,178 @@
+"""
+Shared-memory channel carrying the latest best level from the optimizer to the game.
+"""
+
+import math
+import struct
+import time
+
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from level import Level
+
+
+class LatestLevelChannel:
+
+    """
+    Single-writer "latest value" slot in shared memory, protected by a sequence lock.
+
+    The writer (the optimizer process) overwrites the slot with each level it publishes, so a reader (the game) only
+    ever sees the most recent one. Checking whether something new was published costs a single integer read, and
+    reading it involves no unpickling: the level is stored in its packed format (see `Level.to_bytes()`).
+
+    A second, independent slot carries the optimizer's performance metrics (`publish_metrics()`, `read_metrics()`).
+    """
+
+    # Sequence counter: odd while the writer is updating the slot.
+    SEQUENCE = struct.Struct('<Q')
+    # Fitness, generation, packed level size in bytes, solution path length, publication time (`time.time()`).
+    META = struct.Struct('<dIIId')
+    # Optimizer metrics, in this order (NaN when unknown): throughput, then the phase timings and rejection rates of the
+    # last generation (see `profiling.record_metrics()`).
+    METRIC_NAMES = ('generations_per_second', 'evaluations_per_second', 'cache_hit_rate', 'expansions',
+                    'evaluate_seconds', 'select_seconds', 'replace_seconds', 'mutate_seconds',
+                    'crossover_rejection_rate', 'mutation_rejection_rate')
+    METRICS = struct.Struct('<' + 'd' * len(METRIC_NAMES))
+    # One (x, y) position of the solution path.
+    POSITION_DTYPE = np.uint16
+
+    def __init__(self, width, height, max_path_length=None, name=None):
+        """
+        Constructor.
+
+        :param width: Width of the levels that will be published.
+        :param height: Height of the levels that will be published.
+        :param max_path_length: Maximum number of positions in a published solution path (defaults to four times the
+            number of cells).
+        :param name: Name of an existing channel to attach to. If `None`, a new channel is created and this object
+            owns it (it will be destroyed by `close()`).
+        """
+        if max_path_length is None:
+            max_path_length = 4 * width * height
+        self.width = width
+        self.height = height
+        self.max_path_length = max_path_length
+        # Layout: metrics sequence, metrics, level sequence, meta, level, path.
+        self.metrics_sequence_offset = 0
+        self.metrics_offset = self.SEQUENCE.size
+        self.sequence_offset = self.metrics_offset + self.METRICS.size
+        self.meta_offset = self.sequence_offset + self.SEQUENCE.size
+        self.level_offset = self.meta_offset + self.META.size
+        self.max_level_size = Level.header.size + (width * height + 1) // 2
+        self.path_offset = self.level_offset + self.max_level_size
+        size = self.path_offset + max_path_length * 2 * np.dtype(self.POSITION_DTYPE).itemsize
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.shm.buf[:size] = bytes(size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.last_sequence = 0
+        # Metrics published by this writer so far.
+        self.metrics = dict.fromkeys(self.METRIC_NAMES, math.nan)
+        # Publication time of the level returned by the last successful `read()`.
+        self.published_at = None
+
+    def __reduce__(self):
+        # Other processes attach to the same shared memory block.
+        return LatestLevelChannel, (self.width, self.height, self.max_path_length, self.shm.name)
+
+    def _sequence(self, offset):
+        return self.SEQUENCE.unpack_from(self.shm.buf, offset)[0]
+
+    def publish(self, level, fitness, path=(), generation=0):
+        """
+        Overwrite the slot with a new level.
+
+        :param level: The level to publish.
+        :param fitness: Its fitness.
+        :param path: Its solution, as a sequence of (x, y) positions.
+        :param generation: The generation it was found at.
+        """
+        data = level.to_bytes()
+        path = np.asarray(path, dtype=self.POSITION_DTYPE).reshape(-1, 2)
+        if len(data) > self.max_level_size:
+            raise ValueError(f'level too large for this channel: {level.width}x{level.height}')
+        if len(path) > self.max_path_length:
+            raise ValueError(f'solution path too long for this channel: {len(path)}')
+        buf = self.shm.buf
+        sequence = self._sequence(self.sequence_offset) + 1
+        self.SEQUENCE.pack_into(buf, self.sequence_offset, sequence)
+        self.META.pack_into(buf, self.meta_offset, fitness, generation, len(data), len(path), time.time())
+        buf[self.level_offset:self.level_offset + len(data)] = data
+        buf[self.path_offset:self.path_offset + path.nbytes] = path.tobytes()
+        self.SEQUENCE.pack_into(buf, self.sequence_offset, sequence + 1)
+
+    def publish_metrics(self, **metrics):
+        """
+        Update the metrics slot. Keyword arguments are metrics from `METRIC_NAMES`; the others keep the values last
+        published through this object (NaN if none).
+        """
+        for name, value in metrics.items():
+            if name not in self.metrics:
+                raise ValueError(f'unknown metric: {name}')
+            self.metrics[name] = value
+        buf = self.shm.buf
+        sequence = self._sequence(self.metrics_sequence_offset) + 1
+        self.SEQUENCE.pack_into(buf, self.metrics_sequence_offset, sequence)
+        self.METRICS.pack_into(buf, self.metrics_offset, *(self.metrics[name] for name in self.METRIC_NAMES))
+        self.SEQUENCE.pack_into(buf, self.metrics_sequence_offset, sequence + 1)
+
+    def read_metrics(self):
+        """
+        Read the latest metrics.
+
+        :return: A dict of metrics (NaN when unknown), or `None` if the writer is in the middle of an update.
+        """
+        sequence = self._sequence(self.metrics_sequence_offset)
+        values = self.METRICS.unpack_from(self.shm.buf, self.metrics_offset)
+        if sequence % 2 == 1 or self._sequence(self.metrics_sequence_offset) != sequence:
+            return None
+        if sequence == 0:
+            return dict.fromkeys(self.METRIC_NAMES, math.nan)
+        return dict(zip(self.METRIC_NAMES, values))
+
+    def has_new(self):
+        """
+        Whether a level was published since the last successful `read()`.
+        """
+        return self._sequence(self.sequence_offset) != self.last_sequence
+
+    def read(self):
+        """
+        Read the latest published level, if it was not already read.
+
+        This never blocks: if the writer is in the middle of an update, `None` is returned and the next call will
+        try again.
+
+        :return: `None` if there is nothing new, or a tuple `(level, fitness, path, generation)`. Its publication time
+            is in `self.published_at`.
+        """
+        sequence = self._sequence(self.sequence_offset)
+        if sequence == self.last_sequence or sequence % 2 == 1:
+            return None
+        buf = self.shm.buf
+        fitness, generation, level_size, path_length, published_at = self.META.unpack_from(buf, self.meta_offset)
+        level_size = min(level_size, self.max_level_size)
+        path_length = min(path_length, self.max_path_length)
+        data = bytes(buf[self.level_offset:self.level_offset + level_size])
+        path_size = path_length * 2 * np.dtype(self.POSITION_DTYPE).itemsize
+        path_data = bytes(buf[self.path_offset:self.path_offset + path_size])
+        if self._sequence(self.sequence_offset) != sequence:
+            # The writer updated the slot while we were reading it.
+            return None
+        self.last_sequence = sequence
+        self.published_at = published_at
+        path = [tuple(position) for position in
+                np.frombuffer(path_data, dtype=self.POSITION_DTYPE).reshape(-1, 2).tolist()]
+        return Level.from_bytes(data), fitness, path, generation
+
+    def close(self):
+        """
+        Detach from the shared memory (and destroy it if this object created it).
+        """
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,89 @@
+"""
+Checkpoints of the genetic algorithm, so that long runs survive restarts.
+
+A checkpoint is a single uncompressed `.npz` file holding the population (packed genomes, fitnesses, and evaluation
+flags), the trajectory, the generation and evaluation counters, and the state of both random number generators
+(`random`, and the algorithm's numpy generator, `numpy.random` by default). It is written to a temporary file which
+then replaces the previous checkpoint, so that a crash while saving never leaves a truncated checkpoint behind.
+"""
+
+import os
+import random
+
+import numpy as np
+
+from trajectory import Trajectory
+
+
+def island_checkpoint_path(checkpoint_dir, island_id):
+    """
+    Checkpoint file of island `island_id` in `checkpoint_dir` (`None` if `checkpoint_dir` is `None`).
+    """
+    if checkpoint_dir is None:
+        return None
+    return os.path.join(checkpoint_dir, f'island-{island_id}.npz')
+
+
+def save_checkpoint(path, algorithm):
+    """
+    Atomically save the state of `algorithm` (an `Algorithm`) to `path`.
+    """
+    population = algorithm.population
+    trajectory = algorithm.trajectory
+    version, python_state, gauss_next = random.getstate()
+    numpy_state = algorithm.rng.get_state()
+    arrays = dict(
+        genomes=np.array([np.frombuffer(individual.getGenotype().pack(), dtype=np.uint8)
+                          for individual in population]),
+        fitnesses=np.array([individual.getFitness() for individual in population], dtype=np.float64),
+        ids=np.array([individual.individualID() for individual in population], dtype=np.int64),
+        evaluated=np.array([individual.evaluated for individual in population], dtype=bool),
+        candidates=np.array([individual.candidate for individual in population], dtype=bool),
+        counters=np.array([algorithm.generation, algorithm.evaluations, algorithm.population_size,
+                           -1 if algorithm.max_steps is None else algorithm.max_steps], dtype=np.int64),
+        level_size=np.array([trajectory.level_width, trajectory.level_height], dtype=np.int64),
+        trajectory_start=np.array(trajectory.start, dtype=np.int64),
+        trajectory_actions=np.array([int(action) for action in trajectory.actions], dtype=np.uint8),
+        python_rng=np.array(python_state, dtype=np.int64),
+        python_rng_extra=np.array([version, np.nan if gauss_next is None else gauss_next]),
+        numpy_rng_keys=numpy_state[1],
+        numpy_rng_extra=np.array(numpy_state[2:], dtype=np.float64),
+    )
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'wb') as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Load the checkpoint at `path`.
+
+    :return: A dict of arrays, as saved by `save_checkpoint()`.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def checkpoint_trajectory(checkpoint):
+    """
+    The trajectory saved in `checkpoint` (as returned by `load_checkpoint()`).
+    """
+    level_width, level_height = checkpoint['level_size']
+    return Trajectory.from_actions(int(level_width), int(level_height), checkpoint['trajectory_start'],
+                                   checkpoint['trajectory_actions'])
+
+
+def restore_random_states(checkpoint, rng=np.random):
+    """
+    Restore the state of `random` and of the numpy generator `rng` saved in `checkpoint`.
+    """
+    version, gauss_next = checkpoint['python_rng_extra']
+    random.setstate((int(version), tuple(int(x) for x in checkpoint['python_rng']),
+                     None if np.isnan(gauss_next) else float(gauss_next)))
+    pos, has_gauss, cached_gaussian = checkpoint['numpy_rng_extra']
+    rng.set_state(('MT19937', checkpoint['numpy_rng_keys'], int(pos), int(has_gauss), float(cached_gaussian)))
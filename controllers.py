@@ -1,6 +1,4 @@
-from pygame.locals import K_RIGHT, K_LEFT, K_UP, K_DOWN
-from world import World, Action
-from search import WorldGraph, a_star_search
+from world import Action
 
 
 class Controller:
@@ -14,45 +12,29 @@ class Controller:
 class KeyboardController(Controller):
     def __init__(self):
         super().__init__()
+        # Imported here so that importing this module does not import pygame.
+        from pygame.locals import K_RIGHT, K_LEFT, K_UP, K_DOWN
+        self.actions = {K_LEFT: Action.LEFT, K_RIGHT: Action.RIGHT, K_UP: Action.UP, K_DOWN: Action.DOWN}
 
     def get_action(self, data):
         action = None
         if data is not None:
             event = data
-            if K_LEFT == event.key:
-                action = Action.LEFT
-            elif K_RIGHT == event.key:
-                action = Action.RIGHT
-            elif K_UP == event.key:
-                action = Action.UP
-            elif K_DOWN == event.key:
-                action = Action.DOWN
+            action = self.actions.get(event.key)
         return action
 
 
 class AStarController(Controller):
     ACTION_TICK_INTERVAL = 1
 
-    def _compute_astar(self, level):
-        self.level = level
-        self.world = World(level=self.level)
-        exit_position, exit_cell = self.level.get_exit()
-        came_from, cost_so_far, current, n_steps = a_star_search(
-              graph=WorldGraph(self.world), start=self.world.init_state,
-              exit_definition=exit_position,
-              extract_definition=self.world.get_player_position)
+    def __init__(self, path):
+        """
+        Constructor.
 
-        self.path = []
-        while True:
-            if current is None:
-                break
-            self.path.append(self.world.get_player_position(current))
-            current = came_from[current]
-        self.path.reverse()
-
-    def __init__(self, level):
+        :param path: The solution to follow, as a list of positions from start to exit.
+        """
         self.tick = 0
-        self._compute_astar(level)
+        self.path = list(path)
         super().__init__()
 
     def _get_action(self, src, dst):
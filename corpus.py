@@ -0,0 +1,210 @@
+"""
+On-disk corpus of evolved levels.
+
+A corpus is a directory holding two append-only files:
+- `cells.bin`: levels serialized with `Level.to_bytes()`, one after the other, read through a memory map,
+- `index.jsonl`: one JSON line per level, with its content hash, offset and size in `cells.bin`, fitness, trajectory
+  and solution path.
+Levels are identified by their position in the index. A level already in the corpus (same content hash) is not added
+again. Only one process may add levels at a time, but any number of processes may read (see `refresh()`). Within a
+process, a corpus may be shared by several threads (e.g. the game adds levels in the background).
+"""
+
+import collections
+import json
+import mmap
+import os
+import threading
+
+import numpy as np
+
+from level import Level
+from trajectory import Trajectory
+
+
+CorpusEntry = collections.namedtuple('CorpusEntry', ['level', 'trajectory', 'fitness', 'solution'])
+
+
+def load_entry(path, level_id=None):
+    """
+    Level `level_id` (by default, the one with the highest fitness) of the corpus at `path`, as a `CorpusEntry`.
+
+    :raise FileNotFoundError: If there is no corpus at `path`.
+    :raise LookupError: If the corpus is empty, or has no level `level_id`.
+    """
+    if not os.path.isdir(path):
+        raise FileNotFoundError(path)
+    with LevelCorpus(path) as corpus:
+        if len(corpus) == 0:
+            raise LookupError(f'The corpus at {path} has no levels')
+        if level_id is None:
+            level_id = corpus.best() or 0
+        elif not 0 <= level_id < len(corpus):
+            raise LookupError(f'The corpus at {path} has no level {level_id} (it has {len(corpus)})')
+        return corpus.get(level_id)
+
+
+class LevelCorpus:
+
+    CELLS_FILENAME = 'cells.bin'
+    INDEX_FILENAME = 'index.jsonl'
+
+    def __init__(self, path):
+        """
+        Constructor.
+
+        :param path: Directory of the corpus, created if needed.
+        """
+        self.path = path
+        # Guards the files and the entries.
+        self.lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self.cells_file = open(os.path.join(path, self.CELLS_FILENAME), 'a+b')
+        self.index_file = open(os.path.join(path, self.INDEX_FILENAME), 'a+', encoding='utf-8')
+        self.index_file.seek(0)
+        self.map = None
+        self.entries = []
+        self.fitnesses = []
+        self.ids = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Read the entries added (possibly by another process) since the last call.
+        """
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self):
+        cells_size = os.fstat(self.cells_file.fileno()).st_size
+        while True:
+            position = self.index_file.tell()
+            line = self.index_file.readline()
+            if not line.endswith('\n'):
+                # End of file, or an entry being written: read it next time.
+                self.index_file.seek(position)
+                break
+            entry = json.loads(line)
+            if entry['offset'] + entry['size'] > cells_size:
+                # Its cells are not all there (the writer crashed, or is still writing).
+                self.index_file.seek(position)
+                break
+            self._add_entry(entry)
+
+    def _add_entry(self, entry):
+        self.ids[entry['hash']] = len(self.entries)
+        self.entries.append(entry)
+        self.fitnesses.append(np.nan if entry['fitness'] is None else entry['fitness'])
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, level):
+        return level.content_hash() in self.ids
+
+    def find(self, level):
+        """
+        Id of `level` in the corpus, or `None`.
+        """
+        return self.ids.get(level.content_hash())
+
+    def add(self, level, trajectory=None, fitness=None, solution=None):
+        """
+        Append `level` to the corpus, unless it is there already.
+
+        :param trajectory: Trajectory the level was generated for.
+        :param fitness: Fitness of the level.
+        :param solution: Solution path, as a list of (x, y) positions.
+        :return: The id of the level.
+        """
+        data = level.to_bytes()
+        content_hash = level.content_hash()
+        with self.lock:
+            return self._add(data, content_hash, trajectory, fitness, solution)
+
+    def _add(self, data, content_hash, trajectory, fitness, solution):
+        if content_hash in self.ids:
+            return self.ids[content_hash]
+        self.cells_file.seek(0, os.SEEK_END)
+        offset = self.cells_file.tell()
+        self.cells_file.write(data)
+        self.cells_file.flush()
+        entry = dict(hash=content_hash, offset=offset, size=len(data),
+                     fitness=None if fitness is None else float(fitness),
+                     trajectory=None if trajectory is None else dict(
+                         start=[int(x) for x in trajectory.start],
+                         actions=''.join(str(int(action)) for action in trajectory.actions)),
+                     solution=None if solution is None else [[int(x), int(y)] for x, y in solution])
+        # The index line is written last, so that readers never see an entry without its cells.
+        self.index_file.seek(0, os.SEEK_END)
+        self.index_file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self.index_file.flush()
+        self._add_entry(entry)
+        return len(self.entries) - 1
+
+    def _data(self, entry):
+        end = entry['offset'] + entry['size']
+        with self.lock:
+            if self.map is None or len(self.map) < end:
+                # The file grew since it was mapped.
+                if self.map is not None:
+                    self.map.close()
+                self.map = mmap.mmap(self.cells_file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self.map[entry['offset']:end]
+
+    def level(self, level_id):
+        """
+        The level with id `level_id` (without its trajectory, fitness and solution).
+        """
+        return Level.from_bytes(self._data(self.entries[level_id]))
+
+    def get(self, level_id):
+        """
+        The level with id `level_id`, as a `CorpusEntry`.
+        """
+        entry = self.entries[level_id]
+        level = Level.from_bytes(self._data(entry))
+        trajectory = None
+        if entry['trajectory'] is not None:
+            trajectory = Trajectory.from_actions(level.width, level.height, entry['trajectory']['start'],
+                                                 entry['trajectory']['actions'])
+        solution = None if entry['solution'] is None else [tuple(position) for position in entry['solution']]
+        return CorpusEntry(level, trajectory, entry['fitness'], solution)
+
+    def select(self, min_fitness=None, max_fitness=None):
+        """
+        Ids of the levels whose fitness is within [`min_fitness`, `max_fitness`] (levels without fitness are excluded
+        if any bound is given).
+        """
+        with self.lock:
+            fitnesses = np.array(self.fitnesses, dtype=np.float64)
+        selected = np.ones(len(fitnesses), dtype=bool)
+        if min_fitness is not None:
+            selected &= fitnesses >= min_fitness
+        if max_fitness is not None:
+            selected &= fitnesses <= max_fitness
+        return np.flatnonzero(selected)
+
+    def best(self):
+        """
+        Id of the level with the highest fitness (`None` if there is no level with a fitness).
+        """
+        with self.lock:
+            fitnesses = np.array(self.fitnesses, dtype=np.float64)
+        if len(fitnesses) == 0 or np.isnan(fitnesses).all():
+            return None
+        return int(np.nanargmax(fitnesses))
+
+    def close(self):
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+            self.cells_file.close()
+            self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
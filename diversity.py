@@ -0,0 +1,198 @@
+"""
+Diversity control: an archive of packed genomes, and an evaluator that avoids evaluating duplicates.
+
+Genomes are compared with the Hamming distance (number of differing cells), computed directly on packed genomes (see
+`Genotype.pack()`) with NumPy, for a whole batch against the whole archive at once.
+"""
+
+import numpy as np
+
+from evaluators import Evaluator
+
+
+def packed_hamming(a, b, chunk_size=256):
+    """
+    Hamming distances between two sets of packed genomes.
+
+    :param a: Array of shape (n, packed size).
+    :param b: Array of shape (m, packed size).
+    :param chunk_size: Number of rows of `b` compared at once (bounds memory usage).
+    :return: Array of shape (n, m) counting the cells that differ.
+    """
+    distances = np.empty((len(a), len(b)), dtype=np.int32)
+    for start in range(0, len(b), chunk_size):
+        diff = a[:, None, :] ^ b[None, start:start + chunk_size, :]
+        distances[:, start:start + chunk_size] = (np.count_nonzero(diff & 0x0F, axis=2) +
+                                                  np.count_nonzero(diff & 0xF0, axis=2))
+    return distances
+
+
+def packed_genomes(individuals):
+    """
+    Packed genomes of `individuals` (at least one), as an array with one row per individual.
+    """
+    return np.array([np.frombuffer(individual.getGenotype().pack(), dtype=np.uint8) for individual in individuals])
+
+
+class DiversityArchive:
+
+    """
+    Fixed-size archive of recently evaluated genomes (packed) with their fitness, solution and statistics.
+
+    When full, the oldest entries are overwritten.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.genomes = None
+        self.results = [None] * capacity
+        self.size = 0
+        self.next = 0
+
+    def clear(self):
+        self.size = 0
+        self.next = 0
+        self.results = [None] * self.capacity
+
+    def add(self, genome, individual):
+        if self.genomes is None:
+            self.genomes = np.zeros((self.capacity, len(genome)), dtype=np.uint8)
+        self.genomes[self.next] = genome
+        self.results[self.next] = (individual.getFitness(), individual.solution, individual.stats)
+        self.next = (self.next + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def distances(self, genomes):
+        """
+        Hamming distances from each of `genomes` to each archived genome, as an array of shape (len(genomes), size).
+        """
+        if self.size == 0:
+            return np.zeros((len(genomes), 0), dtype=np.int32)
+        return packed_hamming(genomes, self.genomes[:self.size])
+
+
+class DiversityFilter(Evaluator):
+
+    """
+    Evaluator avoiding evaluations of duplicates, and penalising clones.
+
+    When a batch is evaluated (`evaluate()`, used by the generational algorithm):
+    - individuals identical to an archived genome reuse its fitness without being evaluated again,
+    - individuals within `near_distance` of an earlier member of the batch are clones: they are not evaluated and get
+      that member's fitness, reduced by `penalty` (a fraction).
+    When individuals are submitted one by one (`submit()`, used by the steady-state algorithm), they are compared with
+    the archive, which holds the individuals evaluated most recently: any of them within `near_distance` is treated
+    as a clone.
+    Everything else is evaluated by the wrapped evaluator and added to the archive, if it was actually searched (not
+    rejected by a `SurrogateScreen`). Fitnesses depend on the A* step budget, so the archive is cleared when it changes.
+    """
+
+    def __init__(self, evaluator, near_distance=0, penalty=0.5, archive_size=1000):
+        self.evaluator = evaluator
+        self.near_distance = near_distance
+        self.penalty = penalty
+        self.archive = DiversityArchive(archive_size)
+        self.max_steps = None
+        self.done = []
+        self.genomes = {}
+        self.n_cache_hits = 0
+        self.n_clones = 0
+        self.n_evaluated = 0
+
+    def _archive(self, genome, individual):
+        # Individuals rejected by a surrogate screen have no search statistics: their fitness is only a guess.
+        if individual.stats is not None:
+            self.archive.add(genome, individual)
+
+    def _copy_result(self, individual, result, penalty=0):
+        fitness, individual.solution, individual.stats = result
+        individual.setFitness(fitness * (1 - penalty))
+
+    def submit(self, individual):
+        genome = packed_genomes([individual])
+        distances = self.archive.distances(genome)[0]
+        if len(distances) > 0 and distances.min() <= self.near_distance:
+            self._copy_result(individual, self.archive.results[int(distances.argmin())], self.penalty)
+            self.n_clones += 1
+            self.done.append(individual)
+        else:
+            self.genomes[id(individual)] = genome[0]
+            self.evaluator.submit(individual)
+
+    def completed(self, timeout=None):
+        done, self.done = self.done, []
+        evaluated = self.evaluator.completed(timeout=0 if done else timeout)
+        for individual in evaluated:
+            self._archive(self.genomes.pop(id(individual)), individual)
+            self.n_evaluated += 1
+        return done + evaluated
+
+    def pending(self):
+        return self.evaluator.pending() + len(self.done)
+
+    def capacity(self):
+        return self.evaluator.capacity()
+
+    def set_search_budget(self, max_steps):
+        if max_steps != self.max_steps:
+            self.archive.clear()
+            self.max_steps = max_steps
+        self.evaluator.set_search_budget(max_steps)
+
+    def set_record_heatmaps(self, enabled):
+        self.evaluator.set_record_heatmaps(enabled)
+
+    def evaluate(self, individuals):
+        if not individuals:
+            # E.g. a generation where every offspring was rejected.
+            return
+        genomes = packed_genomes(individuals)
+        to_archive = self.archive.distances(genomes)
+        within_batch = packed_hamming(genomes, genomes)
+        # For each individual, the earlier batch member it is a clone of (or None), and whether it is in the archive.
+        originals = [None] * len(individuals)
+        cached = [None] * len(individuals)
+        is_original = np.zeros(len(individuals), dtype=bool)
+        to_evaluate = []
+        for i in range(len(individuals)):
+            earlier = np.flatnonzero(is_original[:i] & (within_batch[i, :i] <= self.near_distance))
+            if len(earlier) > 0:
+                originals[i] = int(earlier[0])
+                continue
+            is_original[i] = True
+            if to_archive.shape[1] > 0 and to_archive[i].min() == 0:
+                cached[i] = self.archive.results[int(to_archive[i].argmin())]
+            else:
+                to_evaluate.append(i)
+
+        self.evaluator.evaluate([individuals[i] for i in to_evaluate])
+        for i in to_evaluate:
+            self._archive(genomes[i], individuals[i])
+        self.n_evaluated += len(to_evaluate)
+        for i, individual in enumerate(individuals):
+            if cached[i] is not None:
+                self._copy_result(individual, cached[i])
+                self.n_cache_hits += 1
+            elif originals[i] is not None:
+                original = individuals[originals[i]]
+                self._copy_result(individual, (original.getFitness(), original.solution, original.stats), self.penalty)
+                self.n_clones += 1
+
+    def close(self):
+        self.evaluator.close()
+
+    def metrics(self, individuals):
+        """
+        Diversity metrics of `individuals` (typically the population), plus counters since this filter was created.
+        """
+        genomes = packed_genomes(individuals)
+        distances = packed_hamming(genomes, genomes)
+        n = len(individuals)
+        pairs = distances[np.triu_indices(n, k=1)]
+        return dict(mean_distance=float(pairs.mean()) if len(pairs) else 0.0,
+                    min_distance=int(pairs.min()) if len(pairs) else 0,
+                    unique=len(np.unique(genomes, axis=0)),
+                    archive_size=self.archive.size,
+                    evaluated=self.n_evaluated,
+                    cache_hits=self.n_cache_hits,
+                    clones=self.n_clones)
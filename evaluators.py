@@ -0,0 +1,448 @@
+"""
+Fitness evaluation backends for the genetic algorithm.
+
+An evaluator computes the fitness of individuals, either in the current process (`LocalEvaluator`) or on worker
+processes connected over TCP (`EvaluationServer`, with workers started by `run_worker()`, possibly on other machines).
+Evaluators can be used synchronously with `evaluate()`, or asynchronously with `submit()` and `completed()`.
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+from multiprocessing import Process
+from multiprocessing.connection import Client, Listener
+
+
+logger = logging.getLogger(__name__)
+
+# Environment variable holding the shared secret that authenticates workers. Messages are pickled, so anyone knowing it
+# can run code on the server and the workers: it must be set (to a long random string) to listen beyond this machine.
+AUTHKEY_VARIABLE = 'ONIRIKON_AUTHKEY'
+
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+def environment_authkey():
+    """
+    Shared secret read from `$ONIRIKON_AUTHKEY`, or `None` if it is not set.
+    """
+    authkey = os.environ.get(AUTHKEY_VARIABLE)
+    return authkey.encode('utf-8') if authkey else None
+
+
+class Evaluator(object):
+
+    """
+    Abstract class for evaluators.
+    """
+
+    def submit(self, individual):
+        """
+        Queue `individual` for evaluation.
+        """
+        raise NotImplementedError(self.__class__.__name__)
+
+    def completed(self, timeout=None):
+        """
+        Wait until at least one submitted individual is evaluated, or `timeout` seconds have passed.
+
+        :return: The list of individuals evaluated since the last call, with their fitness, solution and search
+            statistics set.
+        """
+        raise NotImplementedError(self.__class__.__name__)
+
+    def pending(self):
+        """
+        Number of submitted individuals not yet returned by `completed()`.
+        """
+        raise NotImplementedError(self.__class__.__name__)
+
+    def capacity(self):
+        """
+        Number of individuals that can be evaluated in parallel (at least 1: an evaluator without workers evaluates in
+        the calling process, see `EvaluationServer`).
+        """
+        return 1
+
+    def set_search_budget(self, max_steps):
+        """
+        Limit the number of A* steps of subsequent evaluations (`None` for no limit).
+        """
+        self.max_steps = max_steps
+
+    def set_record_heatmaps(self, enabled):
+        """
+        Whether subsequent evaluations should record A* expansion counts per cell (in `individual.stats['heatmap']`).
+        """
+        self.record_heatmaps = enabled
+
+    def evaluate(self, individuals):
+        """
+        Evaluate all `individuals` and wait for the results.
+        """
+        for individual in individuals:
+            self.submit(individual)
+        while self.pending() > 0:
+            self.completed()
+
+    def close(self):
+        """
+        Release resources held by this evaluator.
+        """
+        pass
+
+
+class LocalEvaluator(Evaluator):
+
+    """
+    Evaluator computing fitnesses in the current process, as soon as individuals are submitted.
+    """
+
+    def __init__(self, fitness_function):
+        """
+        Constructor.
+
+        :param fitness_function: Function computing the fitness of an individual (typically
+            `Algorithm.calculateFitness`, which also sets the individual's solution and statistics).
+        """
+        self.fitness_function = fitness_function
+        self.done = []
+
+    def set_search_budget(self, max_steps):
+        # The fitness function knows the budget already.
+        pass
+
+    def set_record_heatmaps(self, enabled):
+        # Same as the budget.
+        pass
+
+    def submit(self, individual):
+        individual.setFitness(self.fitness_function(individual))
+        self.done.append(individual)
+
+    def completed(self, timeout=None):
+        done, self.done = self.done, []
+        return done
+
+    def pending(self):
+        return len(self.done)
+
+    def evaluate(self, individuals):
+        for individual in individuals:
+            individual.setFitness(self.fitness_function(individual))
+
+
+class EvaluationServer(Evaluator):
+
+    """
+    Evaluator handing out work to worker processes over TCP.
+
+    Each task is a packed genome plus the id of its trajectory and the current A* settings. Trajectories are sent once
+    per worker, which caches them. The task of a worker that disconnects is put back in the queue for another worker. A
+    task taking more than `timeout` seconds is given to another worker too (the first one keeps working on it, and its
+    result is used if it comes first), up to `max_attempts` times, after which it gets the fitness of a level exceeding
+    the search budget. When no worker has been connected for `worker_wait` seconds, tasks are evaluated in the process
+    calling `completed()` instead.
+    """
+
+    # Longest wait (in seconds) for results before checking that workers remain.
+    POLL_PERIOD = 0.5
+
+    def __init__(self, address=('localhost', 0), authkey=None, timeout=60.0, max_attempts=2, worker_wait=10.0):
+        """
+        Constructor.
+
+        :param address: (host, port) to listen on. Port 0 picks a free port (see `self.address`).
+        :param authkey: Shared secret workers must know (by default, `$ONIRIKON_AUTHKEY`). It is required to listen on
+            another interface than localhost; otherwise a random one is generated, known to the local workers only
+            (see `start_local_workers()`).
+        :param timeout: Time (in seconds) after which a task is given to another worker.
+        :param max_attempts: Number of workers a task is given to before giving up on it.
+        :param worker_wait: Time (in seconds) without any worker after which tasks are evaluated locally.
+        """
+        if authkey is None:
+            authkey = environment_authkey()
+        if authkey is None:
+            if address[0] not in LOCAL_HOSTS:
+                raise ValueError(f'An authkey (or ${AUTHKEY_VARIABLE}) is required to listen on {address[0]}')
+            authkey = os.urandom(32)
+        self.listener = Listener(address, authkey=authkey)
+        self.address = self.listener.address
+        self.authkey = authkey
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.worker_wait = worker_wait
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.in_flight = {}
+        # Number of workers each task timed out on, by task id.
+        self.attempts = {}
+        # Trajectories by id, and their ids by content (see `Trajectory.key()`).
+        self.trajectories = []
+        self.trajectory_ids = {}
+        self.task_ids = itertools.count()
+        self.max_steps = None
+        self.record_heatmaps = False
+        self.lock = threading.Lock()
+        self.closing = False
+        self.n_workers = 0
+        # Since when no worker is connected (`None` while there are some).
+        self.workerless_since = time.monotonic()
+        # Genotypes used to evaluate tasks locally, by trajectory id.
+        self.local_genotypes = {}
+        self.worker_processes = []
+        self.accept_thread = threading.Thread(target=self._accept, daemon=True)
+        self.accept_thread.start()
+
+    def start_local_workers(self, n_workers=None):
+        """
+        Start `n_workers` worker processes on this machine (defaults to the number of CPUs).
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        for i in range(n_workers):
+            process = Process(target=run_worker, kwargs=dict(address=self.address, authkey=self.authkey),
+                              daemon=True)
+            process.start()
+            self.worker_processes.append(process)
+
+    def _trajectory_id(self, trajectory):
+        # Individuals deep copy their trajectory, so trajectories are matched by content.
+        key = trajectory.key()
+        with self.lock:
+            trajectory_id = self.trajectory_ids.get(key)
+            if trajectory_id is None:
+                trajectory_id = self.trajectory_ids[key] = len(self.trajectories)
+                self.trajectories.append(trajectory)
+            return trajectory_id
+
+    def submit(self, individual):
+        genotype = individual.getGenotype()
+        task = (next(self.task_ids), self._trajectory_id(genotype.trajectory), genotype.pack(), self.max_steps,
+                self.record_heatmaps)
+        with self.lock:
+            self.in_flight[task[0]] = individual
+        self.tasks.put(task)
+
+    def completed(self, timeout=None):
+        done = []
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.POLL_PERIOD
+            if deadline is not None:
+                wait = max(0, min(wait, deadline - time.monotonic()))
+            try:
+                result = self.results.get(timeout=wait)
+                break
+            except queue.Empty:
+                if self._workerless():
+                    self._evaluate_locally()
+                elif deadline is not None and time.monotonic() >= deadline:
+                    return done
+        try:
+            while True:
+                task_id, fitness, solution, stats = result
+                with self.lock:
+                    individual = self.in_flight.pop(task_id, None)
+                    self.attempts.pop(task_id, None)
+                # Results of tasks given to several workers (see `_timed_out()`) may come more than once.
+                if individual is not None:
+                    individual.setFitness(fitness)
+                    individual.solution = solution
+                    individual.stats = stats
+                    done.append(individual)
+                result = self.results.get_nowait()
+        except queue.Empty:
+            pass
+        return done
+
+    def pending(self):
+        with self.lock:
+            return len(self.in_flight)
+
+    def capacity(self):
+        return max(1, self.n_workers)
+
+    def _is_pending(self, task_id):
+        # Whether the result of `task_id` is still awaited (tasks given to several workers may be answered already).
+        with self.lock:
+            return task_id in self.in_flight
+
+    def _workerless(self):
+        with self.lock:
+            return (self.n_workers == 0 and self.workerless_since is not None
+                    and time.monotonic() - self.workerless_since >= self.worker_wait)
+
+    def _evaluate_locally(self):
+        # Evaluate the next queued task in this process (when there are no workers).
+        try:
+            task = self.tasks.get_nowait()
+        except queue.Empty:
+            return
+        task_id, trajectory_id, packed_genome, max_steps, heatmap = task
+        if not self._is_pending(task_id):
+            return
+        logger.warning('No evaluation worker left, evaluating task %d locally', task_id)
+        if trajectory_id not in self.local_genotypes:
+            self.local_genotypes[trajectory_id] = _trajectory_genotype(self.trajectories[trajectory_id])
+        result = _evaluate_task(self.local_genotypes[trajectory_id], packed_genome, max_steps, heatmap)
+        self.results.put((task_id,) + result)
+
+    def _timed_out(self, task):
+        # Give `task` to another worker, or give up on it if it timed out too many times already.
+        task_id, trajectory_id, packed_genome, max_steps, heatmap = task
+        if not self._is_pending(task_id):
+            return
+        with self.lock:
+            attempts = self.attempts[task_id] = self.attempts.get(task_id, 0) + 1
+        if attempts < self.max_attempts:
+            logger.warning('Evaluation worker timed out on task %d, giving it to another worker', task_id)
+            self.tasks.put(task)
+        else:
+            logger.warning('Evaluation of task %d timed out on %d workers, giving up', task_id, attempts)
+            from algorithm import budgetExceededResult
+            result = budgetExceededResult(max_steps, dict(n_nodes=0, seconds=attempts * self.timeout))
+            self.results.put((task_id,) + result)
+
+    def _accept(self):
+        while not self.closing:
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError):
+                # Failed handshake, or listener closed.
+                continue
+            if self.closing:
+                connection.close()
+                break
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        sent_trajectories = set()
+        task = None
+        with self.lock:
+            self.n_workers += 1
+            self.workerless_since = None
+        try:
+            while not self.closing:
+                try:
+                    task = self.tasks.get(timeout=self.POLL_PERIOD)
+                except queue.Empty:
+                    continue
+                task_id, trajectory_id, packed_genome, max_steps, heatmap = task
+                if not self._is_pending(task_id):
+                    task = None
+                    continue
+                if trajectory_id not in sent_trajectories:
+                    connection.send(('trajectory', trajectory_id, self.trajectories[trajectory_id]))
+                    sent_trajectories.add(trajectory_id)
+                connection.send(('evaluate', task_id, trajectory_id, packed_genome, max_steps, heatmap))
+                if not connection.poll(self.timeout):
+                    self._timed_out(task)
+                    task = None
+                    # The worker carries on with the task: wait for it (its result is still used if it comes first).
+                    while not connection.poll(self.POLL_PERIOD):
+                        if self.closing:
+                            return
+                self.results.put(connection.recv()[1:])
+                task = None
+            else:
+                connection.send(('stop',))
+        except (OSError, EOFError):
+            logger.warning('Lost an evaluation worker')
+        finally:
+            if task is not None:
+                # Give the task to another worker.
+                self.tasks.put(task)
+            with self.lock:
+                self.n_workers -= 1
+                if self.n_workers == 0:
+                    self.workerless_since = time.monotonic()
+            connection.close()
+
+    def close(self):
+        self.closing = True
+        try:
+            # Wake up the thread waiting for connections.
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+        self.accept_thread.join()
+        self.listener.close()
+        for process in self.worker_processes:
+            process.join(timeout=1)
+
+
+def _trajectory_genotype(trajectory):
+    # Genotype reused to unpack the genomes of `trajectory`.
+    from genotype import Genotype
+    genotype = Genotype()
+    genotype.trajectory = trajectory
+    return genotype
+
+
+def _evaluate_task(genotype, packed_genome, max_steps, heatmap):
+    # Fitness, solution and statistics of a packed genome, using `genotype` (see `_trajectory_genotype()`).
+    from algorithm import levelFitness
+    genotype.unpack(packed_genome, genotype.trajectory)
+    return levelFitness(genotype.getPhenotype().level, max_steps, heatmap)
+
+
+def run_worker(address, authkey=None):
+    """
+    Connect to the `EvaluationServer` at `address` and evaluate the tasks it sends until it stops or disconnects.
+
+    :param authkey: Shared secret of the server (by default, `$ONIRIKON_AUTHKEY`).
+    """
+    if authkey is None:
+        authkey = environment_authkey()
+    if authkey is None:
+        raise ValueError(f'An authkey (or ${AUTHKEY_VARIABLE}) is required to connect to an evaluation server')
+    connection = Client(tuple(address), authkey=authkey)
+    genotypes = {}
+    try:
+        while True:
+            message = connection.recv()
+            if message[0] == 'trajectory':
+                trajectory_id, trajectory = message[1:]
+                genotypes[trajectory_id] = _trajectory_genotype(trajectory)
+            elif message[0] == 'evaluate':
+                task_id, trajectory_id, packed_genome, max_steps, heatmap = message[1:]
+                result = _evaluate_task(genotypes[trajectory_id], packed_genome, max_steps, heatmap)
+                connection.send(('result', task_id) + result)
+            elif message[0] == 'stop':
+                break
+            else:
+                raise NotImplementedError(message[0])
+    except (OSError, EOFError):
+        # The server closed or reset the connection.
+        logger.info('Disconnected from the evaluation server')
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluation worker: connects to an evaluation server and computes '
+                                                 f'fitnesses. The shared secret is read from ${AUTHKEY_VARIABLE}.')
+    parser.add_argument('host', help='server host')
+    parser.add_argument('port', type=int, help='server port')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes to run')
+    args = parser.parse_args()
+    if environment_authkey() is None:
+        parser.error(f'${AUTHKEY_VARIABLE} is not set')
+    processes = [Process(target=run_worker, kwargs=dict(address=(args.host, args.port)))
+                 for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,972 @@
+"""
+The game: a window showing the levels found by the optimizer, which the player (or A*) solves. Started by
+`front.py`.
+"""
+
+import collections
+import logging
+import math
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import numpy as np
+
+import pygame
+from pygame.locals import QUIT, K_SPACE, K_F3, K_F4, KEYDOWN, USEREVENT
+from pygame.event import Event
+
+from GUI import Button, SimpleText
+from GUI.locals import TOPLEFT, GREEN, GREY, BLACK
+
+from game_utils import GameUtils
+from level import Level, EmptyCell, BlockCell, StartPositionCell, ExitCell, WineCell, CheeseCell, TornadoCell, IceCell
+from controllers import KeyboardController, AStarController
+from trajectory import RandomWalkTrajectory, Trajectory
+from world import World
+import launcher
+from level import LEVEL_WIDTH, LEVEL_HEIGHT
+
+logger = logging.getLogger(__name__)
+
+# Initialize seed immediately to be safe (default = system clock, but you can use a fixed integer for debugging).
+random.seed(None)
+
+
+class CustomEvents:
+    EVENT_MODE_CHANGED = USEREVENT
+    EVENT_GO_NEXT_LEVEL = USEREVENT + 1
+
+
+class EngineState:
+    def __init__(self, mode, playing):
+        self.mode = mode
+        self.playing = playing
+        self.optimizer_process = None
+        self.channel = None
+        self.trajectory = None
+        self.stop_event = None
+        self.go_next_level = False
+
+
+class Menu:
+    PANEL_WIDTH = 180
+    PANEL_MARGIN_TOP = 80
+    PANEL_MARGIN_LEFT = 20
+    # Number of optimizer islands (None = one per CPU).
+    N_ISLANDS = None
+    # Where optimizer islands are checkpointed, so that optimization resumes where it stopped in the last session.
+    CHECKPOINT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkpoints')
+
+    def __init__(self, display, context):
+        self.display = display
+        # Multiprocessing context the optimizer is started with (see `launcher.py`).
+        self.context = context
+        w, h = self.display.get_size()
+        self.panel_pos = (w - self.PANEL_WIDTH, self.PANEL_MARGIN_TOP)
+        self.optimizeButton = OptimizeButton(self.run_optimizer, self.panel_pos)
+        self.keyboardModeButton = KeyboardModeButton(self.keyboard_mode, self.panel_pos)
+        self.astarModeButton = AStarModeButton(self.astar_mode, self.panel_pos)
+        self.nextLevelButton = NextLevelButton(self.next_level, self.panel_pos)
+        self.evaluationLabel = MyLabel(self.panel_pos, "Fitness: {0}", -12, 220, args = ['-'])
+        self.gui_objects = [self.optimizeButton, self.keyboardModeButton, self.astarModeButton, self.nextLevelButton, self.evaluationLabel]
+        self.should_run_optimizer = False
+        self.trajectory = None
+
+    def update(self, enginestate):
+        if enginestate.mode == GameEngine.MODE_KEYBOARD:
+            self.keyboardModeButton.activate()
+            self.astarModeButton.deactivate()
+        elif enginestate.mode == GameEngine.MODE_ASTAR:
+            self.keyboardModeButton.deactivate()
+            self.astarModeButton.activate()
+        if self.should_run_optimizer:
+            self.should_run_optimizer = False
+            self._run_optimizer(enginestate)
+        if enginestate.optimizer_process is not None and not enginestate.optimizer_process.is_alive():
+            logger.warning('Optimizer process died')
+            enginestate.optimizer_process = None
+            self.optimizeButton.set_disabled(False)
+            enginestate.stop_event.set()
+
+    def draw(self):
+        for gui_object in self.gui_objects:
+            gui_object.gui_element.render(self.display)
+
+    def get_rect(self):
+        # Screen area of the panel (labels may start a little left of the buttons).
+        w, h = self.display.get_size()
+        left = self.panel_pos[0] - self.PANEL_MARGIN_LEFT
+        return pygame.Rect(left, 0, w - left, h)
+
+    def on_mouse_up(self):
+        for gui_object in self.gui_objects:
+            if gui_object.handle_mouse_events:
+                gui_object.on_mouse_up()
+
+    def on_mouse_down(self):
+        mouse = pygame.mouse.get_pos()
+        for gui_object in self.gui_objects:
+            if mouse in gui_object.gui_element and gui_object.handle_mouse_events:
+                gui_object.on_mouse_down()
+
+    def _run_optimizer(self, enginestate):
+        # Imported when needed, to keep the optimizer out of the game's startup.
+        from channel import LatestLevelChannel
+        from optimize import optimize_islands
+        enginestate.stop_event = self.context.Event()
+        if self.trajectory is None:
+            trajectory = RandomWalkTrajectory(level_width=LEVEL_WIDTH, level_height=LEVEL_HEIGHT)
+        else:
+            trajectory = self.trajectory
+        if enginestate.channel is not None:
+            enginestate.channel.close()
+        enginestate.channel = LatestLevelChannel(trajectory.level_width, trajectory.level_height)
+        enginestate.trajectory = trajectory
+        enginestate.optimizer_process = self.context.Process(target=optimize_islands,
+                                                             kwargs=dict(channel=enginestate.channel,
+                                                                         stop_event=enginestate.stop_event,
+                                                                         trajectory=trajectory,
+                                                                         n_islands=self.N_ISLANDS,
+                                                                         checkpoint_dir=self.CHECKPOINT_DIR))
+        enginestate.optimizer_process.start()
+        self.optimizeButton.set_disabled(True)
+
+    def run_optimizer(self):
+        self.should_run_optimizer = True
+
+    def keyboard_mode(self):
+        event = Event(CustomEvents.EVENT_MODE_CHANGED, message=GameEngine.MODE_KEYBOARD)
+        pygame.event.post(event)
+
+    def astar_mode(self):
+        event = Event(CustomEvents.EVENT_MODE_CHANGED, message=GameEngine.MODE_ASTAR)
+        pygame.event.post(event)
+
+    def next_level(self):
+        event = Event(CustomEvents.EVENT_GO_NEXT_LEVEL, message=None)
+        pygame.event.post(event)
+
+def format_metric(value, pattern):
+    """
+    Format `value` with `pattern`, or as '-' if it is unknown (`None` or NaN).
+    """
+    return '-' if value is None or math.isnan(value) else pattern.format(value)
+
+
+class PerformanceOverlay:
+    """
+    Frame time percentiles and optimizer metrics, drawn above the level (toggled with F3).
+
+    While hidden, it only records frame times and level latencies; the optimizer metrics are read from the channel and
+    the text is rendered only while it is shown, a few times per second. While shown, it is drawn over the sprites every
+    frame (see `erase()` and `draw()`).
+    """
+    N_FRAMES = 300
+    N_LATENCIES = 20
+    REFRESH_PERIOD = 0.25
+    FONT_SIZE = 20
+
+    def __init__(self, pos):
+        self.pos = pos
+        self.visible = False
+        self.frame_times = collections.deque(maxlen=self.N_FRAMES)
+        self.latencies = collections.deque(maxlen=self.N_LATENCIES)
+        self.metrics = None
+        self.font = None
+        self.image = None
+        self.rect = None
+        self.next_refresh = 0
+
+    def toggle(self):
+        self.visible = not self.visible
+        self.next_refresh = 0
+
+    def add_frame_time(self, milliseconds):
+        self.frame_times.append(milliseconds)
+
+    def add_latency(self, seconds):
+        self.latencies.append(seconds)
+
+    def set_metrics(self, metrics):
+        if metrics is not None:
+            self.metrics = metrics
+
+    def _lines(self):
+        lines = []
+        if self.frame_times:
+            p50, p95, p99 = np.percentile(self.frame_times, [50, 95, 99])
+            lines.append(f'frame time {p50:.1f} / {p95:.1f} / {p99:.1f} ms (p50 / p95 / p99)')
+        metrics = self.metrics or {}
+        lines.append('optimizer {} gen/s, {} eval/s, cache hits {}, A* expansions of best {}'.format(
+            format_metric(metrics.get('generations_per_second'), '{:.2f}'),
+            format_metric(metrics.get('evaluations_per_second'), '{:.1f}'),
+            format_metric(metrics.get('cache_hit_rate'), '{:.0%}'),
+            format_metric(metrics.get('expansions'), '{:.0f}')))
+        from profiling import PHASES
+        phases = ', '.join('{} {}'.format(phase, format_metric(metrics.get(f'{phase}_seconds'), '{:.3f}s'))
+                           for phase in PHASES)
+        lines.append('last generation {}, rejected {} of crossovers and {} of mutations'.format(
+            phases, format_metric(metrics.get('crossover_rejection_rate'), '{:.0%}'),
+            format_metric(metrics.get('mutation_rejection_rate'), '{:.0%}')))
+        latency = np.median(self.latencies) * 1000 if self.latencies else None
+        lines.append('level latency from publish to game {} ms'.format(format_metric(latency, '{:.0f}')))
+        return lines
+
+    def _render(self):
+        if self.font is None:
+            self.font = pygame.font.Font(None, self.FONT_SIZE)
+        texts = [self.font.render(line, True, BLACK) for line in self._lines()]
+        self.image = pygame.Surface((max(text.get_width() for text in texts), sum(text.get_height() for text in texts)),
+                                    pygame.SRCALPHA)
+        y = 0
+        for text in texts:
+            self.image.blit(text, (0, y))
+            y += text.get_height()
+
+    def erase(self, screen, background):
+        """
+        Restore the background under the overlay, before the sprites are drawn. Returns the screen areas that changed.
+        """
+        if self.rect is None:
+            return []
+        dirty = [screen.blit(background, self.rect, self.rect)]
+        self.rect = None
+        return dirty
+
+    def draw(self, screen):
+        """
+        Draw the overlay if it is shown, after the sprites (its text is rendered again a few times per second). Returns
+        the screen areas that changed.
+        """
+        if not self.visible:
+            return []
+        if self.image is None or time.perf_counter() >= self.next_refresh:
+            self._render()
+            self.next_refresh = time.perf_counter() + self.REFRESH_PERIOD
+        self.rect = screen.blit(self.image, self.pos)
+        return [self.rect]
+
+
+class MyLabel:
+    def __init__(self, panel_pos, text, x, y, args, color = BLACK):
+        self.unformatted_text = text
+
+        if args is None:
+            display_text = text
+        else:
+            display_text = text.format(*args)
+
+        self.gui_element = SimpleText(display_text, (x + panel_pos[0], y + panel_pos[1]), color, anchor=TOPLEFT)
+        self.panel_pos = panel_pos
+        self.handle_mouse_events = False
+
+    def set_values(self, *args):
+        text = self.unformatted_text.format(*args)
+        self.gui_element.text = text
+
+class MyButton:
+    MODE_ACTIVATED_COLOR = (242, 142, 48)
+    MODE_DEACTIVATED_COLOR = (219, 185, 151)
+    MODE_DISABLED_COLOR = (181, 176, 171)
+
+    def __init__(self, callback, panel_pos, name, label, x, y, w, h, activated_color=GREEN, deactivated_color=GREY):
+        self.callback = callback
+        self.panel_pos = panel_pos
+        self.name = name
+        self.activated_color = activated_color
+        self.deactivated_color = deactivated_color
+        self.gui_element = Button(self._do_action, (x + panel_pos[0], y + panel_pos[1]), (w, h), label,
+                                  self.activated_color, anchor=TOPLEFT)
+        self.down = False
+        self.activated = True
+        self.disabled = False
+        self.handle_mouse_events = True
+
+    def on_mouse_up(self):
+        if self.down and not self.disabled:
+            self.gui_element.unfocus()
+            self.gui_element.release()
+            self.down = False
+
+    def on_mouse_down(self):
+        if not self.down and not self.disabled:
+            self.down = True
+            self.gui_element.focus()
+            self.gui_element.click()
+
+    def activate(self):
+        if not self.activated:
+            self.gui_element.color = self.activated_color
+            self.activated = True
+
+    def deactivate(self):
+        if self.activated:
+            self.gui_element.color = self.deactivated_color
+            self.activated = False
+
+    def set_disabled(self, value):
+        if value != self.disabled:
+            self.disabled = value
+            if self.disabled:
+                self.gui_element.color = self.MODE_DISABLED_COLOR
+            else:
+                self.gui_element.color = self.activated_color
+
+    def _do_action(self):
+        self.callback()
+
+
+class OptimizeButton(MyButton):
+    def __init__(self, callback, panel_pos, x=0, y=0, w=100, h=40):
+        super().__init__(callback, panel_pos, 'optimize', 'Optimize', x, y, w, h)
+
+
+class KeyboardModeButton(MyButton):
+    def __init__(self, callback, panel_pos, x=0, y=100, w=150, h=40,
+                 activated_color=MyButton.MODE_ACTIVATED_COLOR, deactivated_color=MyButton.MODE_DEACTIVATED_COLOR):
+        super().__init__(callback, panel_pos, 'keyboard', 'Keyboard Mode', x, y, w, h,
+                         activated_color, deactivated_color)
+
+
+class AStarModeButton(MyButton):
+    def __init__(self, callback, panel_pos, x=0, y=150, w=150, h=40,
+                 activated_color=MyButton.MODE_ACTIVATED_COLOR, deactivated_color=MyButton.MODE_DEACTIVATED_COLOR):
+        super().__init__(callback, panel_pos, 'astar', 'A* Mode', x, y, w, h,
+                         activated_color, deactivated_color)
+
+
+class NextLevelButton(MyButton):
+    def __init__(self, callback, panel_pos, x=0, y=300, w=150, h=40,
+                 activated_color=GREEN):
+        super().__init__(callback, panel_pos, 'next', 'NEXT LEVEL', x, y, w, h,
+                         activated_color)
+
+
+class GameEngine:
+    SCREEN_WIDTH, SCREEN_HEIGHT = 1280, 768
+    MARGIN_LEFT = 70
+    MARGIN_TOP = 70
+    CELL_SIZE = 32
+    TICKS_PER_SECOND = 30
+    SOUNDS = ['spawn', 'move', 'blocked', 'drink', 'eat', 'win']
+    MODE_KEYBOARD = 'keyboard'
+    MODE_ASTAR = 'astar'
+    SOLUTION_CACHE_SIZE = 1000
+    # A* step budget of the solver process (several seconds): levels it cannot solve within it are skipped.
+    SOLVER_MAX_STEPS = 100000
+    # Where the levels received from the optimizer are saved (see `corpus.py`).
+    CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'levels')
+    # Number of levels kept ready per difficulty tier, and of processes evolving them (see `pool.py`).
+    POOL_LEVELS_PER_TIER = 5
+    POOL_FILLERS = 1
+    # Number of shades of the A* expansion heatmap (see `_draw_heatmap()`).
+    HEATMAP_SHADES = 16
+
+    def _clear_screen(self):
+        self.surface.fill((255, 255, 255))
+
+    def _init_display(self, fullscreen):
+        if fullscreen:
+            self.screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN | pygame.HWSURFACE)
+        else:
+            self.screen = pygame.display.set_mode((self.SCREEN_WIDTH, self.SCREEN_HEIGHT), pygame.RESIZABLE)
+        pygame.display.set_caption('Onirikon')
+        surface = pygame.Surface(self.screen.get_size())
+        self.surface = surface.convert_alpha()
+        self.menu = Menu(self.screen, self.context)
+        self.overlay = PerformanceOverlay((self.MARGIN_LEFT, 5))
+
+    def _init_clock(self):
+        self.clock = pygame.time.Clock()
+
+    def _init_keyboard(self):
+        pygame.key.set_repeat(1, 40)
+
+    def _init_assets(self):
+        # Images and sounds are read and decoded once, in the background, so that level changes do not touch the disk.
+        # They are converted for the display and the mixer on first use, from this thread.
+        GameUtils.preload_assets((self.CELL_SIZE, self.CELL_SIZE), self.SOUNDS)
+
+    def _play_sound(self, name):
+        if name in GameUtils.sounds or name in GameUtils.sound_files:
+            GameUtils.load_sound(name).play()
+
+    def _init_enginestate(self):
+        self.enginestate = EngineState(self.MODE_KEYBOARD, True)
+
+    def _set_mode(self, mode):
+        self.enginestate.mode = mode
+        if mode == self.MODE_KEYBOARD:
+            self._initialize_controller(KeyboardController())
+        elif mode == self.MODE_ASTAR:
+            self._initialize_controller(AStarController(self.solution))
+
+    def _set_playing(self, playing):
+        self.enginestate.playing = playing
+
+    def __init__(self, fullscreen=False):
+        self.level = None
+        self.corpus = None
+        self.pool = None
+        # Difficulty tier of the next level taken from the pool (it increases with each level).
+        self.tier = 0
+        # Solution paths, and A* expansion heatmaps (see `heatmap.py`), by level content hash.
+        self.solutions = {}
+        self.heatmaps = {}
+        # Whether the heatmap is drawn over the level (toggled with F4).
+        self.show_heatmap = False
+        # Heatmap being computed by the solver process: (async result, level), or None.
+        self.pending_heatmap = None
+        self.last_valid_level = None
+        self.background = None
+        # Level start waiting for its solution: (async result, level, mode), or None.
+        self.pending_start = None
+        # Start the optimizer's fork server first, so that it imports the optimizer while pygame starts.
+        self.context = launcher.get_context()
+        launcher.warm_up(self.context)
+        pygame.init()
+        self._init_display(fullscreen)
+        self._init_keyboard()
+        self._init_clock()
+        self._init_assets()
+        self._init_enginestate()
+        self._init_pool()
+        self._init_saver()
+        # Process solving levels that come without a solution, so that hard levels do not freeze the game.
+        self.solver = self.context.Pool(1)
+
+    def _load_level(self, level_filename=None, level=None, trajectory=None, fitness=None, solution=None,
+                    level_id=None):
+        if level is not None:
+            logger.debug('Loading a level from the optimizer or the pool')
+            self.level = level
+            if solution:
+                self._remember_solution(level, solution)
+            self.trajectory = trajectory
+            self.trajectory.draw()
+        elif level_filename is None:
+            logger.debug('Loading a new level for the checkpointed or a random trajectory')
+            self.trajectory = self._checkpointed_trajectory()
+            if self.trajectory is None:
+                self.trajectory = RandomWalkTrajectory(LEVEL_WIDTH, LEVEL_HEIGHT)
+            width, height = self.trajectory.level_width, self.trajectory.level_height
+            self.level = Level(width, height)
+            self.level.generate_from_trajectory(self.trajectory, 0.5)
+        else:
+            fitness = self._load_corpus_level(level_filename, level_id)
+        self.level_width, self.level_height = self.level.size()
+        self.menu.trajectory = self.trajectory
+        
+        self.menu.evaluationLabel.set_values(fitness)
+
+    def _load_corpus_level(self, corpus_dir, level_id=None):
+        # Level `level_id` (by default, the best one) of the corpus in `corpus_dir`. Returns its fitness.
+        from corpus import load_entry
+        level, trajectory, fitness, solution = load_entry(corpus_dir, level_id)
+        self.level = level
+        self.trajectory = trajectory
+        if self.trajectory is None:
+            # The trajectory was not stored: only the start and exit are known.
+            self.trajectory = Trajectory.from_actions(level.width, level.height, level.start, ())
+        if solution:
+            self._remember_solution(level, solution)
+        return fitness
+
+    def _init_pool(self):
+        from corpus import LevelCorpus
+        from pool import LevelPool
+        self.corpus = LevelCorpus(self.CORPUS_DIR)
+        self.pool = LevelPool(self.corpus, per_tier=self.POOL_LEVELS_PER_TIER, n_fillers=self.POOL_FILLERS,
+                              context=self.context)
+        self.pool.start(LEVEL_WIDTH, LEVEL_HEIGHT)
+
+    def _init_saver(self):
+        # Levels received from the optimizer are written to the corpus by a background thread, off the frame path.
+        self.levels_to_save = queue.Queue()
+        self.saver = threading.Thread(target=self._save_levels, daemon=True)
+        self.saver.start()
+
+    def _save_levels(self):
+        while True:
+            entry = self.levels_to_save.get()
+            if entry is None:
+                break
+            self.corpus.add(*entry)
+
+    def _save_level(self, level, trajectory, fitness, solution):
+        # Keep every level received from the optimizer.
+        self.levels_to_save.put((level, trajectory, fitness, solution))
+
+    def _pop_pool_level(self):
+        # A ready level from the pool, as a (level, trajectory, fitness, solution) tuple, or None.
+        entry = self.pool.pop(self.tier)
+        if entry is None:
+            return None
+        self.tier = min(self.tier + 1, len(self.pool.tiers) - 1)
+        return entry
+
+    def _checkpointed_trajectory(self):
+        # The trajectory the optimizer was working on in the last session, if any, so that it can resume.
+        from checkpoint import checkpoint_trajectory, island_checkpoint_path, load_checkpoint
+        path = island_checkpoint_path(Menu.CHECKPOINT_DIR, 0)
+        if not os.path.exists(path):
+            return None
+        try:
+            return checkpoint_trajectory(load_checkpoint(path))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _initialize_level(self):
+        # Static tiles are drawn once into the background; only items and the player are sprites redrawn each frame.
+        static_objects = []
+        self.game_objects = []
+        for x in range(self.level_width):
+            for y in range(self.level_height):
+                cell = self.level.get_cell(x, y)
+                if type(cell) is BlockCell:
+                    static_objects.append(Block(x, y))
+                elif type(cell) is ExitCell:
+                    self.exit = Exit(x, y)
+                    static_objects.append(self.exit)
+                else:
+                    static_objects.append(Empty(x, y))
+                if type(cell) is StartPositionCell:
+                    self.player = Player(x, y)
+                elif type(cell) is WineCell:
+                    self.game_objects.append(Wine(x, y))
+                elif type(cell) is CheeseCell:
+                    self.game_objects.append(Cheese(x, y))
+                elif type(cell) is TornadoCell:
+                    static_objects.append(Tornado(x, y))
+                elif type(cell) is IceCell:
+                    static_objects.append(Ice(x, y))
+        self.game_objects.append(self.player)
+
+        self.world = World(self.level)
+        self.state = self.world.init_state
+
+        # Path from start to exit.
+        self.solution = self.solutions[self.level.content_hash()]
+        self.search_path = []
+        for point in self.solution:
+            x = GameEngine.MARGIN_LEFT + point[0] * GameEngine.CELL_SIZE + GameEngine.CELL_SIZE/2 + 2
+            y = GameEngine.MARGIN_TOP + point[1] * GameEngine.CELL_SIZE + GameEngine.CELL_SIZE/2 + 2
+            self.search_path.append([x, y])
+        
+        trajectory_path = self.trajectory.get_path()
+        self.trajectory_path = []
+        for point in trajectory_path:
+            x = GameEngine.MARGIN_LEFT + point[0] * GameEngine.CELL_SIZE + GameEngine.CELL_SIZE/2 - 2
+            y = GameEngine.MARGIN_TOP + point[1] * GameEngine.CELL_SIZE + GameEngine.CELL_SIZE/2 - 2
+            self.trajectory_path.append([x, y])
+
+        self.static_objects = static_objects
+        self._draw_background()
+
+        # Initialize sprites.
+        self.sprites = pygame.sprite.RenderUpdates(self.game_objects)
+
+    def _draw_background(self):
+        self.background = self.surface.copy()
+        pygame.sprite.Group(self.static_objects).draw(self.background)
+        if self.show_heatmap:
+            heatmap = self.heatmaps.get(self.level.content_hash())
+            if heatmap is not None:
+                self._draw_heatmap(self.background, heatmap)
+            else:
+                self._request_heatmap()
+        pygame.draw.lines(self.background, GameUtils.RED, False, self.search_path, 2)
+        pygame.draw.lines(self.background, GameUtils.YELLOW, False, self.trajectory_path, 2)
+        self.full_redraw = True
+
+    def _draw_heatmap(self, surface, heatmap):
+        # Each expanded cell gets a red tint and the "searched" mark, more opaque the more it was expanded.
+        mark, rect = GameUtils.load_image('searched.png', rescale=(self.CELL_SIZE, self.CELL_SIZE))
+        from heatmap import heat_levels
+        shades = np.ceil(heat_levels(heatmap) * self.HEATMAP_SHADES).astype(int)
+        tiles = {}
+        for y, x in zip(*np.nonzero(shades)):
+            shade = shades[y, x]
+            tile = tiles.get(shade)
+            if tile is None:
+                heat = shade / self.HEATMAP_SHADES
+                tile = tiles[shade] = pygame.Surface(rect.size, pygame.SRCALPHA)
+                tile.fill((*GameUtils.RED, int(40 + 120 * heat)))
+                shaded_mark = mark.copy()
+                shaded_mark.set_alpha(int(60 + 195 * heat))
+                tile.blit(shaded_mark, (0, 0))
+            surface.blit(tile, (self.MARGIN_LEFT + x * self.CELL_SIZE, self.MARGIN_TOP + y * self.CELL_SIZE))
+
+    def _toggle_heatmap(self):
+        self.show_heatmap = not self.show_heatmap
+        if self.background is not None:
+            self._draw_background()
+
+    def _request_heatmap(self):
+        # Solve the current level again in the solver process, recording its expansions.
+        if self.pending_heatmap is not None and self.pending_heatmap[1] is self.level:
+            return
+        if self.pending_start is not None and self.pending_start[1] is self.level:
+            # The pending solution comes with its heatmap.
+            return
+        self.pending_heatmap = self._solve(self.level), self.level
+
+    def _check_pending_heatmap(self):
+        if self.pending_heatmap is None or not self.pending_heatmap[0].ready():
+            return
+        result, level = self.pending_heatmap
+        self.pending_heatmap = None
+        try:
+            self._remember_solution(level, *result.get())
+        except OverflowError as e:
+            logger.warning('No heatmap for level %s: %s', level.content_hash(), e)
+            return
+        if level is self.level and self.show_heatmap and self.background is not None:
+            self._draw_background()
+
+    def _solve(self, level):
+        # Solve `level` in the solver process, with its heatmap. The result raises `OverflowError` if A* failed.
+        from search import solve_level
+        return self.solver.apply_async(solve_level, (level, True, self.SOLVER_MAX_STEPS))
+
+    def _remember_solution(self, level, solution, heatmap=None):
+        if len(self.solutions) >= self.SOLUTION_CACHE_SIZE:
+            # Forget the oldest one.
+            forgotten = next(iter(self.solutions))
+            del self.solutions[forgotten]
+            self.heatmaps.pop(forgotten, None)
+        content_hash = level.content_hash()
+        self.solutions[content_hash] = solution
+        if heatmap is not None:
+            self.heatmaps[content_hash] = heatmap
+
+    def _initialize_controller(self, controller):
+        self.controller = controller
+
+    def _update_display(self):
+        if self.background is None:
+            # The first level is not ready yet.
+            return
+        # Only the areas that changed are redrawn and sent to the display: the sprites' old and new positions, and the
+        # menu panel (unless the whole screen needs redrawing, e.g. after a level change).
+        dirty = []
+        if self.full_redraw:
+            self.screen.blit(self.background, (0, 0))
+            dirty.append(self.screen.get_rect())
+            self.full_redraw = False
+            self.overlay.rect = None
+        # The overlay is drawn over the sprites: it is erased first, so that the sprites under it are drawn again.
+        dirty.extend(self.overlay.erase(self.screen, self.background))
+        self.sprites.clear(self.screen, self.background)
+        dirty.extend(self.sprites.draw(self.screen))
+        panel = self.menu.get_rect()
+        self.screen.blit(self.background, panel, panel)
+        self.menu.draw()
+        dirty.append(panel)
+        dirty.extend(self.overlay.draw(self.screen))
+        pygame.display.update(dirty)
+
+    def _update_collected(self):
+        for obj in self.game_objects:
+            if isinstance(obj, Item) and obj.x == self.player.x and obj.y == self.player.y:
+                obj.set_state(1)
+
+    def _teardown(self):
+        logger.info('Exiting...')
+        if self.enginestate.stop_event is not None:
+            self.enginestate.stop_event.set()
+        if self.enginestate.channel is not None:
+            if self.enginestate.optimizer_process is not None:
+                self.enginestate.optimizer_process.join()
+            self.enginestate.channel.close()
+        self.solver.terminate()
+        self.levels_to_save.put(None)
+        self.saver.join()
+        if self.pool is not None:
+            self.pool.close()
+        if self.corpus is not None:
+            self.corpus.close()
+        pygame.mixer.quit()
+        pygame.quit()
+
+    def start(self, mode, level_filename=None, level_id=None):
+        if self.level is None:
+            self._load_level(level_filename, level_id=level_id)
+        if self.level.content_hash() not in self.solutions:
+            # Solving may take a while: it is done by the solver process, and the level starts when the solution
+            # arrives (see `_check_pending_start()`). The previous frame stays on screen meanwhile.
+            if self.pending_start is not None and self.pending_start[1] is self.level:
+                result = self.pending_start[0]
+            else:
+                result = self._solve(self.level)
+            self.pending_start = result, self.level, mode
+            self._set_playing(False)
+            return
+        self.pending_start = None
+        self._clear_screen()
+        self._initialize_level()
+        self._set_mode(mode)
+        self._set_playing(True)
+
+    def _check_pending_start(self):
+        if self.pending_start is None or not self.pending_start[0].ready():
+            return
+        result, level, mode = self.pending_start
+        self.pending_start = None
+        try:
+            self._remember_solution(level, *result.get())
+        except OverflowError as e:
+            logger.warning('Skipping level %s, which the solver failed on: %s', level.content_hash(), e)
+            if level is self.level:
+                self._skip_level(mode)
+            return
+        if level is self.level:
+            self.start(mode)
+
+    def _skip_level(self, mode):
+        # Replace the current level by the next one (see `_check_new_level()`), or else by a new level generated in this
+        # process (see `_load_level()`).
+        entry = self.last_valid_level or self._pop_pool_level()
+        self.last_valid_level = None
+        if entry is None:
+            self._load_level()
+        else:
+            level, trajectory, fitness, solution = entry
+            self._load_level(level=level, trajectory=trajectory, fitness=fitness, solution=solution)
+        self.start(mode)
+
+    def _check_new_level(self):
+        level = None
+        trajectory = self.enginestate.trajectory
+        if self.enginestate.channel is not None:
+            latest = self.enginestate.channel.read()
+            if latest is not None:
+                level, fitness, solution, generation = latest
+                self.overlay.add_latency(time.time() - self.enginestate.channel.published_at)
+                self._save_level(level, trajectory, fitness, solution)
+            if self.overlay.visible:
+                self.overlay.set_metrics(self.enginestate.channel.read_metrics())
+
+        if self.enginestate.go_next_level:
+            # Load next level.
+            if level is None:
+                # No new level this time, but maybe we got an unused one still waiting?
+                if self.last_valid_level is not None:
+                    level, trajectory, fitness, solution = self.last_valid_level
+                else:
+                    # Otherwise take one from the pool.
+                    entry = self._pop_pool_level()
+                    if entry is None:
+                        return
+                    level, trajectory, fitness, solution = entry
+            assert level is not None
+            self.last_valid_level = None
+            self.enginestate.go_next_level = False
+            logger.debug('Going to next level')
+            self._load_level(level=level, trajectory=trajectory, fitness=fitness, solution=solution)
+            self.start(self.enginestate.mode)
+        elif level is not None:
+            # Remember it in case we need it later.
+            self.last_valid_level = level, trajectory, fitness, solution
+
+    def loop(self):
+        tick = 0
+        keys = []
+        key = None
+        self._play_sound('spawn')
+        while True:
+            pygame.event.pump()
+            for event in pygame.event.get():
+                if event.type == QUIT:
+                    self._teardown()
+                    sys.exit()
+                if event.type == KEYDOWN:
+                    if K_SPACE == event.key:
+                        self._teardown()
+                        sys.exit()
+                    elif K_F3 == event.key:
+                        self.overlay.toggle()
+                    elif K_F4 == event.key:
+                        self._toggle_heatmap()
+                    else:
+                        if self.enginestate.mode == self.MODE_KEYBOARD:
+                            keys.append(event)
+                elif event.type == pygame.MOUSEBUTTONDOWN:
+                    self.menu.on_mouse_down()
+                elif event.type == pygame.MOUSEBUTTONUP:
+                    self.menu.on_mouse_up()
+                elif event.type == CustomEvents.EVENT_MODE_CHANGED:
+                    self.start(event.message)
+                elif event.type == CustomEvents.EVENT_GO_NEXT_LEVEL:
+                    self.enginestate.go_next_level = True
+                elif event.type in (pygame.VIDEORESIZE, pygame.VIDEOEXPOSE):
+                    self.full_redraw = True
+            if self.enginestate.playing:
+                if len(keys) > 0:
+                    key = keys.pop(0)
+                else:
+                    key = None
+                action = self.controller.get_action(data=key)
+                if action is not None:
+                    state = self.world.perform(self.state, action)
+                    if state is not None:
+                        self.player.set_weight(self.world.get_weight(state))
+                        self.state = state
+                        player_pos = self.world.get_player_position(self.state)
+                        self.player.x, self.player.y = player_pos
+                        self.player.update_coords()
+                        self._update_collected()
+                        if self.player.x == self.exit.x and self.player.y == self.exit.y:
+                            self._play_sound('win')
+                            self._set_playing(False)
+                            self.clock.tick(1)
+                        else:
+                            self._play_sound('move')
+                    else:
+                        self._play_sound('blocked')
+            self.menu.update(self.enginestate)
+            self._update_display()
+            self.clock.tick(self.TICKS_PER_SECOND)
+            # Time spent on this frame, not counting the wait for the next tick.
+            self.overlay.add_frame_time(self.clock.get_rawtime())
+            tick += 1
+            if self.enginestate.mode == self.MODE_ASTAR and not self.enginestate.playing and self.pending_start is None:
+                self.enginestate.go_next_level = True
+            self._check_pending_start()
+            self._check_pending_heatmap()
+            self._check_new_level()
+
+
+class GameObject(pygame.sprite.Sprite):
+    def __init__(self, x, y, x_offset=0, y_offset=0):
+        self.x = x
+        self.y = y
+        self.x_offset = x_offset
+        self.y_offset = y_offset
+        self.update_coords()
+        self.killed = False
+        super().__init__()
+
+    def update_coords(self):
+        self.rect.x = GameEngine.MARGIN_LEFT + self.x * GameEngine.CELL_SIZE + self.x_offset
+        self.rect.y = GameEngine.MARGIN_TOP + self.y * GameEngine.CELL_SIZE + self.y_offset
+
+    def remove(self):
+        if not self.killed:
+            self.killed = True
+            self.kill()
+
+
+# Characters.
+
+class Player(GameObject):
+    def __init__(self, x, y):
+        self.image1, self.rect1 = GameUtils.load_image('player-1.png',
+                                                       rescale=(GameEngine.CELL_SIZE, GameEngine.CELL_SIZE))
+        self.image2, self.rect2 = GameUtils.load_image('player-2.png',
+                                                       rescale=(GameEngine.CELL_SIZE, GameEngine.CELL_SIZE))
+        self.image3, self.rect3 = GameUtils.load_image('player-3.png',
+                                                       rescale=(GameEngine.CELL_SIZE, GameEngine.CELL_SIZE))
+        self.set_weight(2)
+        # self.rect = self.rect2
+        super().__init__(x, y)
+
+    def set_weight(self, weight):
+        self.weight = weight
+        if weight <= 1:
+            self.image = self.image1
+            self.rect = self.rect1
+        elif weight >= 3:
+            self.image = self.image3
+            self.rect = self.rect3
+        else:
+            self.image = self.image2
+            self.rect = self.rect2
+
+
+# Obstacles.
+
+class Block(GameObject):
+    def __init__(self, x, y):
+        name = 'wall%d.png' % (np.random.randint(5) + 1)
+        self.image, self.rect = GameUtils.load_image(name, rescale=(GameEngine.CELL_SIZE, GameEngine.CELL_SIZE))
+        super().__init__(x, y)
+
+
+class Ice(GameObject):
+    def __init__(self, x, y):
+        self.image, self.rect = GameUtils.load_image('ice.png', rescale=(GameEngine.CELL_SIZE, GameEngine.CELL_SIZE))
+        super().__init__(x, y)
+
+
+class Tornado(GameObject):
+    def __init__(self, x, y):
+        self.image, self.rect = GameUtils.load_image('tornado.png',
+                                                     rescale=(GameEngine.CELL_SIZE, GameEngine.CELL_SIZE))
+        super().__init__(x, y)
+
+
+class Empty(GameObject):
+    def __init__(self, x, y):
+        # name = 'empty%d.png' % (((x + y) % 2) + 1)
+        name = 'empty%d.png' % (((x + y) % 1) + 1)
+        self.image, self.rect = GameUtils.load_image(name, rescale=(GameEngine.CELL_SIZE, GameEngine.CELL_SIZE))
+        super().__init__(x, y)
+
+
+# Items.
+
+class Item(GameObject):
+    def __init__(self, x, y):
+        self.images = []
+        self.rects = []
+        for image_name in self.image_names:
+            image, rect = GameUtils.load_image(image_name, rescale=(GameEngine.CELL_SIZE, GameEngine.CELL_SIZE))
+            self.images.append(image)
+            self.rects.append(rect)
+        self.set_state(0, False)
+        super().__init__(x, y)
+
+    def set_state(self, state, do_update = True):
+        self.image = self.images[state]
+        self.rect = self.rects[state]
+        
+        if do_update:
+            self.update_coords()
+
+class Cheese(Item):
+    def __init__(self, x, y):
+        self.image_names = ['cheese.png', 'cheese_collected.png']
+        super().__init__(x, y)
+
+
+class Wine(Item):
+    def __init__(self, x, y):
+        self.image_names = ['wine.png', 'wine_collected.png']
+        super().__init__(x, y)
+
+
+# Objectives.
+
+class Exit(GameObject):
+    def __init__(self, x, y):
+        self.image, self.rect = GameUtils.load_image('exit.png', rescale=(GameEngine.CELL_SIZE, GameEngine.CELL_SIZE))
+        super().__init__(x, y)
+
+
+def main(argv=None):
+    # Usage: front.py [corpus directory [level id]]
+    logging.basicConfig(level=logging.INFO, format='%(processName)s %(name)s: %(message)s')
+    argv = sys.argv[1:] if argv is None else argv
+    level_filename = argv[0] if len(argv) >= 1 else None
+    level_id = int(argv[1]) if len(argv) >= 2 else None
+    engine = GameEngine(fullscreen=False)
+    try:
+        engine.start(GameEngine.MODE_KEYBOARD, level_filename=level_filename, level_id=level_id)
+    except (FileNotFoundError, LookupError) as e:
+        engine._teardown()
+        return f'Cannot load the level: {e}'
+    engine.loop()
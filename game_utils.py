@@ -1,9 +1,15 @@
+import io
+import logging
 import os
+import threading
 import pygame
 from binascii import crc32
 from numpy import random
 
 
+logger = logging.getLogger(__name__)
+
+
 class GameUtils:
     DEFAULT_WIDTH = 32
     DEFAULT_HEIGHT = 32
@@ -11,6 +17,16 @@ class GameUtils:
     RED = (200, 0, 0)
     YELLOW = (255, 230, 20)
 
+    ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets')
+
+    # Process-wide asset caches: decoded (scaled, converted) images by (name, size), and sounds by name.
+    images = {}
+    sounds = {}
+    # Filled by `preload_assets()`: images decoded and scaled, but not converted yet, by (name, size), and the contents
+    # of sound files by name. Only the main thread converts images and creates sounds.
+    decoded_images = {}
+    sound_files = {}
+
     def _color_from_string(s):
         h = crc32(s.encode('utf-8'))
         color = (h % 256, (h//256) % 256, (h//65536) % 256)
@@ -23,13 +39,60 @@ class GameUtils:
         image.fill(color)
         return image, rect
 
-    def load_image(name, rescale=None):
-        fullname = os.path.join('assets', 'images', name)
+    def _decode_image(name, rescale=None):
+        fullname = os.path.join(GameUtils.ASSETS_DIR, 'images', name)
         try:
             image = pygame.image.load(fullname)
-        except pygame.error:
-            # print('Warning: cannot load image: %s, generating placeholder' % fullname)
-            return GameUtils.generate_placeholder_image(name)
+        except (pygame.error, FileNotFoundError):
+            logger.debug('Cannot load image %s, generating a placeholder', fullname)
+            return GameUtils.generate_placeholder_image(name)[0]
         if rescale is not None:
             image = pygame.transform.scale(image, rescale)
-        return image.convert_alpha(), image.get_rect()
+        return image
+
+    def _image_key(name, rescale):
+        return name, None if rescale is None else tuple(rescale)
+
+    def _sound_path(name):
+        return os.path.join(GameUtils.ASSETS_DIR, 'sound', name + '.wav')
+
+    def load_image(name, rescale=None):
+        # Images are shared: sprites must not draw on them. Each caller gets its own rect.
+        key = GameUtils._image_key(name, rescale)
+        image = GameUtils.images.get(key)
+        if image is None:
+            image = GameUtils.decoded_images.pop(key, None)
+            if image is None:
+                image = GameUtils._decode_image(name, rescale)
+            image = GameUtils.images[key] = image.convert_alpha()
+        return image, image.get_rect()
+
+    def load_sound(name):
+        sound = GameUtils.sounds.get(name)
+        if sound is None:
+            data = GameUtils.sound_files.pop(name, None)
+            source = GameUtils._sound_path(name) if data is None else io.BytesIO(data)
+            sound = GameUtils.sounds[name] = pygame.mixer.Sound(source)
+        return sound
+
+    def preload_assets(rescale, sound_names=()):
+        """
+        Decode and scale every image (at size `rescale`), and read the files of the sounds `sound_names`, in a
+        background thread. The thread does not touch the display or the mixer: `load_image()` and `load_sound()` finish
+        the work from the main thread. Returns the thread.
+        """
+        def preload():
+            for name in sorted(os.listdir(os.path.join(GameUtils.ASSETS_DIR, 'images'))):
+                key = GameUtils._image_key(name, rescale)
+                if name.endswith('.png') and key not in GameUtils.images:
+                    GameUtils.decoded_images[key] = GameUtils._decode_image(name, rescale)
+            for name in sound_names:
+                try:
+                    with open(GameUtils._sound_path(name), 'rb') as f:
+                        GameUtils.sound_files[name] = f.read()
+                except FileNotFoundError:
+                    logger.warning('Sound "%s" not found', name)
+
+        thread = threading.Thread(target=preload, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,124 @@
+"""
+Headless batch level generation.
+
+Evolves a number of levels (one optimization run per level, each for a new random trajectory) on parallel worker
+processes, and adds them to a level corpus (see `corpus.py`). This never imports pygame, so that it can run on servers
+with no display, e.g.:
+
+    python generate.py levels -n 100 --sizes 30x20 40x30 --seed 0 --workers 8 --time-budget 60
+"""
+
+import argparse
+import logging
+import multiprocessing
+import random
+import sys
+import time
+
+import numpy as np
+
+from corpus import LevelCorpus
+from level import Level
+from level import LEVEL_WIDTH, LEVEL_HEIGHT
+from optimize import make_algorithm
+from profiling import JsonlSink
+from trajectory import RandomWalkTrajectory
+
+
+def generate_level(width, height, seed=None, generations=100, time_budget=None, stagnation_generations=None,
+                   metrics_path=None):
+    """
+    Evolve one level for a new random trajectory.
+
+    :param seed: Seed of the random number generators of the trajectory and the algorithm, for reproducible levels
+        (the global `random` and `numpy.random` are used if `None`).
+    :param metrics_path: If not `None`, JSON lines file where the record of each generation (see `profiling.py`) is
+        appended, along with the seed and level size.
+    :return: A tuple `(packed level, trajectory, fitness, solution, stats)` where `stats` holds the time spent in each
+        phase and the number of generations and evaluations.
+    """
+    trajectory_rng, rng = random, np.random
+    if seed is not None:
+        trajectory_rng, rng = random.Random(seed), np.random.RandomState(seed % 2 ** 32)
+    start_time = time.perf_counter()
+    trajectory = RandomWalkTrajectory(width, height, rng=trajectory_rng)
+    trajectory_time = time.perf_counter()
+    algorithm = make_algorithm(trajectory, generations=generations, rng=rng)
+    sink = None if metrics_path is None else JsonlSink(metrics_path)
+    best = None
+    try:
+        for best in algorithm.run(time_budget=time_budget, stagnation_generations=stagnation_generations,
+                                  metrics_sink=None if sink is None else
+                                  lambda record: sink(dict(record, seed=seed, size=[width, height]))):
+            pass
+    finally:
+        if sink is not None:
+            sink.close()
+    level, fitness, solution = best
+    end_time = time.perf_counter()
+    stats = dict(trajectory=trajectory_time - start_time, evolution=end_time - trajectory_time,
+                 generations=algorithm.generation, evaluations=algorithm.evaluations)
+    return level.to_bytes(), trajectory, fitness, solution, stats
+
+
+def _generate_job(job):
+    return generate_level(**job)
+
+
+def parse_size(size):
+    width, height = size.lower().split('x')
+    return int(width), int(height)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate levels without a display, and add them to a level corpus.')
+    parser.add_argument('output', help='corpus directory (created if needed)')
+    parser.add_argument('-n', '--levels', type=int, default=10, help='number of levels to generate')
+    parser.add_argument('--sizes', type=parse_size, nargs='+', default=[(LEVEL_WIDTH, LEVEL_HEIGHT)],
+                        help='level sizes as WIDTHxHEIGHT, used in turn')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='seed of the first level (level i uses seed + i); random if not given')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--generations', type=int, default=100, help='maximum number of generations per level')
+    parser.add_argument('--time-budget', type=float, default=None, help='maximum number of seconds per level')
+    parser.add_argument('--stagnation', type=int, default=None,
+                        help='stop a level when its fitness did not improve for this many generations')
+    parser.add_argument('--metrics', default=None,
+                        help='JSON lines file where per-generation timings and counts are appended')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log the best fitness of each generation')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(processName)s %(name)s: %(message)s')
+
+    jobs = [dict(width=args.sizes[i % len(args.sizes)][0], height=args.sizes[i % len(args.sizes)][1],
+                 seed=None if args.seed is None else args.seed + i, generations=args.generations,
+                 time_budget=args.time_budget, stagnation_generations=args.stagnation, metrics_path=args.metrics)
+            for i in range(args.levels)]
+    totals = dict(trajectory=0.0, evolution=0.0, write=0.0, generations=0, evaluations=0)
+    n_added = 0
+    start_time = time.perf_counter()
+    with LevelCorpus(args.output) as corpus, multiprocessing.Pool(args.workers) as pool:
+        for i, (level_data, trajectory, fitness, solution, stats) in enumerate(
+                pool.imap_unordered(_generate_job, jobs)):
+            write_start = time.perf_counter()
+            size = len(corpus)
+            corpus.add(Level.from_bytes(level_data), trajectory, fitness, solution)
+            n_added += len(corpus) - size
+            totals['write'] += time.perf_counter() - write_start
+            for key in stats:
+                totals[key] += stats[key]
+            print(f'[{i + 1}/{len(jobs)}] {trajectory.level_width}x{trajectory.level_height} level with fitness '
+                  f'{fitness} after {stats["generations"]} generations ({stats["evolution"]:.1f}s)')
+    elapsed = time.perf_counter() - start_time
+
+    print(f'Generated {len(jobs)} levels ({n_added} new in {args.output}) in {elapsed:.1f}s: '
+          f'{len(jobs) / elapsed:.2f} levels/s')
+    print(f'Phases (summed over workers): trajectory {totals["trajectory"]:.2f}s, '
+          f'evolution {totals["evolution"]:.2f}s, corpus writes {totals["write"]:.2f}s')
+    print(f'{totals["generations"]} generations, {totals["evaluations"]} evaluations '
+          f'({totals["evaluations"] / max(totals["evolution"], 1e-9):.1f} evaluations/s per worker)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
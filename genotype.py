@@ -6,19 +6,20 @@ Created on Thu May 31 15:46:00 2018
 """
 
 from phenotype import Phenotype
-from level import Level
+from level import Level, pack_cells, unpack_cells
 import numpy as np
-import random
 
 class Genotype:
     
     #Add the map as a genotype and phenotype
     def __init__(self):
-        self.chromosomes = np.zeros(0, dtype=int)
+        self.chromosomes = np.zeros(0, dtype=Level.dtype)
 
-    def randomize(self, chromosomeSize, trajectory):
+    def randomize(self, chromosomeSize, trajectory, rng=None):
+        if rng is None:
+            rng = np.random
         self.level = Level(trajectory.level_width,trajectory.level_height)
-        self.level.generate_from_trajectory(trajectory, random.uniform(0,1))
+        self.level.generate_from_trajectory(trajectory, rng.uniform(0,1), rng)
         self.phenotype = Phenotype(self.level)
         self.chromosomes = self.level.cells.flatten()
         self.trajectory = trajectory
@@ -31,6 +32,23 @@ class Genotype:
             self.chromosomes.append(random.randint(0,1))
         """
             
+    def fromChromosomes(self, chromosomes, trajectory):
+        self.level = Level(trajectory.level_width, trajectory.level_height)
+        self.level.set_start(trajectory.get_start())
+        self.level.set_exit(trajectory.get_end())
+        self.phenotype = Phenotype(self.level)
+        self.chromosomes = np.array(chromosomes, dtype=Level.dtype)
+        self.trajectory = trajectory
+
+    """
+    Compact form of the chromosomes (4 bits per gene), e.g. to send them to another process
+    """
+    def pack(self):
+        return pack_cells(self.chromosomes)
+
+    def unpack(self, data, trajectory):
+        self.fromChromosomes(unpack_cells(data, trajectory.level_width * trajectory.level_height), trajectory)
+
     def getPhenotype(self):
         self.phenotype.levelFromChromosomes(self.chromosomes, self.trajectory,
                                             self.trajectory.level_width, self.trajectory.level_height)
@@ -0,0 +1,134 @@
+"""
+A* expansion heatmaps.
+
+A heatmap counts, for each cell of a level, how many A* states with the player on that cell were expanded while
+solving it (see `a_star_search()`): it shows where the difficulty of a level (and the time spent evaluating it) comes
+from. The game draws it over the level (F4), and this script exports it without a display:
+
+    python heatmap.py levels                     # best level of the `levels` corpus, to heatmap.png
+    python heatmap.py levels 12 -o heatmap.npy   # level 12, as a NumPy array (or .csv)
+"""
+
+import argparse
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+from level import CellType, Level
+from search import solve
+from world import World
+
+
+FORMATS = ('.png', '.npy', '.csv')
+
+# Colors of the PNG export: cells without expansions, blocks, and the most expanded cells (the other ones are blended
+# between the first and the last, on a logarithmic scale).
+WHITE = (255, 255, 255)
+GREY = (96, 96, 96)
+RED = (200, 0, 0)
+
+
+def level_heatmap(level):
+    """
+    Solve `level` with A*, recording its expansions.
+
+    :return: A tuple `(heatmap, path, n_steps)`, where `heatmap` is a (height, width) array of expansion counts, and
+        `path` and `n_steps` are as returned by `solve()`.
+    """
+    heatmap = np.zeros(level.cells.shape, dtype=np.uint32)
+    path, n_steps = solve(World(level), heatmap=heatmap)
+    return heatmap, path, n_steps
+
+
+def heat_levels(heatmap):
+    """
+    Heat of each cell, from 0 (never expanded) to 1 (the most expanded), on a logarithmic scale so that cells expanded
+    a few times remain visible next to the hot spots.
+    """
+    heat = np.log1p(heatmap, dtype=np.float64)
+    top = heat.max()
+    return heat / top if top > 0 else heat
+
+
+def encode_png(rgb):
+    """
+    Encode a (height, width, 3) array of bytes as a PNG image (without depending on pygame or an image library).
+    """
+    height, width, channels = rgb.shape
+    assert channels == 3
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    # Each row starts with its filter type (0: none).
+    rows = np.zeros((height, 1 + 3 * width), dtype=np.uint8)
+    rows[:, 1:] = rgb.reshape(height, 3 * width)
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows.tobytes(), 9))
+            + chunk(b'IEND', b''))
+
+
+def heatmap_image(heatmap, level=None, scale=16):
+    """
+    Render `heatmap` as an RGB array of `scale` pixels per cell, with the blocks of `level` (if given) in grey.
+    """
+    heat = heat_levels(heatmap)[..., np.newaxis]
+    rgb = (1 - heat) * np.array(WHITE) + heat * np.array(RED)
+    if level is not None:
+        rgb[(level.cells == CellType.BLOCK) & (heatmap == 0)] = GREY
+    rgb = np.round(rgb).astype(np.uint8)
+    return rgb.repeat(scale, axis=0).repeat(scale, axis=1)
+
+
+def save_heatmap(heatmap, path, level=None, scale=16):
+    """
+    Save `heatmap` to `path`, as a PNG image (see `heatmap_image()`), a NumPy array or CSV, depending on the extension.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.npy':
+        np.save(path, heatmap)
+    elif extension == '.csv':
+        np.savetxt(path, heatmap, fmt='%d', delimiter=',')
+    elif extension == '.png':
+        with open(path, 'wb') as f:
+            f.write(encode_png(heatmap_image(heatmap, level, scale)))
+    else:
+        raise ValueError(f'Unsupported heatmap format: {path} (use one of {", ".join(FORMATS)})')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the A* expansion heatmap of a level.')
+    parser.add_argument('corpus', help='corpus directory (see corpus.py)')
+    parser.add_argument('level_id', type=int, nargs='?', default=None,
+                        help='id of the level in the corpus (default: the one with the highest fitness)')
+    parser.add_argument('-o', '--output', default='heatmap.png',
+                        help=f'output file, whose extension gives the format ({", ".join(FORMATS)})')
+    parser.add_argument('--scale', type=int, default=16, help='pixels per cell of the PNG image')
+    parser.add_argument('--top', type=int, default=5, help='number of most expanded cells to print')
+    args = parser.parse_args(argv)
+    if os.path.splitext(args.output)[1].lower() not in FORMATS:
+        parser.error(f'unsupported output format: {args.output} (use one of {", ".join(FORMATS)})')
+
+    try:
+        level = Level.load_level(args.corpus, args.level_id)
+    except FileNotFoundError:
+        parser.error(f'no corpus at {args.corpus}')
+    except LookupError as e:
+        parser.error(str(e))
+    heatmap, path, n_steps = level_heatmap(level)
+    save_heatmap(heatmap, args.output, level, args.scale)
+    print(f'{level.width}x{level.height} level {level.content_hash()}: {n_steps} A* steps, '
+          f'{int(heatmap.sum())} expansions on {np.count_nonzero(heatmap)} cells, path of {len(path)} positions')
+    for index in np.argsort(heatmap, axis=None)[::-1][:args.top]:
+        y, x = np.unravel_index(index, heatmap.shape)
+        if heatmap[y, x]:
+            print(f'  ({x}, {y}): {heatmap[y, x]} expansions')
+    print(f'Heatmap saved to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -7,16 +7,33 @@ Created on Thu May 31 15:45:33 2018
 
 from genotype import Genotype
 from world import World
-import random
+import numpy as np
 import copy
 
 class Individual:
     
-    def __init__(self, id, chromosome_size, trajectory):
+    """
+    A new random individual, or one rebuilt from a packed genome (see `Genotype.pack`)
+    Random numbers are drawn from `rng` (here and in the methods below), a numpy `RandomState` (`numpy.random` by
+    default). The methods below also count offspring and mutations, and those rejected because they made the
+    trajectory invalid, in `counts` (a `collections.Counter`) if it is not None
+    """
+    def __init__(self, id, chromosome_size, trajectory, packed_genome=None, rng=None):
         self.id = id
         self.fitness = 0.0
+        # Whether the fitness is that of the current genotype (it is reset by crossovers and mutations).
+        self.evaluated = False
+        # Whether this is a new candidate (a new random individual or a crossover offspring) never evaluated in any
+        # form: only candidates are pre-screened (see `SurrogateScreen`), so that mutated elites are fully evaluated.
+        self.candidate = True
+        # Solution path and search statistics found when computing the fitness.
+        self.solution = None
+        self.stats = None
         self.genotype = Genotype()
-        self.genotype.randomize(chromosome_size, trajectory)
+        if packed_genome is None:
+            self.genotype.randomize(chromosome_size, trajectory, rng)
+        else:
+            self.genotype.unpack(packed_genome, trajectory)
         self.chromosome_size = chromosome_size
         
     def individualID(self):
@@ -25,12 +42,14 @@ class Individual:
     """
     TWO POINT CROSSOVER
     """
-    def crossover(self, otherInd):
+    def crossover(self, otherInd, rng=None, counts=None):
         #print("Individual " + str(self.id) + " is doing the crossover with Individual " + str(otherInd.id))
         #2-point-crossover
+        if rng is None:
+            rng = np.random
         
-        lower_bound = random.randint(0, len(self.genotype.chromosomes) - 1)
-        higher_bound = random.randint(lower_bound, len(self.genotype.chromosomes) - 1)        
+        lower_bound = rng.randint(0, len(self.genotype.chromosomes))
+        higher_bound = rng.randint(lower_bound, len(self.genotype.chromosomes))
         
         offsprings = []
         offsprings.append(copy.deepcopy(self))
@@ -39,55 +58,100 @@ class Individual:
         for i in range(lower_bound, higher_bound + 1):
             offsprings[0].getGenotype().chromosomes[i] = otherInd.getGenotype().chromosomes[i]
             offsprings[1].getGenotype().chromosomes[i] = self.getGenotype().chromosomes[i]
+        for offspring in offsprings:
+            offspring.evaluated = False
+            offspring.candidate = True
         
         
         #Check for validity of the world
         world_validity = World(offsprings[0].getPhenotype().level)
+        rejections = 0
         if world_validity.validate_trajectory(offsprings[0].getGenotype().trajectory) == False:
             offsprings[0] = copy.deepcopy(self)
+            rejections += 1
         if world_validity.validate_trajectory(offsprings[1].getGenotype().trajectory) == False:
             offsprings[1] = copy.deepcopy(otherInd)
+            rejections += 1
+        if counts is not None:
+            counts['crossovers'] += 2
+            counts['crossover_rejections'] += rejections
         
         return offsprings 
     
     """
     Mutate an individual chromosome! (called from the algorithm!)
     """
-    def mutate(self, mutation_probability):
+    def mutate(self, mutation_probability, rng=None):
         possible_tiles = [0,1,5,6,7,8]
         tries = 10
+        if rng is None:
+            rng = np.random
         
         #print("Individual " + str(self.id) + " is MUTATING")
         while tries > 0 :
             tries -= 1
             mutated_individual = copy.deepcopy(self)
-            if random.uniform(0,1) < mutation_probability:
-                mutated_individual.genotype.chromosomes[random.randint(0, len(self.genotype.chromosomes) - 1)] = possible_tiles[random.randint(0, len(possible_tiles) - 1)]
+            if rng.uniform(0,1) < mutation_probability:
+                mutated_individual.genotype.chromosomes[rng.randint(0, len(self.genotype.chromosomes))] = possible_tiles[rng.randint(0, len(possible_tiles))]
             world_validity = World(mutated_individual.getPhenotype().level)
             if world_validity.validate_trajectory(mutated_individual.getGenotype().trajectory) == True :
                 self.genotype = copy.deepcopy(mutated_individual.genotype)
+                self.evaluated = False
         return
     
     """
-    Test each chromosome for mutation
+    Test each chromosome for mutation (all at once)
     """
-    def mutateAll(self, mutation_probability):
+    def mutateAll(self, mutation_probability, rng=None, counts=None):
         possible_tiles = [0,1,5,6,7,8]
         chromosome_size = len(self.genotype.chromosomes)
-        
+        if rng is None:
+            rng = np.random
 
         mutated_individual = copy.deepcopy(self)
         
-        for i in range(chromosome_size):
-            if random.uniform(0, 1) < mutation_probability:
-                mutated_individual.genotype.chromosomes[i] = possible_tiles[random.randint(0, len(possible_tiles) - 1)]
+        mutated = rng.uniform(0, 1, size=chromosome_size) < mutation_probability
+        mutated_individual.genotype.chromosomes[mutated] = rng.choice(possible_tiles, size=np.count_nonzero(mutated))
                 
+        self.keepMutation(mutated_individual, counts)
+
+    """
+    Keep the genotype of `mutated_individual` if the trajectory is still valid in its level
+    """
+    def keepMutation(self, mutated_individual, counts=None):
         world_validity = World(mutated_individual.getPhenotype().level)
-        if world_validity.validate_trajectory(mutated_individual.getGenotype().trajectory) == True :
+        valid = world_validity.validate_trajectory(mutated_individual.getGenotype().trajectory)
+        if valid:
             self.genotype = copy.deepcopy(mutated_individual.genotype)
+            self.evaluated = False
+        if counts is not None:
+            counts['mutations'] += 1
+            counts['mutation_rejections'] += not valid
+
+    """
+    Mutate a number of chromosomes following the same distribution as mutateAll, but chosen in proportion to the
+    per-cell `weights` (a height x width array) rather than uniformly
+    """
+    def mutateGuided(self, mutation_probability, weights, rng=None, counts=None):
+        possible_tiles = [0,1,5,6,7,8]
+        if rng is None:
+            rng = np.random
+        weights = weights.ravel()
+        n_mutations = min(rng.binomial(len(self.genotype.chromosomes), mutation_probability),
+                          np.count_nonzero(weights))
+        if n_mutations == 0:
+            return
+
+        mutated_individual = copy.deepcopy(self)
+        genes = rng.choice(len(weights), size=n_mutations, replace=False, p=weights / weights.sum())
+        mutated_individual.genotype.chromosomes[genes] = rng.choice(possible_tiles, size=n_mutations)
+
+        self.keepMutation(mutated_individual, counts)
 
     def setFitness(self, fitness):
         self.fitness = fitness
+        self.evaluated = True
+        self.candidate = False
         
     def getFitness(self):
         return self.fitness
@@ -0,0 +1,37 @@
+"""
+Fast launch of optimizer processes.
+
+Optimizer processes are started from a fork server (where the platform supports it) which imports the optimizer modules
+once, in the background, when the game starts. Each new optimizer process is then forked from it with everything
+already imported, instead of starting a new interpreter and importing the search stack again. Neither the fork
+server nor its processes import pygame: they only import the main script as `__mp_main__`, and `front.py` keeps the
+game out of it.
+"""
+
+import multiprocessing
+
+
+# Modules imported by the fork server before it forks anything.
+PRELOADED_MODULES = ['numpy', 'level', 'world', 'search', 'trajectory', 'algorithm', 'optimize', 'pool']
+
+
+def get_context():
+    """
+    Multiprocessing context to start optimizer processes with. Events, queues and shared arrays passed to these
+    processes must be created from the same context.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context()
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(PRELOADED_MODULES)
+    return context
+
+
+def warm_up(context):
+    """
+    Start the fork server of `context` now (it imports the preloaded modules in the background) rather than when the
+    first process is started.
+    """
+    if context.get_start_method() == 'forkserver':
+        from multiprocessing import forkserver
+        forkserver.ensure_running()
@@ -5,7 +5,8 @@ Created on Thu May 31 17:14:26 2018
 @author: dominik.scherer
 """
 
-import random
+import hashlib
+import struct
 from enum import IntEnum
 
 import numpy as np
@@ -26,19 +27,21 @@ class CellType(IntEnum):
     TORNADO = 7
     ICE = 8
 
+initial_weights = {
+    CellType.BLOCK: 80,
+    CellType.WINE: 5,
+    CellType.CHEESE: 5,
+    CellType.TORNADO: 30,
+    CellType.ICE: 30,
+
+    CellType.START: 0,
+    CellType.EXIT: 0,
+    CellType.TRAJECTORY: 0,
+    CellType.EMPTY: 0,
+ }
+
 def PreprocessInitialDistribution():
-    weights = {
-        CellType.BLOCK: 80,
-        CellType.WINE: 5,
-        CellType.CHEESE: 5,
-        CellType.TORNADO: 30,
-        CellType.ICE: 30,
-
-        CellType.START: 0,
-        CellType.EXIT: 0,
-        CellType.TRAJECTORY: 0,
-        CellType.EMPTY: 0,
-     }
+    weights = initial_weights
     
     sum = 0
     for key, value in weights.items():
@@ -56,6 +59,28 @@ def PreprocessInitialDistribution():
 
 cell_distribution = PreprocessInitialDistribution()
 
+# Same weights as an array indexed by cell type value, for vectorized sampling.
+cell_weights = np.array([initial_weights[cell_type] for cell_type in CellType], dtype=float)
+
+def pack_cells(cells):
+    """
+    Pack an array of cell types into bytes, 4 bits per cell.
+    """
+    flat = np.asarray(cells, dtype=np.uint8).ravel()
+    if len(flat) % 2 == 1:
+        flat = np.append(flat, np.uint8(0))
+    return ((flat[0::2] << 4) | flat[1::2]).tobytes()
+
+def unpack_cells(data, count):
+    """
+    Unpack the first `count` cell types from bytes produced by `pack_cells()`, as a flat uint8 array.
+    """
+    packed = np.frombuffer(data, dtype=np.uint8, count=(count + 1) // 2)
+    flat = np.empty(2 * len(packed), dtype=np.uint8)
+    flat[0::2] = packed >> 4
+    flat[1::2] = packed & 0x0F
+    return flat[:count]
+
 class Cell(object):
     def __init__(self, type, state=None):
         self.type = type
@@ -127,28 +152,81 @@ class WineCell(PickableItemCell):
 
 
 class Level:
-    def load_level(level_filename):
-        # TODO
-        return Level(10, 10)
+    types = {
+        CellType.EMPTY: EmptyCell,
+        CellType.BLOCK: BlockCell,
+        CellType.START: StartPositionCell,
+        CellType.EXIT: ExitCell,
+        CellType.TRAJECTORY: TrajectoryCell,
+        CellType.WINE: WineCell,
+        CellType.CHEESE: CheeseCell,
+        CellType.TORNADO: TornadoCell,
+        CellType.ICE: IceCell
+    }
+
+    # Cells are stored as one byte each (there are fewer than 16 cell types, see `to_bytes()`).
+    dtype = np.uint8
+
+    # Header of the packed format: width and height.
+    header = struct.Struct('<HH')
+
+    def load_level(level_filename, level_id=None):
+        """
+        Load level `level_id` (by default, the one with the highest fitness) from the corpus at `level_filename` (see
+        `corpus.load_entry()`, which raises `FileNotFoundError` or `LookupError` if there is no such level).
+        """
+        from corpus import load_entry
+        return load_entry(level_filename, level_id).level
 
     def __init__(self, width, height):
-        self.types = {
-            CellType.EMPTY: EmptyCell,
-            CellType.BLOCK: BlockCell,
-            CellType.START: StartPositionCell,
-            CellType.EXIT: ExitCell,
-            CellType.TRAJECTORY: TrajectoryCell,
-            CellType.WINE: WineCell,
-            CellType.CHEESE: CheeseCell,
-            CellType.TORNADO: TornadoCell,
-            CellType.ICE: IceCell
-        }
         self.width = width
         self.height = height
-        self.cells = np.zeros((height, width), dtype=int)
+        self.cells = np.zeros((height, width), dtype=self.dtype)
         self.reset_border()
         self.start = None
         self.exit = None
+
+    def __reduce__(self):
+        # Pickle (and send across processes) using the compact packed format.
+        return Level.from_bytes, (self.to_bytes(),)
+
+    def to_bytes(self):
+        """
+        Serialize the level with 4 bits per cell.
+
+        Start and exit are not stored separately: they are recovered from the cells by `from_bytes()`.
+        """
+        return self.header.pack(self.width, self.height) + pack_cells(self.cells)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Rebuild a level serialized by `to_bytes()`.
+        """
+        width, height = cls.header.unpack_from(data)
+        level = cls.__new__(cls)
+        level.width = width
+        level.height = height
+        level.cells = unpack_cells(data[cls.header.size:], width * height).reshape(height, width)
+        level.start = level.find(CellType.START)
+        level.exit = level.find(CellType.EXIT)
+        return level
+
+    def content_hash(self):
+        """
+        Digest of the level's content, e.g. to cache data about a level.
+        """
+        return hashlib.blake2b(self.to_bytes(), digest_size=16).hexdigest()
+
+    def find(self, cell_type):
+        """
+        Position of the first cell of type `cell_type` (scanning column by column), or `None` if there is none.
+        """
+        found = np.argwhere(self.cells.T == cell_type)
+        if len(found) == 0:
+            return None
+        x, y = found[0].tolist()
+        return x, y
         
     def reset_border(self):
         self.cells[:, 0] = CellType.BLOCK.value
@@ -170,22 +248,26 @@ class Level:
         self.exit = pos
         self.set(pos, CellType.EXIT)
         
-    def generate_from_trajectory(self, trajectory, density=0.1):
+    def generate_from_trajectory(self, trajectory, density=0.1, rng=None):
         self.set_start(trajectory.get_start())
         self.set_exit(trajectory.get_end())
-        self.generate_valid(trajectory, density)
+        self.generate_valid(trajectory, density, rng)
         
-    def generate_simple(self, trajectory, density):
+    def generate_simple(self, trajectory, density, rng=None):
+        if rng is None:
+            rng = np.random
         blocked_cells = trajectory.get_traversed_cells()
         for i in range(1, self.width-1):
             for j in range(1, self.height-1):
                 pos = (i,j)
                 if pos not in blocked_cells:
-                    if random.random() < density:
+                    if rng.random() < density:
                         self.set(pos, CellType.BLOCK)
         
-    def random_state(self):
-        r = random.random()
+    def random_state(self, rng=None):
+        if rng is None:
+            rng = np.random
+        r = rng.random()
         for cell_type, bounds in cell_distribution.items():
             lower, upper = bounds[0], bounds[1]
             if r >= lower and r < upper:
@@ -193,37 +275,62 @@ class Level:
         
         raise ValueError
 
-    def generate_valid(self, trajectory, density = 0.2):
-        from world import World
+    def allowed_tiles(self, trajectory):
+        """
+        Compute which cell types each cell may take while keeping `trajectory` valid.
+
+        Cells off the trajectory may take any type. Cells on the trajectory are restricted, based on the player's
+        weight when entering them, to the types that neither block the player nor change its weight.
+
+        :return: A boolean array of shape (height, width, len(CellType)).
+        """
+        from world import World, MAX_WEIGHT_ON_ICE, MIN_WEIGHT_ON_TORNADO
+
+        allowed = np.zeros((self.height, self.width, len(CellType)), dtype=bool)
+        allowed[1:-1, 1:-1, :] = True
+        for x, y in trajectory.get_traversed_cells():
+            allowed[y, x, :] = False
+        for pos, weight in World(self).trajectory_weights(trajectory):
+            x, y = pos
+            allowed[y, x, :] = False
+            if self.cells[y, x] in (CellType.WINE, CellType.CHEESE):
+                # Existing items shape the weight profile: leave them alone.
+                continue
+            allowed[y, x, CellType.EMPTY] = True
+            allowed[y, x, CellType.ICE] = weight <= MAX_WEIGHT_ON_ICE
+            allowed[y, x, CellType.TORNADO] = weight >= MIN_WEIGHT_ON_TORNADO
+        for pos in (self.start, self.exit):
+            if pos is not None:
+                allowed[pos[1], pos[0], :] = False
+        return allowed
+
+    def generate_valid(self, trajectory, density = 0.2, rng = None):
+        """
+        Randomly fill `density` of the level while keeping `trajectory` valid.
+
+        Changed cells are drawn without replacement among the cells that can take at least one weighted type, and
+        their new types are drawn from `cell_distribution` restricted to what `allowed_tiles` permits, all in one go.
+        """
+        if rng is None:
+            rng = np.random
 
         self.set_start(trajectory.get_start())
         self.set_exit(trajectory.get_end())
-        world = World(self)
-        
-        num_changes = int(density * self.width * self.height)
-        
-        iterations = 0
-        while num_changes != 0:
-            # select a random cell
-            cell = (random.randint(1,self.width-2), random.randint(1,self.height-2))
-            # select a new state for this cell
-            old_state = self.get(cell)
-            new_state = self.random_state()
-            self.set(cell, new_state)
-            # validate that the new level is traversable by the trajectory
-            if world.validate_trajectory(trajectory):
-                num_changes -= 1
-            else:
-                self.set(cell, CellType(old_state))
-            iterations += 1
-            if iterations > 1000:
-                return
-        
+
+        weights = (self.allowed_tiles(trajectory) * cell_weights).reshape(-1, len(CellType))
+        candidates = np.flatnonzero(weights.sum(axis=1))
+        num_changes = min(int(density * self.width * self.height), len(candidates))
+
+        changed = rng.choice(candidates, size=num_changes, replace=False)
+        cumulative = np.cumsum(weights[changed], axis=1)
+        draws = rng.random(num_changes) * cumulative[:, -1]
+        self.cells.flat[changed] = (cumulative <= draws[:, None]).sum(axis=1)
+
         self.set_start(self.start)
         self.set_exit(self.exit)
 
     def generate_from_matrix(self, matrix, trajectory = None):
-        self.cells = matrix
+        self.cells = np.asarray(matrix, dtype=self.dtype)
         self.set_start(self.start)
         self.set_exit(self.exit)
         self.reset_border()
@@ -2,55 +2,286 @@
 Genetic algorithm optimization.
 """
 
+import logging
+import math
+import os
 import queue
 import time
 
 from multiprocessing import Event, Process, Queue
 
+import numpy as np
+
 from algorithm import Algorithm
+from channel import LatestLevelChannel
+from checkpoint import checkpoint_trajectory, island_checkpoint_path, load_checkpoint
 from level import Level
 from level import LEVEL_WIDTH, LEVEL_HEIGHT
+from profiling import ChannelSink, record_metrics
 from trajectory import RandomWalkTrajectory
 
 
-def optimize(output_queue, stop_event, trajectory, width=LEVEL_WIDTH, height=LEVEL_HEIGHT, put_period=10, density=0.2):
+logger = logging.getLogger(__name__)
+
+
+def make_algorithm(trajectory, evaluator=None, steady_state=False, generations=1000, rng=None):
+    return Algorithm(trajectory=trajectory, width=trajectory.level_width, height=trajectory.level_height,
+                     population_size=10,
+                     tournament_size=5,
+                     mutation_probability=0.01,
+                     generations=generations, chromosome_size=100,
+                     evaluator=evaluator, steady_state=steady_state, rng=rng)
+
+
+def process_rng(seed=None):
+    """
+    Random generator of an optimizer process. Processes forked from the same parent (islands, pool fillers, and every
+    process started from the fork server, see `launcher.py`) inherit the same `numpy.random` state: each one needs its
+    own generator, or they would all evolve the same population.
+
+    :param seed: `numpy.random.SeedSequence` of the generator (by default, a new one seeded from the OS entropy).
+    """
+    return np.random.RandomState(np.random.MT19937(np.random.SeedSequence() if seed is None else seed))
+
+
+def algorithm_counters(algorithm):
+    """
+    Counters of `algorithm` from which the optimizer metrics are computed (see `ThroughputMeter`).
+    """
+    best = algorithm.population[0]
+    counters = dict(generations=algorithm.generation, evaluations=algorithm.evaluations, cache_hits=0,
+                    cache_lookups=0, expansions=best.stats['n_steps'] if best.stats else math.nan,
+                    record=algorithm.profiler.last_record)
+    if algorithm.diversity is not None:
+        diversity = algorithm.diversity
+        counters.update(cache_hits=diversity.n_cache_hits,
+                        cache_lookups=diversity.n_cache_hits + diversity.n_clones + diversity.n_evaluated)
+    return counters
+
+
+class ThroughputMeter:
+
+    """
+    Optimizer metrics shown by the game (see `LatestLevelChannel.publish_metrics()`), computed from the counters of
+    one or several algorithms (e.g. islands) since they were first reported.
+    """
+
+    def __init__(self):
+        self.first = {}
+        self.last = {}
+        self.first_time = {}
+
+    def update(self, source, counters):
+        """
+        Record the latest `counters` (see `algorithm_counters()`) of algorithm `source`.
+        """
+        if source not in self.first:
+            self.first[source] = counters
+            self.first_time[source] = time.perf_counter()
+        self.last[source] = counters
+
+    def _rate(self, name):
+        now = time.perf_counter()
+        return sum((self.last[source][name] - self.first[source][name]) / (now - self.first_time[source])
+                   for source in self.last if now > self.first_time[source])
+
+    def metrics(self, best_source=None):
+        """
+        :param best_source: Algorithm holding the best level, whose A* expansions are reported.
+        """
+        lookups = sum(counters['cache_lookups'] for counters in self.last.values())
+        hits = sum(counters['cache_hits'] for counters in self.last.values())
+        expansions = math.nan
+        if best_source in self.last:
+            expansions = self.last[best_source]['expansions']
+        return dict(generations_per_second=self._rate('generations'),
+                    evaluations_per_second=self._rate('evaluations'),
+                    cache_hit_rate=hits / lookups if lookups else math.nan,
+                    expansions=expansions)
+
+
+def resume_if_possible(algorithm, checkpoint_path):
+    """
+    Resume `algorithm` from the checkpoint at `checkpoint_path`, if there is one for the same trajectory.
+
+    :return: Whether the algorithm was resumed.
+    """
+    if checkpoint_path is None or not os.path.exists(checkpoint_path):
+        return False
+    try:
+        trajectory = checkpoint_trajectory(load_checkpoint(checkpoint_path))
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning('Ignoring unreadable checkpoint %s: %s', checkpoint_path, e)
+        return False
+    if not trajectory.same_as(algorithm.trajectory):
+        return False
+    algorithm.resume(checkpoint_path)
+    logger.info('Resumed from %s at generation %d', checkpoint_path, algorithm.generation)
+    return True
+
+
+def optimize(channel, stop_event, trajectory, width=LEVEL_WIDTH, height=LEVEL_HEIGHT, put_period=10, density=0.2,
+             evaluator=None, steady_state=False, generations=1000, time_budget=None, delivery_period=None,
+             stagnation_generations=None, checkpoint_path=None, checkpoint_period=10, metrics_sink=None,
+             profile_generation=None):
     """
     Launch optimization.
 
-    :param output_queue: Queue where the interesting results of the optimization process should be put.
+    :param channel: `LatestLevelChannel` where the best level is published, whenever it improves and at least every
+        `put_period` generations.
     :param stop_event: Event that should be set when this function must return.
+    :param evaluator: Fitness evaluation backend (see `evaluators.py`), in this process by default.
+    :param steady_state: Whether to use the steady-state algorithm (see `Algorithm.runSteadyState()`) rather than the
+        generational one. In that mode a "generation" is `population_size // 2` evaluations.
+    :param generations: Maximum number of generations (`None` for no limit).
+    :param time_budget: If not `None`, stop after this many seconds.
+    :param delivery_period: If not `None`, adapt the population size and A* budget so that a generation takes about
+        this many seconds (see `Algorithm.run()`).
+    :param stagnation_generations: If not `None`, stop when the best fitness did not improve for this many generations.
+    :param checkpoint_path: If not `None`, save a checkpoint there every `checkpoint_period` generations and when
+        stopping, and resume from it if it exists for the same trajectory.
+    :param metrics_sink: If not `None`, callable receiving the record of each generation (see `profiling.py`), besides
+        the channel.
+    :param profile_generation: If not `None`, profile this generation with cProfile (see `Algorithm.run()`).
     """
-    algorithm = Algorithm(trajectory=trajectory, width=trajectory.level_width, height=trajectory.level_height,
-                          population_size=10,
-                          tournament_size=5,
-                          mutation_probability=0.01,
-                          generations=1000, chromosome_size=100)
+    algorithm = make_algorithm(trajectory, evaluator, steady_state, generations, rng=process_rng())
+    resume_if_possible(algorithm, checkpoint_path)
+    meter = ThroughputMeter()
 
-    for best_level, fitness in algorithm.run():
-        try:
-            output_queue.put_nowait((best_level, trajectory, fitness))
-        except queue.Full:
-            print('Warning: output queue is full')
+    published_fitness = None
+    for best_level, fitness, solution in algorithm.run(
+            time_budget=time_budget, delivery_period=delivery_period, stagnation_generations=stagnation_generations,
+            checkpoint_path=checkpoint_path, checkpoint_period=checkpoint_period,
+            metrics_sink=[ChannelSink(channel)] + ([] if metrics_sink is None else [metrics_sink]),
+            profile_generation=profile_generation, stop_event=stop_event):
+        generation = algorithm.generation
+        meter.update(0, algorithm_counters(algorithm))
+        channel.publish_metrics(**meter.metrics(best_source=0))
+        if published_fitness is None or fitness > published_fitness or generation % put_period == 0:
+            channel.publish(best_level, fitness, path=solution or (), generation=generation)
+            published_fitness = fitness
+        if stop_event.is_set():
+            logger.info('Stop event detected - stopping optimization')
+            break
+    if checkpoint_path is not None:
+        algorithm.checkpoint(checkpoint_path)
+
+
+
+def optimize_island(island_id, inbox, outbox, results, stop_event, trajectory, migration_period=5, migration_size=2,
+                    checkpoint_path=None, seed=None):
+    """
+    Evolve one island of the island model (see `optimize_islands()`).
+
+    :param island_id: Index of this island.
+    :param inbox: Queue receiving migrants from the previous island.
+    :param outbox: Queue where this island's migrants are sent, every `migration_period` generations.
+    :param results: Queue where this island reports its counters (see `algorithm_counters()`) after each generation,
+        along with its best level when it improved.
+    :param stop_event: Event that should be set when this function must return.
+    :param migration_size: Number of individuals sent to the next island at each migration.
+    :param checkpoint_path: If not `None`, where this island is checkpointed (see `optimize()`).
+    :param seed: `numpy.random.SeedSequence` of this island's random generator (see `process_rng()`).
+    """
+    algorithm = make_algorithm(trajectory, rng=process_rng(seed))
+    resume_if_possible(algorithm, checkpoint_path)
+
+    best_fitness = None
+    for best_level, fitness, solution in algorithm.run(checkpoint_path=checkpoint_path, stop_event=stop_event):
+        generation = algorithm.generation
+        if best_fitness is None or fitness > best_fitness:
+            best_fitness = fitness
+            results.put((island_id, generation, best_level.to_bytes(), fitness, solution,
+                         algorithm_counters(algorithm)))
+        else:
+            results.put((island_id, generation, None, fitness, None, algorithm_counters(algorithm)))
+        if generation % migration_period == migration_period - 1:
+            outbox.put(algorithm.emigrants(migration_size))
+        while True:
+            try:
+                algorithm.immigrate(inbox.get_nowait())
+            except queue.Empty:
+                break
         if stop_event.is_set():
-            print('Stop event detected - stopping optimization')
             break
+    if checkpoint_path is not None:
+        algorithm.checkpoint(checkpoint_path)
+    # Do not wait for the other end to consume what we sent when exiting.
+    outbox.cancel_join_thread()
+    results.cancel_join_thread()
+
+
+def optimize_islands(channel, stop_event, trajectory, n_islands=None, migration_period=5, migration_size=2,
+                     checkpoint_dir=None):
+    """
+    Launch optimization with the island model.
+
+    Each island is an independent `Algorithm` evolving levels for the same trajectory in its own process. Islands form
+    a ring: every `migration_period` generations, each one sends copies of its `migration_size` best individuals (as
+    packed genomes, with their fitness and solution) to the next one, where they replace the worst individuals. This process gathers the islands'
+    results and publishes the global best level whenever it improves.
+
+    :param channel: `LatestLevelChannel` where the global best level is published.
+    :param stop_event: Event that should be set when this function must return.
+    :param n_islands: Number of islands (defaults to the number of CPUs).
+    :param checkpoint_dir: If not `None`, directory where island `i` is checkpointed to `island-<i>.npz`, and resumed
+        from if the file exists for the same trajectory.
+    """
+    if n_islands is None:
+        n_islands = os.cpu_count() or 1
+    inboxes = [Queue() for i in range(n_islands)]
+    # Islands evolve the same trajectory: they only differ by their random generators.
+    seeds = np.random.SeedSequence().spawn(n_islands)
+    results = Queue()
+    islands = [Process(target=optimize_island,
+                       kwargs=dict(island_id=i, inbox=inboxes[i], outbox=inboxes[(i + 1) % n_islands],
+                                   results=results, stop_event=stop_event, trajectory=trajectory,
+                                   migration_period=migration_period, migration_size=migration_size,
+                                   checkpoint_path=island_checkpoint_path(checkpoint_dir, i), seed=seeds[i]))
+               for i in range(n_islands)]
+    for island in islands:
+        island.start()
+
+    best_fitness = None
+    best_island = None
+    meter = ThroughputMeter()
+    while any(island.is_alive() for island in islands) or not results.empty():
+        try:
+            island_id, generation, level_data, fitness, solution, counters = results.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        meter.update(island_id, counters)
+        if counters['record'] is not None:
+            channel.publish_metrics(**record_metrics(counters['record']))
+        if level_data is not None and (best_fitness is None or fitness > best_fitness):
+            best_fitness = fitness
+            best_island = island_id
+            channel.publish(Level.from_bytes(level_data), fitness, path=solution or (), generation=generation)
+        channel.publish_metrics(**meter.metrics(best_source=best_island))
+
+    for island in islands:
+        island.join()
 
 
 if __name__ == '__main__':
     # Test code.
-    output_queue = Queue()
+    logging.basicConfig(level=logging.INFO, format='%(processName)s %(name)s: %(message)s')
+    channel = LatestLevelChannel(LEVEL_WIDTH, LEVEL_HEIGHT)
     stop_event = Event()
-    process = Process(target=optimize, kwargs=dict(output_queue=output_queue, stop_event=stop_event, put_period=1))
+    trajectory = RandomWalkTrajectory(LEVEL_WIDTH, LEVEL_HEIGHT)
+    process = Process(target=optimize, kwargs=dict(channel=channel, stop_event=stop_event, trajectory=trajectory,
+                                                   put_period=1))
     process.start()
     stop_time = time.time() + 10
     while time.time() < stop_time:
-        try:
-            item = output_queue.get(block=True, timeout=1)
-        except queue.Empty:
-            pass
-        print('Obtained an item from the queue')
+        item = channel.read()
+        if item is not None:
+            logger.info('Obtained a level from the channel')
         if not process.is_alive():
-            print('Our dear child died :(')
+            logger.error('Our dear child died :(')
             break
+        time.sleep(0.1)
 
     stop_event.set()
+    process.join()
+    channel.close()
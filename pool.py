@@ -0,0 +1,204 @@
+"""
+Pool of ready-to-play levels, bucketed by difficulty.
+
+The pool keeps up to `per_tier` unplayed levels in each difficulty tier (a range of fitness), so that a new level can
+be served at once. Levels are stored in a `LevelCorpus` (see `corpus.py`), and the pool itself (the ids of unplayed
+levels, per tier) is saved next to it, so that it persists between sessions. Filler processes (`fill_pool()`) evolve
+levels for random trajectories and send those reaching a tier that is not full; a background thread of the pool
+writes them to the corpus, so that the game's frames never wait on the disk.
+"""
+
+import collections
+import json
+import logging
+import math
+import os
+import queue
+import multiprocessing
+import threading
+import time
+
+from level import Level
+from trajectory import RandomWalkTrajectory
+
+
+logger = logging.getLogger(__name__)
+
+# Lowest fitness of each tier (the last tier has no upper bound).
+TIERS = (1, 100, 300, 1000)
+
+
+def tier_of(fitness, tiers=TIERS):
+    """
+    Index of the tier `fitness` belongs to, or `None` if it is below the first tier (e.g. levels A* failed on).
+    """
+    tier = None
+    for i, lowest in enumerate(tiers):
+        if fitness >= lowest:
+            tier = i
+    return tier
+
+
+def fill_pool(results, stop_event, missing, width, height, tiers=TIERS, time_budget=120.0, stagnation_generations=30):
+    """
+    Evolve levels until `stop_event` is set, sending those reaching a tier that is not full to `results`.
+
+    Each run starts from a new random trajectory. As the best fitness grows, the first level reaching each tier is
+    sent, then the run moves on to a new trajectory when all harder tiers are full, it stagnates for
+    `stagnation_generations` generations or it lasts `time_budget` seconds.
+
+    :param results: Queue receiving (packed level, trajectory, fitness, solution) tuples.
+    :param missing: Shared array holding the number of levels missing in each tier (kept up to date by the pool).
+    """
+    from optimize import make_algorithm, process_rng
+
+    rng = process_rng()
+
+    while not stop_event.is_set():
+        if not any(missing):
+            time.sleep(0.5)
+            continue
+        trajectory = RandomWalkTrajectory(width, height)
+        algorithm = make_algorithm(trajectory, generations=None, rng=rng)
+        sent = set()
+        for level, fitness, solution in algorithm.run(time_budget=time_budget,
+                                                      stagnation_generations=stagnation_generations,
+                                                      stop_event=stop_event):
+            tier = tier_of(fitness, tiers)
+            if tier is not None and tier not in sent and missing[tier] > 0:
+                results.put((level.to_bytes(), trajectory, fitness, solution))
+                sent.add(tier)
+            if stop_event.is_set() or not any(missing[tier or 0:]):
+                break
+    results.cancel_join_thread()
+
+
+class LevelPool:
+
+    FILENAME = 'pool.json'
+
+    def __init__(self, corpus, per_tier=5, tiers=TIERS, n_fillers=1, context=None):
+        """
+        Constructor.
+
+        :param corpus: `LevelCorpus` where levels are stored. The pool is saved in the same directory.
+        :param per_tier: Number of levels to keep ready in each tier.
+        :param tiers: Lowest fitness of each tier.
+        :param n_fillers: Number of filler processes started by `start()`.
+        :param context: Multiprocessing context used to start filler processes (see `launcher.py`).
+        """
+        self.corpus = corpus
+        self.per_tier = per_tier
+        self.tiers = tiers
+        self.n_fillers = n_fillers
+        self.context = multiprocessing.get_context() if context is None else context
+        self.path = os.path.join(corpus.path, self.FILENAME)
+        self.ready = [collections.deque() for tier in tiers]
+        self.missing = self.context.Array('i', len(tiers))
+        self.results = None
+        self.stop_event = None
+        self.fillers = []
+        # Thread adding the levels sent by the fillers (see `_collect()`), and the lock it shares with `pop()`.
+        self.collector = None
+        self.closing = False
+        self.lock = threading.Lock()
+        self.load()
+        self._update_missing()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning('Ignoring unreadable level pool %s: %s', self.path, e)
+            return
+        for level_id in saved.get('ready', []):
+            if 0 <= level_id < len(self.corpus):
+                self._push_id(level_id)
+
+    def save(self):
+        with self.lock:
+            ready = [level_id for tier in self.ready for level_id in tier]
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(ready=ready), f)
+        os.replace(temporary_path, self.path)
+
+    def _push_id(self, level_id):
+        fitness = self.corpus.fitnesses[level_id]
+        tier = None if math.isnan(fitness) else tier_of(fitness, self.tiers)
+        if tier is not None and len(self.ready[tier]) < self.per_tier and level_id not in self.ready[tier]:
+            self.ready[tier].append(level_id)
+        self._update_missing()
+
+    def _update_missing(self):
+        for tier, ready in enumerate(self.ready):
+            self.missing[tier] = max(self.per_tier - len(ready), 0)
+
+    def push(self, level, trajectory, fitness, solution=None):
+        """
+        Add a level to the corpus, and to the pool if its tier is not full.
+        """
+        level_id = self.corpus.add(level, trajectory, fitness, solution)
+        with self.lock:
+            self._push_id(level_id)
+
+    def pop(self, tier):
+        """
+        Take an unplayed level out of the pool, from `tier` or else from the closest tier with levels.
+
+        :return: A `CorpusEntry`, or `None` if the pool is empty.
+        """
+        with self.lock:
+            level_id = None
+            for candidate in sorted(range(len(self.tiers)), key=lambda t: (abs(t - tier), -t)):
+                if self.ready[candidate]:
+                    level_id = self.ready[candidate].popleft()
+                    self._update_missing()
+                    break
+        return None if level_id is None else self.corpus.get(level_id)
+
+    def start(self, width, height):
+        """
+        Start the filler processes, and the thread adding the levels they send.
+        """
+        self.results = self.context.Queue()
+        self.stop_event = self.context.Event()
+        self.collector = threading.Thread(target=self._collect, daemon=True)
+        self.collector.start()
+        for i in range(self.n_fillers):
+            filler = self.context.Process(target=fill_pool,
+                                          kwargs=dict(results=self.results, stop_event=self.stop_event,
+                                                      missing=self.missing, width=width, height=height,
+                                                      tiers=self.tiers),
+                                          daemon=True)
+            filler.start()
+            self.fillers.append(filler)
+
+    def _collect(self):
+        # Add the levels sent by the filler processes as they arrive, until `close()` and the queue is empty.
+        while True:
+            try:
+                level_data, trajectory, fitness, solution = self.results.get(timeout=0.5)
+            except queue.Empty:
+                if self.closing:
+                    break
+                continue
+            self.push(Level.from_bytes(level_data), trajectory, fitness, solution)
+
+    def close(self):
+        """
+        Stop the filler processes and save the pool.
+        """
+        if self.stop_event is not None:
+            self.stop_event.set()
+            # Fillers check the event once per generation.
+            for filler in self.fillers:
+                filler.join(timeout=1)
+                if filler.is_alive():
+                    filler.terminate()
+            self.closing = True
+            self.collector.join()
+        self.save()
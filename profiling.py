@@ -0,0 +1,169 @@
+"""
+Per-generation profiling of the genetic algorithm.
+
+`Algorithm.run()` times the phases of each generation (evaluate, select, replace, mutate) with a `GenerationProfiler`,
+which also counts the crossover offspring and mutations rejected because they made the trajectory invalid. At the end
+of each generation it builds a record (a dict) and hands it to sinks: any callable taking a record, such as a
+`JsonlSink` (one JSON line per generation), a `ChannelSink` (shown by the game) or a callback. With diversity control,
+the record also holds the diversity metrics of the population (see `DiversityFilter.metrics()`). It can also profile
+one chosen generation with cProfile.
+"""
+
+import collections
+import contextlib
+import cProfile
+import json
+import logging
+import math
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+PHASES = ('evaluate', 'select', 'replace', 'mutate')
+
+
+def memory_snapshot():
+    """
+    Memory used by this process (in bytes): its peak resident set size, and the memory traced by `tracemalloc` if it
+    is tracing.
+    """
+    memory = {}
+    if resource is not None:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Bytes on macOS, kilobytes elsewhere.
+        memory['max_rss'] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+    if tracemalloc.is_tracing():
+        memory['traced'], memory['traced_peak'] = tracemalloc.get_traced_memory()
+    return memory
+
+
+def record_metrics(record):
+    """
+    Metrics of `record` shown by the game (see `LatestLevelChannel.METRIC_NAMES`).
+    """
+    metrics = {f'{phase}_seconds': record['phases'][phase] for phase in PHASES}
+    for name in ('crossover', 'mutation'):
+        count = record[f'{name}s']
+        metrics[f'{name}_rejection_rate'] = record[f'{name}_rejections'] / count if count else math.nan
+    return metrics
+
+
+class GenerationProfiler:
+
+    """
+    Phase timings, rejection counts and memory of each generation, as records sent to sinks.
+    """
+
+    def __init__(self, sinks=(), profile_generation=None, profile_path=None):
+        """
+        Constructor.
+
+        :param sinks: Callables receiving the record of each generation.
+        :param profile_generation: If not `None`, the phases of this generation are profiled with cProfile.
+        :param profile_path: Where the profile is saved (see `pstats`), by default `generation-<generation>.prof`.
+        """
+        self.sinks = list(sinks)
+        self.profile_generation = profile_generation
+        self.profile_path = profile_path
+        self.profile = None
+        # Crossover offspring and mutations, and how many of them were rejected (see `Individual.crossover()`).
+        self.counts = collections.Counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.generation = None
+        # Start of the current generation (`None` between generations).
+        self.start_time = None
+        self.start_evaluations = 0
+        self.last_record = None
+
+    def start_generation(self, generation, evaluations):
+        self.generation = generation
+        self.start_time = time.perf_counter()
+        self.start_evaluations = evaluations
+        self.counts.clear()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        if generation == self.profile_generation:
+            self.profile = cProfile.Profile()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Context manager timing (and profiling, if requested) a phase of the current generation.
+        """
+        if self.profile is not None:
+            self.profile.enable()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] += time.perf_counter() - start_time
+            if self.profile is not None:
+                self.profile.disable()
+
+    def end_generation(self, algorithm):
+        """
+        Build the record of the current generation of `algorithm` and send it to the sinks.
+
+        Its `seconds` are the wall-clock time since `start_generation()`, which includes the time the caller of
+        `Algorithm.run()` spent on the best level of the generation, unlike the phase timings.
+        """
+        record = dict(generation=self.generation, time=time.time(), seconds=time.perf_counter() - self.start_time,
+                      phases=self.phases, evaluations=algorithm.evaluations - self.start_evaluations,
+                      total_evaluations=algorithm.evaluations, population_size=len(algorithm.population),
+                      best_fitness=algorithm.population[0].getFitness(),
+                      crossovers=self.counts['crossovers'], crossover_rejections=self.counts['crossover_rejections'],
+                      mutations=self.counts['mutations'], mutation_rejections=self.counts['mutation_rejections'],
+                      memory=memory_snapshot())
+        if algorithm.diversity is not None:
+            record['diversity'] = algorithm.diversity.metrics(algorithm.population)
+        if self.profile is not None:
+            path = self.profile_path or f'generation-{self.generation}.prof'
+            self.profile.dump_stats(path)
+            self.profile = None
+            record['profile'] = path
+            logger.info('Profile of generation %d saved to %s', self.generation, path)
+        self.last_record = record
+        self.start_time = None
+        for sink in self.sinks:
+            sink(record)
+        return record
+
+
+class JsonlSink:
+
+    """
+    Sink appending each record to a JSON lines file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ChannelSink:
+
+    """
+    Sink publishing the phase timings and rejection rates of each record to a `LatestLevelChannel`, for the game's
+    performance overlay.
+    """
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def __call__(self, record):
+        self.channel.publish_metrics(**record_metrics(record))
@@ -0,0 +1,186 @@
+"""
+End-to-end throughput regression harness for the genetic algorithm.
+
+Runs `Algorithm.run()` headless for fixed seeds and generation budgets, with several population sizes and evaluator
+backends, and measures generations per second, evaluations per second, and the best fitness reached per second. Each
+run is repeated and only the fastest repeat is kept, to filter out the noise of the machine. Results are compared to a
+JSON baseline, and the harness fails (exit status 1) if any throughput dropped by more than the tolerance:
+
+    python regression.py --update          # record the baseline (on this machine)
+    python regression.py                   # compare to it
+
+Throughput depends on the machine, so baselines should only be compared on the machine they were recorded on. Runs
+are deterministic for a given seed, so a best fitness differing from the baseline means that the search itself
+changed, not only its speed.
+"""
+
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from algorithm import Algorithm
+from evaluators import EvaluationServer
+from trajectory import RandomWalkTrajectory
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'throughput_baseline.json')
+
+# Arguments of `Algorithm` for each evaluator backend (`workers` is the number of local workers of an
+# `EvaluationServer`).
+BACKENDS = collections.OrderedDict([
+    ('local', dict()),
+    ('surrogate', dict(screen_fraction=0.5)),
+    ('diversity', dict(dedup_distance=0)),
+    ('server', dict(workers=2)),
+])
+
+POPULATION_SIZES = (10, 40)
+SEEDS = (0, 1)
+REPEATS = 3
+
+# Metrics that must not regress.
+THROUGHPUT_METRICS = ('generations_per_second', 'evaluations_per_second', 'fitness_per_second')
+
+
+def run_config(backend, population_size, seed, generations=10, width=12, height=10):
+    """
+    Run the algorithm once.
+
+    :param backend: Name of the evaluator backend (see `BACKENDS`).
+    :param seed: Seed of the trajectory and the algorithm.
+    :return: A dict with the elapsed time, the number of generations and evaluations, and the best fitness.
+    """
+    kwargs = dict(BACKENDS[backend])
+    n_workers = kwargs.pop('workers', None)
+    evaluator = None
+    if n_workers is not None:
+        evaluator = EvaluationServer()
+        evaluator.start_local_workers(n_workers)
+    try:
+        trajectory = RandomWalkTrajectory(width, height, rng=random.Random(seed))
+        algorithm = Algorithm(trajectory=trajectory, width=width, height=height, population_size=population_size,
+                              tournament_size=5, mutation_probability=0.01, generations=generations,
+                              chromosome_size=100, evaluator=evaluator, rng=np.random.RandomState(seed), **kwargs)
+        start_time = time.perf_counter()
+        best_fitness = None
+        for level, fitness, solution in algorithm.run():
+            best_fitness = fitness if best_fitness is None else max(best_fitness, fitness)
+        elapsed = time.perf_counter() - start_time
+    finally:
+        if evaluator is not None:
+            evaluator.close()
+    return dict(seconds=elapsed, generations=algorithm.generation, evaluations=algorithm.evaluations,
+                best_fitness=best_fitness)
+
+
+def run_harness(backends=None, population_sizes=POPULATION_SIZES, seeds=SEEDS, generations=10, width=12, height=10,
+                repeats=REPEATS, verbose=True):
+    """
+    Run every configuration (backend and population size) for all `seeds`.
+
+    :param repeats: Number of runs of each configuration and seed, of which only the fastest one is kept.
+    :return: A dict mapping `'<backend>/<population size>'` to the throughput metrics, over all seeds.
+    """
+    backends = list(BACKENDS) if backends is None else backends
+    results = collections.OrderedDict()
+    for backend in backends:
+        for population_size in population_sizes:
+            runs = [min((run_config(backend, population_size, seed, generations, width, height)
+                         for _ in range(repeats)), key=lambda run: run['seconds'])
+                    for seed in seeds]
+            seconds = sum(run['seconds'] for run in runs)
+            best_fitness = float(np.mean([run['best_fitness'] for run in runs]))
+            result = dict(generations_per_second=sum(run['generations'] for run in runs) / seconds,
+                          evaluations_per_second=sum(run['evaluations'] for run in runs) / seconds,
+                          fitness_per_second=sum(run['best_fitness'] for run in runs) / seconds,
+                          best_fitness=best_fitness)
+            key = f'{backend}/{population_size}'
+            results[key] = result
+            if verbose:
+                print(f'{key:<16} {result["generations_per_second"]:8.2f} generations/s '
+                      f'{result["evaluations_per_second"]:9.1f} evaluations/s '
+                      f'{result["fitness_per_second"]:9.1f} fitness/s (best fitness {best_fitness:g})')
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare `results` to `baseline` (both as returned by `run_harness()`).
+
+    :return: The list of regressions, as human-readable strings.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            print(f'{key}: no baseline')
+            continue
+        reference = baseline[key]
+        for metric in THROUGHPUT_METRICS:
+            ratio = result[metric] / reference[metric] if reference[metric] else float('inf')
+            if ratio < 1 - tolerance:
+                regressions.append(f'{key} {metric}: {result[metric]:.2f} vs {reference[metric]:.2f} in the '
+                                   f'baseline ({ratio - 1:+.0%})')
+        if result['best_fitness'] != reference['best_fitness']:
+            print(f'{key}: best fitness {result["best_fitness"]:g} vs {reference["best_fitness"]:g} in the baseline '
+                  f'(the search changed)')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the throughput of the genetic algorithm, and compare it to '
+                                                 'a baseline.')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON baseline file')
+    parser.add_argument('--update', action='store_true', help='write the results to the baseline instead of '
+                                                              'comparing them')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='largest accepted throughput drop, as a fraction of the baseline')
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=None,
+                        help=f'evaluator backends (default: all of {", ".join(BACKENDS)})')
+    parser.add_argument('--population-sizes', type=int, nargs='+', default=list(POPULATION_SIZES))
+    parser.add_argument('--seeds', type=int, nargs='+', default=list(SEEDS))
+    parser.add_argument('--generations', type=int, default=10, help='number of generations of each run')
+    parser.add_argument('--repeats', type=int, default=REPEATS,
+                        help='number of repeats of each run, of which only the fastest one is kept')
+    parser.add_argument('--size', type=int, nargs=2, default=(12, 10), metavar=('WIDTH', 'HEIGHT'),
+                        help='level size')
+    args = parser.parse_args(argv)
+    if args.repeats < 1:
+        parser.error('--repeats must be at least 1')
+
+    backends = list(BACKENDS) if args.backends is None else args.backends
+    settings = dict(backends=backends, population_sizes=args.population_sizes, seeds=args.seeds,
+                    generations=args.generations, size=list(args.size), repeats=args.repeats)
+    baseline = None
+    if not args.update and os.path.exists(args.baseline):
+        # Checked before running anything: results measured with other settings cannot be compared.
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['settings'] != settings:
+            print(f'Error: the baseline was recorded with other settings: {baseline["settings"]}')
+            return 2
+
+    results = run_harness(backends, args.population_sizes, args.seeds, args.generations, *args.size,
+                          repeats=args.repeats)
+    if baseline is None:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(dict(settings=settings, results=results), f, indent=2)
+        print(f'Baseline written to {args.baseline}')
+        return 0
+
+    regressions = compare(results, baseline['results'], args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if regressions:
+        return 1
+    print(f'No throughput regression beyond {args.tolerance:.0%}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
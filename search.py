@@ -6,10 +6,22 @@ A lot of code copied from:
 """
 
 import heapq
+import logging
 import sys
 
+import numpy as np
 
-from world import Action
+from world import Action, World
+
+
+logger = logging.getLogger(__name__)
+
+
+class SearchBudgetExceeded(OverflowError):
+
+    """
+    Raised when A* gives up after its maximum number of steps.
+    """
 
 
 class PriorityQueue:
@@ -91,7 +103,7 @@ def heuristic(from_node_def, to_node_def):
     return sum(abs(a - b) for a, b in zip(from_node_def, to_node_def))
 
 
-def a_star_search(graph, start, exit_definition, extract_definition):
+def a_star_search(graph, start, exit_definition, extract_definition, max_steps=None, heatmap=None):
     """
     A* algorithm.
 
@@ -102,6 +114,9 @@ def a_star_search(graph, start, exit_definition, extract_definition):
     :param extract_definition: A function that, when applied on a node, extracts its definition, to be compared to
         `exit_definition` in order to compute the heuristic and check if the exit is reached. Typically this function
         just extracts the position corresponding to the node.
+    :param max_steps: If not `None`, give up (raising `SearchBudgetExceeded`) after this many steps.
+    :param heatmap: If not `None`, a (height, width) array where the number of expansions of each position is added
+        (node definitions must then be (x, y) positions).
     """
     frontier = PriorityQueue()
     frontier.put(start, 0)
@@ -112,31 +127,42 @@ def a_star_search(graph, start, exit_definition, extract_definition):
     current = None
     found = False
     n_steps = 0
-    while not frontier.empty():
-        n_steps += 1
-        if n_steps % 100000 == 0:
-            print(f'A* steps: {n_steps}')
-        current = frontier.get()
-
-        if extract_definition(current) == exit_definition:
-            # Reached the exit!
-            found = True
-            break
-
-        if current in processed:
-            # TODO This happens a lot! Needs investigating!
-            # print(f'Ignoring {current}')
-            continue
-
-        processed.add(current)
-
-        for next_ in graph.neighbors(current):
-            new_cost = cost_so_far[current] + graph.cost(current, next_)
-            if next_ not in cost_so_far or new_cost < cost_so_far[next_]:
-                cost_so_far[next_] = new_cost
-                priority = new_cost + heuristic(extract_definition(next_), exit_definition)
-                frontier.put(next_, priority)
-                came_from[next_] = current
+    expanded = None if heatmap is None else []
+    try:
+        while not frontier.empty():
+            n_steps += 1
+            if max_steps is not None and n_steps > max_steps:
+                raise SearchBudgetExceeded(f'A* gave up after {max_steps} steps')
+            if n_steps % 100000 == 0:
+                logger.debug('A* steps: %d', n_steps)
+            current = frontier.get()
+
+            if extract_definition(current) == exit_definition:
+                # Reached the exit!
+                found = True
+                break
+
+            if current in processed:
+                # TODO This happens a lot! Needs investigating!
+                # print(f'Ignoring {current}')
+                continue
+
+            processed.add(current)
+            if expanded is not None:
+                expanded.append(extract_definition(current))
+
+            for next_ in graph.neighbors(current):
+                new_cost = cost_so_far[current] + graph.cost(current, next_)
+                if next_ not in cost_so_far or new_cost < cost_so_far[next_]:
+                    cost_so_far[next_] = new_cost
+                    priority = new_cost + heuristic(extract_definition(next_), exit_definition)
+                    frontier.put(next_, priority)
+                    came_from[next_] = current
+    finally:
+        if expanded:
+            # Definitions are (x, y) positions.
+            xs, ys = zip(*expanded)
+            np.add.at(heatmap, (ys, xs), 1)
 
     if not found:
         # TODO Understand why this happens
@@ -145,9 +171,60 @@ def a_star_search(graph, start, exit_definition, extract_definition):
     return came_from, cost_so_far, current, n_steps
 
 
+def reconstruct_path(came_from, current):
+    """
+    Follow `came_from` links back from `current`.
+
+    :return: The list of nodes from the start node to `current`.
+    """
+    path = []
+    while current is not None:
+        path.append(current)
+        current = came_from[current]
+    path.reverse()
+    return path
+
+
+def solve(world, heatmap=None, max_steps=None):
+    """
+    Find the shortest way out of `world` with A*.
+
+    :param heatmap: If not `None`, a (height, width) array where the number of expansions of each cell is added (see
+        `a_star_search()`).
+    :param max_steps: If not `None`, give up (raising `SearchBudgetExceeded`) after this many steps.
+    :return: A tuple `(path, n_steps)` where `path` is the list of player positions from start to exit, and `n_steps`
+        is the number of A* steps it took to find it.
+    """
+    exit_position, exit_cell = world.level.get_exit()
+    came_from, cost_so_far, current, n_steps = a_star_search(
+        graph=WorldGraph(world), start=world.init_state,
+        exit_definition=exit_position,
+        extract_definition=world.get_player_position, max_steps=max_steps, heatmap=heatmap)
+    path = [world.get_player_position(state) for state in reconstruct_path(came_from, current)]
+    return path, n_steps
+
+
+def solve_level(level, heatmap=False, max_steps=None):
+    """
+    Solve `level` with A* (see `solve()`), e.g. in another process.
+
+    :param max_steps: If not `None`, give up after this many steps.
+    :return: The list of player positions from start to exit, or if `heatmap` is True, a tuple `(path, heatmap)` where
+        `heatmap` is a (height, width) array counting the expansions of each cell.
+    :raise OverflowError: If A* fails, or gives up (`SearchBudgetExceeded`).
+    """
+    if not heatmap:
+        path, n_steps = solve(World(level), max_steps=max_steps)
+        return path
+    heatmap = np.zeros(level.cells.shape, dtype=np.uint32)
+    path, n_steps = solve(World(level), heatmap=heatmap, max_steps=max_steps)
+    return path, heatmap
+
+
 def main():
-    # Test code, if needed.
-    return 0
+    # Benchmark the search on the fixed benchmark levels (see `benchmark.py`).
+    from benchmark import main as benchmark_main
+    return benchmark_main(['neighbors', 'a_star_search'] + sys.argv[1:])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,186 @@
+"""
+Cheap surrogate of the fitness, used to pre-screen candidates before running A* on them.
+
+The surrogate features are computed with whole-array operations on `Level.cells`, ignoring the player's weight:
+- the relaxed (BFS) distance from start to exit,
+- the number of items reachable from the start,
+- the number of weight gates (tornado and ice cells) lying on relaxed shortest paths.
+"""
+
+import collections
+import logging
+
+import numpy as np
+
+from evaluators import Evaluator
+from level import CellType
+
+
+logger = logging.getLogger(__name__)
+
+
+def relaxed_distances(passable, source):
+    """
+    BFS distances from `source` (an (x, y) position) over the `passable` boolean grid, ignoring weight constraints.
+
+    :return: An integer grid of distances, -1 where unreachable.
+    """
+    distances = np.full(passable.shape, -1, dtype=np.int32)
+    frontier = np.zeros(passable.shape, dtype=bool)
+    frontier[source[1], source[0]] = True
+    reached = frontier.copy()
+    distance = 0
+    while frontier.any():
+        distances[frontier] = distance
+        grown = np.zeros_like(frontier)
+        grown[1:, :] |= frontier[:-1, :]
+        grown[:-1, :] |= frontier[1:, :]
+        grown[:, 1:] |= frontier[:, :-1]
+        grown[:, :-1] |= frontier[:, 1:]
+        frontier = grown & passable & ~reached
+        reached |= frontier
+        distance += 1
+    return distances
+
+
+def level_features(level):
+    """
+    Surrogate features of `level`.
+
+    :return: An array `[relaxed distance, reachable items, gates on shortest paths]`. The distance is -1 if the exit
+        cannot be reached even when ignoring weights.
+    """
+    cells = level.cells
+    passable = cells != CellType.BLOCK
+    from_start = relaxed_distances(passable, level.start)
+    from_exit = relaxed_distances(passable, level.exit)
+    distance = from_start[level.exit[1], level.exit[0]]
+    reachable = from_start >= 0
+    items = reachable & ((cells == CellType.WINE) | (cells == CellType.CHEESE))
+    on_shortest_path = reachable & (from_exit >= 0) & (from_start + from_exit == distance)
+    gates = on_shortest_path & ((cells == CellType.TORNADO) | (cells == CellType.ICE))
+    return np.array([distance, np.count_nonzero(items), np.count_nonzero(gates)])
+
+
+class SurrogateScreen(Evaluator):
+
+    """
+    Two-stage evaluator: only candidates whose surrogate score beats a threshold are passed on to the full evaluator.
+
+    The others get a fitness of 0 without any search. Only new candidates (see `Individual.candidate`: new random
+    individuals and crossover offspring) are screened; elites, mutated or not, always go on to the full evaluation (the
+    algorithm does not evaluate unchanged individuals again). Unless a fixed `threshold` is given, it is the quantile of the
+    recent surrogate scores that lets `keep_fraction` of the candidates through. The correlation between surrogate
+    scores and actual fitnesses is logged (at the INFO level) every `report_period` full evaluations, to help tune
+    `WEIGHTS` and the threshold.
+    """
+
+    # Weights of the features in the surrogate score.
+    WEIGHTS = np.array([1.0, 10.0, 5.0])
+    # Number of scores to collect before screening anything.
+    MIN_SAMPLES = 20
+
+    def __init__(self, evaluator, keep_fraction=0.5, threshold=None, window=200, report_period=100):
+        """
+        Constructor.
+
+        :param evaluator: The full evaluator.
+        :param keep_fraction: Target fraction of candidates going on to the full evaluation.
+        :param threshold: Fixed surrogate score threshold, overriding `keep_fraction`.
+        :param window: Number of recent scores (and score/fitness pairs) remembered.
+        :param report_period: Number of full evaluations between two correlation reports.
+        """
+        self.evaluator = evaluator
+        self.keep_fraction = keep_fraction
+        self.threshold = threshold
+        self.report_period = report_period
+        self.scores = collections.deque(maxlen=window)
+        self.pairs = collections.deque(maxlen=window)
+        self.screened = {}
+        self.rejected = []
+        self.n_kept = 0
+        self.n_screened = 0
+        self.n_recorded = 0
+
+    def score(self, level):
+        features = level_features(level)
+        if features[0] < 0:
+            return -np.inf
+        return float(self.WEIGHTS @ features)
+
+    def current_threshold(self):
+        if self.threshold is not None:
+            return self.threshold
+        if len(self.scores) < self.MIN_SAMPLES:
+            return -np.inf
+        return float(np.quantile(self.scores, 1 - self.keep_fraction))
+
+    def _screen(self, individual):
+        # Whether `individual` deserves a full evaluation. If not, its fitness is set to 0.
+        if not individual.candidate:
+            return True
+        score = self.score(individual.getPhenotype().level)
+        threshold = self.current_threshold()
+        self.scores.append(score)
+        self.n_screened += 1
+        if score >= threshold:
+            self.n_kept += 1
+            self.screened[id(individual)] = score
+            return True
+        individual.setFitness(0)
+        individual.solution = None
+        individual.stats = None
+        return False
+
+    def submit(self, individual):
+        if self._screen(individual):
+            self.evaluator.submit(individual)
+        else:
+            self.rejected.append(individual)
+
+    def completed(self, timeout=None):
+        done, self.rejected = self.rejected, []
+        evaluated = self.evaluator.completed(timeout=0 if done else timeout)
+        for individual in evaluated:
+            self._record(self.screened.pop(id(individual), None), individual.getFitness())
+        return done + evaluated
+
+    def pending(self):
+        return self.evaluator.pending() + len(self.rejected)
+
+    def capacity(self):
+        return self.evaluator.capacity()
+
+    def set_search_budget(self, max_steps):
+        self.evaluator.set_search_budget(max_steps)
+
+    def set_record_heatmaps(self, enabled):
+        self.evaluator.set_record_heatmaps(enabled)
+
+    def evaluate(self, individuals):
+        kept = [individual for individual in individuals if self._screen(individual)]
+        self.evaluator.evaluate(kept)
+        for individual in kept:
+            self._record(self.screened.pop(id(individual), None), individual.getFitness())
+
+    def close(self):
+        self.evaluator.close()
+
+    def correlation(self):
+        """
+        Pearson correlation between surrogate scores and fitnesses of recent full evaluations (`nan` if undefined).
+        """
+        pairs = np.array([pair for pair in self.pairs if np.isfinite(pair[0])]).reshape(-1, 2)
+        if len(pairs) < 2 or pairs[:, 0].std() == 0 or pairs[:, 1].std() == 0:
+            return np.nan
+        return float(np.corrcoef(pairs[:, 0], pairs[:, 1])[0, 1])
+
+    def _record(self, score, fitness):
+        if score is None:
+            # Not screened (not a candidate).
+            return
+        self.pairs.append((score, fitness))
+        self.n_recorded += 1
+        if self.n_recorded % self.report_period == 0 and logger.isEnabledFor(logging.INFO):
+            logger.info('Surrogate/fitness correlation: %.2f (threshold %.1f, kept %d/%d)', self.correlation(),
+                        self.current_threshold(), self.n_kept, self.n_screened)
@@ -0,0 +1,76 @@
+import math
+import multiprocessing
+import random
+
+import numpy as np
+
+from channel import LatestLevelChannel
+from level import Level
+from trajectory import RandomWalkTrajectory
+
+
+def random_level(width=12, height=10, seed=0):
+    trajectory = RandomWalkTrajectory(width, height, rng=random.Random(seed))
+    level = Level(width, height)
+    level.generate_valid(trajectory, rng=np.random.RandomState(seed))
+    return level
+
+
+def publish_levels(channel, n_levels):
+    for i in range(n_levels):
+        channel.publish(random_level(seed=i % 4), float(i), path=[(i % 12, 1)] * (i % 5), generation=i)
+    channel.close()
+
+
+def test_publish_and_read():
+    channel = LatestLevelChannel(12, 10)
+    try:
+        assert channel.read() is None
+        level = random_level()
+        channel.publish(level, 42.0, path=[(1, 2), (2, 2)], generation=3)
+        assert channel.has_new()
+        read_level, fitness, path, generation = channel.read()
+        assert (read_level.cells == level.cells).all()
+        assert (fitness, path, generation) == (42.0, [(1, 2), (2, 2)], 3)
+        # A level is only read once.
+        assert not channel.has_new()
+        assert channel.read() is None
+    finally:
+        channel.close()
+
+
+def test_metrics_keep_unpublished_values():
+    channel = LatestLevelChannel(12, 10)
+    try:
+        assert all(math.isnan(value) for value in channel.read_metrics().values())
+        channel.publish_metrics(generations_per_second=2.0)
+        channel.publish_metrics(evaluations_per_second=5.0)
+        metrics = channel.read_metrics()
+        assert metrics['generations_per_second'] == 2.0 and metrics['evaluations_per_second'] == 5.0
+        assert math.isnan(metrics['cache_hit_rate'])
+    finally:
+        channel.close()
+
+
+def test_reads_are_consistent_while_another_process_publishes():
+    channel = LatestLevelChannel(12, 10)
+    levels = {seed: random_level(seed=seed).to_bytes() for seed in range(4)}
+    try:
+        # The writer attaches to the same shared memory (see `LatestLevelChannel.__reduce__()`).
+        writer = multiprocessing.get_context('spawn').Process(target=publish_levels, args=(channel, 2000))
+        writer.start()
+        n_read = 0
+        while writer.is_alive() or channel.has_new():
+            item = channel.read()
+            if item is not None:
+                level, fitness, path, generation = item
+                # Every field comes from the same publication.
+                assert fitness == generation
+                assert level.to_bytes() == levels[generation % 4]
+                assert path == [(generation % 12, 1)] * (generation % 5)
+                n_read += 1
+        writer.join()
+        assert writer.exitcode == 0
+        assert n_read > 0
+    finally:
+        channel.close()
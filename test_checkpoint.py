@@ -0,0 +1,56 @@
+import os
+import random
+
+import numpy as np
+
+from algorithm import Algorithm
+from checkpoint import checkpoint_trajectory, load_checkpoint
+from trajectory import RandomWalkTrajectory
+
+
+def make_algorithm(generations):
+    trajectory = RandomWalkTrajectory(12, 10, rng=random.Random(0))
+    return Algorithm(trajectory=trajectory, width=12, height=10, population_size=8, tournament_size=3,
+                     mutation_probability=0.05, generations=generations, chromosome_size=100,
+                     rng=np.random.RandomState(0))
+
+
+def population_state(algorithm):
+    return [(individual.individualID(), individual.getGenotype().pack(), individual.getFitness())
+            for individual in algorithm.population]
+
+
+def run(algorithm, **kwargs):
+    states = []
+    for level, fitness, solution in algorithm.run(**kwargs):
+        states.append((algorithm.generation, fitness, population_state(algorithm)))
+    return states
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / 'checkpoint.npz')
+    algorithm = make_algorithm(generations=2)
+    run(algorithm)
+    algorithm.checkpoint(path)
+    assert not os.path.exists(path + '.tmp')
+    checkpoint = load_checkpoint(path)
+    assert checkpoint_trajectory(checkpoint).same_as(algorithm.trajectory)
+    resumed = make_algorithm(generations=2)
+    resumed.resume(path)
+    assert resumed.generation == algorithm.generation
+    assert resumed.evaluations == algorithm.evaluations
+    assert population_state(resumed) == population_state(algorithm)
+    assert all(individual.evaluated for individual in resumed.population)
+
+
+def test_resume_reproduces_the_same_generations(tmp_path):
+    path = str(tmp_path / 'checkpoint.npz')
+    random.seed(0)
+    # Checkpointed once, when starting generation 4.
+    uninterrupted = run(make_algorithm(generations=6), checkpoint_path=path, checkpoint_period=4)
+    # The random states are restored too.
+    random.seed(1)
+    resumed = make_algorithm(generations=6)
+    resumed.resume(path)
+    assert resumed.generation == 4
+    assert run(resumed) == uninterrupted[4:]
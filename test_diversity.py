@@ -0,0 +1,64 @@
+import random
+
+import numpy as np
+
+from algorithm import Algorithm
+from diversity import DiversityFilter, packed_genomes, packed_hamming
+from evaluators import LocalEvaluator
+from trajectory import RandomWalkTrajectory
+
+
+def make_algorithm(**kwargs):
+    trajectory = RandomWalkTrajectory(12, 10, rng=random.Random(0))
+    return Algorithm(trajectory=trajectory, width=12, height=10, population_size=8, tournament_size=3,
+                     mutation_probability=0.01, generations=3, chromosome_size=100, rng=np.random.RandomState(0),
+                     **kwargs)
+
+
+def test_packed_hamming_counts_cells():
+    algorithm = make_algorithm()
+    algorithm.initializePopulation()
+    genomes = packed_genomes(algorithm.population)
+    distances = packed_hamming(genomes, genomes)
+    assert distances.shape == (8, 8)
+    assert (np.diag(distances) == 0).all()
+    cells = [individual.getGenotype().chromosomes for individual in algorithm.population[:2]]
+    assert distances[0, 1] == np.count_nonzero(np.asarray(cells[0]) != np.asarray(cells[1]))
+
+
+def test_duplicates_are_not_evaluated_again():
+    calls = []
+
+    def fitness(individual):
+        calls.append(individual)
+        # Only searched individuals (with search statistics) are archived.
+        individual.stats = dict(n_steps=1)
+        return 1.0
+
+    algorithm = make_algorithm()
+    algorithm.initializePopulation()
+    population = algorithm.population
+    evaluator = DiversityFilter(LocalEvaluator(fitness))
+    evaluator.evaluate(population[:4])
+    assert len(calls) == 4
+    evaluator.evaluate(population[:4] + population[:2])
+    assert len(calls) == 4
+    assert evaluator.n_cache_hits == 4
+    assert evaluator.n_clones == 2
+
+
+def test_empty_batch_with_archive():
+    algorithm = make_algorithm(dedup_distance=0)
+    next(algorithm.run())
+    assert algorithm.diversity.archive.size > 0
+    # Every individual is evaluated: nothing is left to evaluate.
+    algorithm.evaluatePopulation()
+    algorithm.diversity.evaluate([])
+
+
+def test_metrics_are_recorded():
+    records = []
+    algorithm = make_algorithm(dedup_distance=0)
+    list(algorithm.run(metrics_sink=records.append))
+    assert records and all('diversity' in record for record in records)
+    assert records[-1]['diversity']['unique'] <= len(algorithm.population)
@@ -0,0 +1,36 @@
+import random
+
+import numpy as np
+import pytest
+
+from algorithm import Algorithm
+from evaluators import AUTHKEY_VARIABLE, EvaluationServer
+from trajectory import RandomWalkTrajectory
+
+
+def run_fitnesses(evaluator=None, generations=3):
+    trajectory = RandomWalkTrajectory(12, 10, rng=random.Random(0))
+    algorithm = Algorithm(trajectory=trajectory, width=12, height=10, population_size=8, tournament_size=3,
+                          mutation_probability=0.01, generations=generations, chromosome_size=100,
+                          evaluator=evaluator, rng=np.random.RandomState(0))
+    fitnesses = [fitness for level, fitness, solution in algorithm.run()]
+    return fitnesses, algorithm
+
+
+def test_server_evaluates_like_local():
+    server = EvaluationServer()
+    server.start_local_workers(2)
+    try:
+        fitnesses, algorithm = run_fitnesses(server)
+        # Individuals deep copy the trajectory: its copies are all sent as the same trajectory.
+        assert len(server.trajectories) == 1
+        assert all(individual.evaluated and individual.solution is not None for individual in algorithm.population)
+    finally:
+        server.close()
+    assert fitnesses == run_fitnesses()[0]
+
+
+def test_server_requires_authkey_off_localhost(monkeypatch):
+    monkeypatch.delenv(AUTHKEY_VARIABLE, raising=False)
+    with pytest.raises(ValueError):
+        EvaluationServer(address=('0.0.0.0', 0))
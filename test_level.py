@@ -0,0 +1,43 @@
+import pickle
+import random
+
+import numpy as np
+
+from level import CellType, Level, pack_cells, unpack_cells
+from trajectory import RandomWalkTrajectory
+
+
+def random_level(width=13, height=9, seed=0):
+    trajectory = RandomWalkTrajectory(width, height, rng=random.Random(seed))
+    level = Level(width, height)
+    level.generate_valid(trajectory, rng=np.random.RandomState(seed))
+    return level
+
+
+def test_pack_cells_round_trip():
+    rng = np.random.RandomState(0)
+    for count in (0, 1, 2, 7, 8, 117):
+        cells = rng.randint(len(CellType), size=count).astype(np.uint8)
+        data = pack_cells(cells)
+        assert len(data) == (count + 1) // 2
+        assert (unpack_cells(data, count) == cells).all()
+
+
+def test_level_bytes_round_trip():
+    # An odd number of cells leaves half a byte of padding.
+    level = random_level()
+    copy = Level.from_bytes(level.to_bytes())
+    assert (copy.width, copy.height) == (level.width, level.height)
+    assert copy.cells.dtype == Level.dtype
+    assert (copy.cells == level.cells).all()
+    assert copy.start == level.start and copy.exit == level.exit
+    assert copy.content_hash() == level.content_hash()
+
+
+def test_level_pickles_in_packed_format():
+    level = random_level()
+    data = pickle.dumps(level)
+    assert level.to_bytes() in data
+    copy = pickle.loads(data)
+    assert (copy.cells == level.cells).all()
+    assert copy.start == level.start and copy.exit == level.exit
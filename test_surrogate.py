@@ -0,0 +1,52 @@
+import random
+
+import numpy as np
+
+from algorithm import Algorithm
+from evaluators import LocalEvaluator
+from surrogate import SurrogateScreen
+from trajectory import RandomWalkTrajectory
+
+
+def make_algorithm(evaluator=None, **kwargs):
+    trajectory = RandomWalkTrajectory(12, 10, rng=random.Random(0))
+    return Algorithm(trajectory=trajectory, width=12, height=10, population_size=8, tournament_size=3,
+                     mutation_probability=0.05, generations=4, chromosome_size=100, evaluator=evaluator,
+                     rng=np.random.RandomState(0), **kwargs)
+
+
+def counting_evaluator(calls):
+    def fitness(individual):
+        calls.append(id(individual))
+        individual.stats = dict(n_steps=1)
+        return float(len(calls))
+    return LocalEvaluator(fitness)
+
+
+def test_only_candidates_are_screened():
+    calls = []
+    screen = SurrogateScreen(counting_evaluator(calls), threshold=np.inf)
+    algorithm = make_algorithm()
+    algorithm.initializePopulation()
+    candidate, elite = algorithm.population[:2]
+    elite.setFitness(5.0)
+    # A mutated elite is no candidate: it always gets a full evaluation.
+    elite.evaluated = False
+    screen.evaluate([candidate, elite])
+    assert calls == [id(elite)]
+    assert candidate.getFitness() == 0 and candidate.stats is None
+    assert candidate.evaluated and not candidate.candidate
+    assert screen.n_screened == 1 and screen.n_kept == 0
+
+
+def test_evaluated_individuals_are_not_evaluated_again():
+    calls = []
+    algorithm = make_algorithm(screen_fraction=0.5)
+    algorithm.evaluator.evaluator = counting_evaluator(calls)
+    for level, fitness, solution in algorithm.run():
+        assert all(individual.evaluated for individual in algorithm.population)
+    fitnesses = [(id(individual), individual.getFitness()) for individual in algorithm.population]
+    n_calls = len(calls)
+    algorithm.evaluatePopulation()
+    assert len(calls) == n_calls
+    assert [(id(individual), individual.getFitness()) for individual in algorithm.population] == fitnesses
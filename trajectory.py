@@ -1,6 +1,7 @@
 import random
 
 from level import CellType, Level, EmptyCell, BlockCell, StartPositionCell, ExitCell, TrajectoryCell
+from level import LEVEL_WIDTH, LEVEL_HEIGHT
 from world import Action
 
 def pos_add(a, b):
@@ -21,7 +22,27 @@ class Trajectory():
         self.level_height = level_height
         self.actions = []
         self.start = (1,1)
-        
+
+    @classmethod
+    def from_actions(cls, level_width, level_height, start, actions):
+        """
+        Rebuild a trajectory from its start position and actions (e.g. as saved in a checkpoint or corpus).
+        """
+        trajectory = Trajectory(level_width, level_height)
+        trajectory.start = (int(start[0]), int(start[1]))
+        trajectory.actions = [Action(int(action)) for action in actions]
+        return trajectory
+
+    def key(self):
+        """
+        Hashable content of the trajectory: copies of a trajectory (e.g. deep copies made with the individuals) have the
+        same key.
+        """
+        return self.level_width, self.level_height, tuple(self.start), tuple(self.actions)
+
+    def same_as(self, other):
+        return self.key() == other.key()
+
     def get_traversed_cells(self):
         cells = { self.start }
         pos = self.start
@@ -61,9 +82,12 @@ class Trajectory():
 
 
 class TrivialTrajectory(Trajectory):
-    def __init__(self, level_width, level_height, min_length = 2, max_length = None):
+    def __init__(self, level_width, level_height, min_length = 2, max_length = None, rng = None):
         super().__init__(level_width, level_height)
 
+        if rng is None:
+            rng = random
+
         length_limit = self.level_width-3
         if min_length is None:
             min_length = 1
@@ -76,20 +100,23 @@ class TrivialTrajectory(Trajectory):
             raise ValueError("Max length < min length")
             return
 
-        length = random.randint(min_length, max_length)
-        y = random.randint(1, self.level_height-2)
+        length = rng.randint(min_length, max_length)
+        y = rng.randint(1, self.level_height-2)
         self.start = (1,y)
         for i in range(length):
             self.actions.append(Action.RIGHT);
 
 class SimpleTrajectory(Trajectory):
-    def __init__(self, level_width, level_height):
+    def __init__(self, level_width, level_height, rng = None):
         super().__init__(level_width, level_height)
 
-        start = (random.randint(1,self.level_width-2), random.randint(1,self.level_height-2))
+        if rng is None:
+            rng = random
+
+        start = (rng.randint(1,self.level_width-2), rng.randint(1,self.level_height-2))
         end = start
         while start == end:
-            end = (random.randint(1,self.level_width-2), random.randint(1,self.level_height-2))
+            end = (rng.randint(1,self.level_width-2), rng.randint(1,self.level_height-2))
 
         self.start = start
         x_dir = Action.RIGHT if start[0] < end[0] else Action.LEFT
@@ -101,74 +128,132 @@ class SimpleTrajectory(Trajectory):
             self.actions.append(y_dir)
     
 class RandomWalkTrajectory(Trajectory):
-    def __init__(self, level_width, level_height, max_length = None):
+    # Occupancy values used by the walk bitmap.
+    FREE = 0
+    WALL = 1
+    PATH = 2
+
+    # Border templates, cached per level size.
+    _templates = {}
+
+    def __init__(self, level_width, level_height, max_length = None, rng = None, max_backtracks = None):
         super().__init__(level_width, level_height)
 
         if max_length is None:
             max_length = self.level_width + self.level_height
+        if rng is None:
+            rng = random
 
-        level = Level(level_width, level_height)
-        self.start = (random.randint(1,self.level_width-2), random.randint(1,self.level_height-2))
-        self.actions = self.generate_path(level, self.start, max_length)
-
-    def generate_path(self, level, pos, max_length):
-        level.set(pos, CellType.TRAJECTORY)
-
-        if max_length == 1:
-            return []
-        else:
-            actions = [Action.LEFT, Action.RIGHT, Action.UP, Action.DOWN]
-            random.shuffle(actions)
-            # try a random move
-            for action in actions:
-                offset = self.offsets[action]
-                next_pos = pos_add(pos, offset)
-                # skip if it leads into a wall
-                cell = level.get_cell(*next_pos)
-                if type(cell) is BlockCell:
+        self.start = (rng.randint(1,self.level_width-2), rng.randint(1,self.level_height-2))
+        self.actions = self.generate_path(self.start, max_length, rng, max_backtracks)
+
+    @classmethod
+    def generate_many(cls, n, rng = None, level_width = LEVEL_WIDTH, level_height = LEVEL_HEIGHT, max_length = None,
+                      max_backtracks = None):
+        """
+        Yield `n` independent random walks, e.g. to pick a good seed trajectory for a large map.
+        """
+        for i in range(n):
+            yield cls(level_width, level_height, max_length=max_length, rng=rng, max_backtracks=max_backtracks)
+
+    def _empty_bitmap(self):
+        key = (self.level_width, self.level_height)
+        template = self._templates.get(key)
+        if template is None:
+            w, h = key
+            template = bytearray(w * h)
+            for x in range(w):
+                template[x] = template[(h - 1) * w + x] = self.WALL
+            for y in range(h):
+                template[y * w] = template[y * w + w - 1] = self.WALL
+            self._templates[key] = template
+        return bytearray(template)
+
+    def generate_path(self, pos, max_length, rng = random, max_backtracks = None):
+        """
+        Grow a non-touching random walk of at most `max_length` cells starting at `pos`.
+
+        The walk is iterative with an explicit stack. Dead ends are backtracked at most `max_backtracks` times (by
+        default `max_length`), after which the longest walk found so far is returned.
+        """
+        if max_backtracks is None:
+            max_backtracks = max_length
+        w = self.level_width
+        deltas = {Action.LEFT: -1, Action.RIGHT: 1, Action.UP: -w, Action.DOWN: w}
+        directions = list(deltas)
+
+        cells = self._empty_bitmap()
+        current = pos[1] * w + pos[0]
+        cells[current] = self.PATH
+        positions = [current]
+        actions = []
+        candidates = directions[:]
+        rng.shuffle(candidates)
+        # One list of untried actions per cell of the walk.
+        stack = [candidates]
+        best = []
+        backtracks = 0
+
+        while len(actions) < max_length - 1:
+            current = positions[-1]
+            candidates = stack[-1]
+            moved = False
+            while candidates:
+                action = candidates.pop()
+                next_pos = current + deltas[action]
+                # skip if it leads into a wall or back onto the walk
+                if cells[next_pos] != self.FREE:
+                    continue
+                # the new cell must not touch the walk anywhere but where we come from
+                if any(cells[next_pos + delta] == self.PATH for delta in deltas.values()
+                       if next_pos + delta != current):
                     continue
-                
-                # get a list of all neighbors
-                neighbors = set(actions) - { self.opposites[action] }
-                
-                # check all neighbors
-                all_clear = True
-                for neighbor_action in neighbors:
-                    neighbor = pos_add(next_pos, self.offsets[neighbor_action])
-                    cell = level.get_cell(*neighbor)
-                    all_clear &= (type(cell) is not TrajectoryCell)
-                # if all neighbors are good, keep going
-                if all_clear:
-                    path = self.generate_path(level, next_pos, max_length-1)
-                    if path is not None:
-                        return [action] + path
-            # none of the moves was successful
-            level.set(pos, CellType.EMPTY)
-            return []
+                cells[next_pos] = self.PATH
+                positions.append(next_pos)
+                actions.append(action)
+                candidates = directions[:]
+                rng.shuffle(candidates)
+                stack.append(candidates)
+                moved = True
+                break
+
+            if not moved:
+                # dead end: remember the walk so far, then backtrack one cell
+                if len(actions) > len(best):
+                    best = actions[:]
+                if not actions or backtracks >= max_backtracks:
+                    return best
+                backtracks += 1
+                cells[positions.pop()] = self.FREE
+                actions.pop()
+                stack.pop()
+
+        return actions
 
 class RandomCrossWalk(Trajectory):
-    def __init__(self, level_width, level_height, max_length = None, min_segment = 2, max_segment = 8):
+    def __init__(self, level_width, level_height, max_length = None, min_segment = 2, max_segment = 8, rng = None):
         super().__init__(level_width, level_height)
 
         if max_length is None:
             max_length = self.level_width + self.level_height
+        if rng is None:
+            rng = random
 
-        self.start = (random.randint(1, level_width-2), random.randint(1, level_height-2))
-        self.actions = self.generate_crossing_path(self.start, max_length, min_segment, max_segment, level_width, level_height)
+        self.start = (rng.randint(1, level_width-2), rng.randint(1, level_height-2))
+        self.actions = self.generate_crossing_path(self.start, max_length, min_segment, max_segment, level_width, level_height, rng = rng)
 
 
-    def generate_crossing_path(self, pos, max_length, min_segment, max_segment, max_width, max_height, is_horizontal = True):
+    def generate_crossing_path(self, pos, max_length, min_segment, max_segment, max_width, max_height, is_horizontal = True, rng = random):
         horizontal_actions = [Action.LEFT, Action.RIGHT]
-        random.shuffle(horizontal_actions)
+        rng.shuffle(horizontal_actions)
 
         vertical_actions = [Action.UP, Action.DOWN]
-        random.shuffle(vertical_actions)
+        rng.shuffle(vertical_actions)
 
         path = []
 
         for i in range(100):
-            length = random.randint(min_segment, max_segment)
-            print (i, length, max_length)
+            length = rng.randint(min_segment, max_segment)
 
             actions = horizontal_actions if is_horizontal else vertical_actions
             action = actions[i % 2]
@@ -1,5 +1,8 @@
 from enum import IntEnum
-from level import BlockCell, CellType, CheeseCell, EmptyCell, ExitCell, IceCell, StartPositionCell, TornadoCell, WineCell
+
+import numpy as np
+
+from level import CellType, TrajectoryCell
 
 class Action(IntEnum):
     LEFT = 0
@@ -40,25 +43,21 @@ class World(object):
 
     def init(self):
         # Initialization: analyze the level to build the initial state.
+        # Cells are scanned column by column, i.e. in the same order as `Level.enumerate_cells()`.
+        columns = self.level.cells.T
+        if (columns == CellType.TRAJECTORY).any():
+            raise NotImplementedError(TrajectoryCell)
         # First get the state of stateful cells.
         self.init_state = []
-        for pos, cell in self.level.enumerate_cells():
-            if cell.has_state():
-                self.init_state.append(cell.get_state())
-            self.item_idx[pos] = len(self.init_state) - 1
+        items = np.argwhere((columns == CellType.WINE) | (columns == CellType.CHEESE))
+        for x, y in items.tolist():
+            self.init_state.append(True)
+            self.item_idx[x, y] = len(self.init_state) - 1
 
         # Add player position.
-        for pos, cell in self.level.enumerate_cells():
-            if isinstance(cell, StartPositionCell):
-                self.init_state.append(pos)
-                self.player_position_idx = len(self.init_state) - 1
-            elif isinstance(cell, (BlockCell, EmptyCell, ExitCell, TornadoCell, IceCell)):
-                # Ignore.
-                pass
-            elif isinstance(cell, (WineCell, CheeseCell)):
-                pass
-            else:
-                raise NotImplementedError(type(cell))
+        for x, y in np.argwhere(columns == CellType.START).tolist():
+            self.init_state.append((x, y))
+            self.player_position_idx = len(self.init_state) - 1
         assert self.player_position_idx is not None
         # Add weight.
         self.init_state.append(INIT_WEIGHT)
@@ -102,6 +101,25 @@ class World(object):
             new_state[self.item_idx[pos]] = False
         return tuple(new_state)
 
+    def trajectory_weights(self, trajectory):
+        """
+        Follow `trajectory` from the initial state.
+
+        :return: The list of `(position, weight)` pairs giving the player's weight when entering each position along
+            the trajectory (the start position excluded). The walk stops at the first invalid move.
+        """
+        state = self.init_state
+        assert state is not None
+        profile = []
+        for action in trajectory.actions:
+            weight = state[self.weight_idx]
+            new_state = self.perform(state, action)
+            if new_state is None:
+                break
+            state = new_state
+            profile.append((self.get_player_position(state), weight))
+        return profile
+
     def validate_trajectory(self, trajectory):
         state = self.init_state
         assert state is not None